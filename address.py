@@ -0,0 +1,123 @@
+import socket
+
+
+def reverse_name(packed):
+    """ Returns the reverse lookup name of a packed ipv4 or ipv6 address"""
+    if len(packed) == 4:
+        return '{3}.{2}.{1}.{0}.in-addr.arpa'.format(*packed).encode('ascii')
+    return '.'.join(reversed(packed.hex())).encode('ascii') + b'.ip6.arpa'
+
+
+def parse_reverse_name(name):
+    """ Returns the packed address of the reverse lookup name of one single
+        address, None for all other names (e.g. of subnets)"""
+    labels = name.lower().split(b'.')
+    try:
+        if len(labels) == 6 and labels[4:] == [b'in-addr', b'arpa']:
+            packed = bytes(int(label) for label in reversed(labels[:4]))
+        elif len(labels) == 34 and labels[32:] == [b'ip6', b'arpa'] \
+                and all(len(label) == 1 for label in labels[:32]):
+            packed = bytes.fromhex(b''.join(reversed(labels[:32]))
+                                   .decode('ascii'))
+        else:
+            return None
+    except ValueError:
+        return None
+    if reverse_name(packed) != name.lower():  # e.g. leading zeros
+        return None
+    return packed
+
+
+def reverse_name_range(name):
+    """ Returns the lowest and the highest packed address whose reverse
+        lookup names are below or equal to the given (partial) reverse lookup
+        name (e.g. ``100.51.198.in-addr.arpa``), None for all other names"""
+    labels = name.lower().split(b'.')
+    if labels[-2:] == [b'in-addr', b'arpa'] and len(labels) <= 6:
+        try:
+            prefix = bytes(int(label) for label in reversed(labels[:-2]))
+        except ValueError:
+            return None
+        if b'.'.join(str(octet).encode('ascii') for octet in
+                     reversed(prefix)) != b'.'.join(labels[:-2]):
+            return None  # e.g. leading zeros
+        padding = 4 - len(prefix)
+        return prefix + b'\x00' * padding, prefix + b'\xff' * padding
+    if labels[-2:] == [b'ip6', b'arpa'] and len(labels) <= 34:
+        if not all(len(label) == 1 for label in labels[:-2]):
+            return None
+        nibbles = b''.join(reversed(labels[:-2])).decode('ascii')
+        padding = 32 - len(nibbles)
+        try:
+            return (bytes.fromhex(nibbles + '0' * padding),
+                    bytes.fromhex(nibbles + 'f' * padding))
+        except ValueError:
+            return None
+    return None
+
+
+class Address(object):
+    """ Compact representation of one single (client) ip address.
+
+        Only the packed form is stored, the textual form and the reverse
+        lookup name are computed on access.
+
+        :param bytes packed: address in network byte order (4 bytes for ipv4,
+            16 bytes for ipv6)"""
+    __slots__ = ('version', 'packed')
+
+    def __init__(self, packed):
+        if len(packed) == 4:
+            self.version = 4
+        elif len(packed) == 16:
+            self.version = 6
+        else:
+            raise ValueError('Invalid packed address {0!r}'.format(packed))
+        self.packed = packed
+
+    @property
+    def text(self):
+        return socket.inet_ntop(socket.AF_INET if self.version == 4
+                                else socket.AF_INET6, self.packed)
+
+    @property
+    def reverse(self):
+        return reverse_name(self.packed)
+
+    @classmethod
+    def parse(cls, text):
+        """ Parses the textual form of a single ipv4 or ipv6 address.
+
+            :raises ValueError: text is not a valid address"""
+        family = socket.AF_INET6 if ':' in text else socket.AF_INET
+        try:
+            return cls(socket.inet_pton(family, text))
+        except OSError:
+            raise ValueError('Invalid ip address {0!r}'.format(text))
+
+    def __int__(self):
+        return int.from_bytes(self.packed, 'big')
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return 'Address({0!r})'.format(self.text)
+
+    def __eq__(self, other):
+        if other.__class__ is not Address:
+            return NotImplemented
+        return self.packed == other.packed
+
+    def __ne__(self, other):
+        if other.__class__ is not Address:
+            return NotImplemented
+        return self.packed != other.packed
+
+    def __lt__(self, other):
+        if other.__class__ is not Address:
+            return NotImplemented
+        return (self.version, self.packed) < (other.version, other.packed)
+
+    def __hash__(self):
+        return hash(self.packed)
@@ -0,0 +1,96 @@
+""" Compares the change detection of InMemoryAuthority on large zones: the
+    former record-by-record comparison against the digest comparison
+    (including the digest computation, which is done once per build)."""
+import argparse
+import ipaddress
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from twisted.names import dns  # noqa: E402
+
+from openvpnzone import InMemoryAuthority, ZoneRecords  # noqa: E402
+
+
+def nested_loop_changed(old_records, records):
+    """ The change detection used before digests were introduced"""
+    if len(old_records) != len(records):
+        return True
+    for name in old_records:
+        if name not in records:
+            return True
+        if len(old_records[name]) != len(records[name]):
+            return True
+        for record in old_records[name]:
+            for new_record in records[name]:
+                if new_record == record:
+                    break
+                if new_record.__class__ is dns.Record_SOA and \
+                        record.__class__ is dns.Record_SOA and \
+                        new_record.mname == record.mname and \
+                        new_record.rname == record.rname and \
+                        new_record.refresh == record.refresh and \
+                        new_record.retry == record.retry and \
+                        new_record.expire == record.expire and \
+                        new_record.minimum == record.minimum:
+                    break
+            else:
+                return True
+    return False
+
+
+def make_zone(count, serial, changed=0):
+    """ Zone with ``count`` records, one A (and for every second name one
+        AAAA) record per name; the last ``changed`` names get other
+        addresses"""
+    soa = dns.Record_SOA(mname='dns.example.org', rname='admin.example.org',
+                         serial=serial, refresh='1h', retry='2h',
+                         expire='3h', minimum='4h')
+    records = ZoneRecords()
+    records[b'vpn.example.org'].append(soa)
+    number = 0
+    while number < count:
+        name = 'client{0}.vpn.example.org'.format(number).encode('ascii')
+        offset = 1 if number >= count - changed else 0
+        records[name].append(dns.Record_A('10.{0}.{1}.{2}'.format(
+            number >> 16 & 255, number >> 8 & 255, (number + offset) & 255)))
+        if number % 2 == 0:
+            records[name].append(dns.Record_AAAA(
+                str(ipaddress.IPv6Address(0xfd00 << 112 | number + offset))))
+            number += 1
+        number += 1
+    return soa, records
+
+
+def timed(callback):
+    start = time.perf_counter()
+    result = callback()
+    return result, time.perf_counter() - start
+
+
+def run(count, changed):
+    soa, old = make_zone(count, 1)
+    soa2, new = make_zone(count, 2, changed)
+    result, nested = timed(lambda: nested_loop_changed(old, new))
+    _, digests = timed(lambda: (old.update_digests(), new.update_digests()))
+    authority = InMemoryAuthority()
+    authority.setData((b'vpn.example.org', soa), old)
+    result2, compare = timed(lambda: authority.changed((b'vpn.example.org', soa2), new))
+    assert result == result2
+    _, names = timed(lambda: old.changed_names(new))
+    print('{0:>8} records {1:>6} changed  nested loop {2:8.2f} ms  digest compare'
+          ' {3:8.4f} ms  changed names {4:8.2f} ms  (digest computation {5:8.2f} ms'
+          ' per zone)'.format(count, changed, nested * 1000, compare * 1000,
+                              names * 1000, digests / 2 * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--records', type=int, nargs='+', default=[100000])
+    parser.add_argument('--changed', type=int, nargs='+', default=[0, 1, 1000])
+    args = parser.parse_args()
+    for count in args.records:
+        for changed in args.changed:
+            run(count, changed)
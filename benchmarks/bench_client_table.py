@@ -0,0 +1,71 @@
+""" Memory of the client records of one instance: the compact client table
+    against the same zones materialized into lists of record objects (the
+    layout before the client table)::
+
+        python benchmarks/bench_client_table.py --clients 100000"""
+import argparse
+import contextlib
+import gc
+import io
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from config import ConfigParser  # noqa: E402
+from openvpnzone import (AuthorityTuple, InMemoryAuthority,  # noqa: E402
+                         OpenVpnAuthorityHandler, ZoneRecords)
+from statusfile import extract_zones_from_status_file  # noqa: E402
+import generate  # noqa: E402
+
+
+def allocated(build):
+    """ Returns the result of build and the memory still allocated by it"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        gc.collect()
+        return result, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def materialize(authorities):
+    return [ZoneRecords(dict(authority.records.items())).update_digests()
+            for authority in authorities]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=100000)
+    parser.add_argument('--ipv6-every', type=int, default=2)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        path = generate.write_instances(directory, args.clients,
+                                        ipv6_every=args.ipv6_every)
+        with contextlib.redirect_stdout(io.StringIO()):
+            handler = OpenVpnAuthorityHandler(ConfigParser(path))
+        instance = next(iter(handler.config.instances.values()))
+        clients = extract_zones_from_status_file(instance.status_file)
+        handler.authorities[instance.name] = AuthorityTuple(
+            InMemoryAuthority(), InMemoryAuthority(), InMemoryAuthority())
+
+        def build():
+            with contextlib.redirect_stdout(io.StringIO()):
+                handler.build_zone_from_clients(instance, clients)
+            return handler.authorities[instance.name]
+        authorities, compact = allocated(build)
+        records, listed = allocated(lambda: materialize(authorities))
+    names = sum(len(zone) for zone in records)
+    print('{0} clients, {1} names'.format(args.clients, names))
+    print('client table   {0:8.1f} MiB  {1:6.0f} bytes/name'.format(
+        compact / 2**20, compact / names))
+    print('record objects {0:8.1f} MiB  {1:6.0f} bytes/name'.format(
+        listed / 2**20, listed / names))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+""" Compares parsing the same clients in status-version 1, 2 and 3 format.
+
+    "rows" measures the extraction of the row fingerprints only, "full" a
+    complete first pass including the address parsing."""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from statusfile import StatusFile, detect_version  # noqa: E402
+import generate  # noqa: E402
+
+
+def best_of(repeat, callback):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        callback()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run(clients_count, repeat):
+    clients = generate.make_clients(clients_count)
+    with tempfile.TemporaryDirectory() as tmp:
+        for version, formatter in sorted(generate.FORMATTERS.items()):
+            path = os.path.join(tmp, 'status-v{0}'.format(version))
+            generate.write_status_file(path, clients, formatter)
+            status = StatusFile(path)
+            data = status.read()
+            assert detect_version(data) == version
+
+            def rows():
+                status.split_rows(data, version)
+
+            def full():
+                StatusFile(path).update()
+            print('v{0}  {1:>8} clients  {2:>9} bytes  rows {3:8.2f} ms'
+                  '  full {4:8.2f} ms'.format(
+                      version, clients_count, len(data),
+                      best_of(repeat, rows) * 1000,
+                      best_of(repeat, full) * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, nargs='+', default=[50000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    for count in args.clients:
+        run(count, args.repeat)
@@ -0,0 +1,377 @@
+""" End-to-end load test: starts openvpn2dns (``OpenVpn2DnsApplication``
+    via the openvpn2dns script) with a generated status file on a loopback
+    port, sends a mix of queries over UDP at a target rate (and closed-loop
+    over TCP connections), rewrites the status file during the run and
+    reports the answered queries per second, the latency percentiles and the
+    loss - overall and for the queries sent shortly after the rewrite::
+
+        python benchmarks/bench_load.py --clients 100000 --rate 20000 \\
+            --mix A=50,AAAA=20,PTR=20,SOA=5,NXDOMAIN=5 --tcp-connections 2
+
+    The load generator itself is written in Python: compare the achieved send
+    rate with the target rate to recognize when the generator (and not the
+    server) is the bottleneck."""
+import argparse
+import array
+import collections
+import ipaddress
+import json
+import os
+import random
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from twisted.names import dns  # noqa: E402
+
+import generate  # noqa: E402
+
+
+ZONE = 'vpn0.example.org'
+QUERY_KINDS = ('A', 'AAAA', 'PTR', 'SOA', 'NXDOMAIN')
+RCODES = {0: 'NOERROR', 1: 'FORMERR', 2: 'SERVFAIL', 3: 'NXDOMAIN',
+          4: 'NOTIMP', 5: 'REFUSED'}
+
+
+def parse_mix(value):
+    """ Parses a query mix like ``A=60,PTR=30,NXDOMAIN=10``"""
+    mix = {}
+    for entry in value.split(','):
+        kind, weight = entry.split('=', 1)
+        kind = kind.strip().upper()
+        if kind not in QUERY_KINDS:
+            raise argparse.ArgumentTypeError('unknown query kind ' + kind)
+        mix[kind] = float(weight)
+    return mix
+
+
+def encode_query(name, type):
+    message = dns.Message(id=0)
+    message.queries = [dns.Query(name.encode('ascii'), type, dns.IN)]
+    return bytearray(message.toStr())
+
+
+def make_queries(clients, mix, count, seed=42):
+    """ Returns ``count`` encoded queries (id 0) following the mix"""
+    rng = random.Random(seed)
+    ipv6_clients = [client for client in clients
+                    if any(':' in address for address in client[1])]
+
+    def make(kind):
+        if kind == 'SOA':
+            return encode_query(ZONE, dns.SOA)
+        if kind == 'NXDOMAIN':
+            return encode_query('unknown{0}.{1}'.format(
+                rng.randrange(10**6), ZONE), dns.A)
+        if kind == 'AAAA':
+            return encode_query(rng.choice(ipv6_clients)[0], dns.AAAA)
+        name, addresses = rng.choice(clients)
+        if kind == 'PTR':
+            return encode_query(ipaddress.ip_address(addresses[0])
+                                .reverse_pointer, dns.PTR)
+        return encode_query(name, dns.A)
+    kinds = rng.choices(sorted(mix), [mix[kind] for kind in sorted(mix)],
+                        k=count)
+    return [make(kind) for kind in kinds]
+
+
+def free_port():
+    """ Returns a loopback port that is free for UDP and TCP"""
+    while True:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp:
+            udp.bind(('127.0.0.1', 0))
+            port = udp.getsockname()[1]
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp:
+                try:
+                    tcp.bind(('127.0.0.1', port))
+                except OSError:
+                    continue
+                return port
+
+
+def wait_ready(address, process, timeout=60):
+    """ Waits until the server answers SOA queries of the zone"""
+    query = encode_query(ZONE, dns.SOA)
+    deadline = time.time() + timeout
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client:
+        client.settimeout(0.2)
+        while time.time() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError('server exited with {0}'
+                                   .format(process.returncode))
+            client.sendto(query, address)
+            try:
+                data = client.recv(4096)
+            except socket.timeout:
+                continue
+            if struct.unpack_from('!H', data, 2)[0] & 0xf == 0:
+                return
+            time.sleep(0.2)
+    raise RuntimeError('server did not start within {0} s'.format(timeout))
+
+
+class UdpLoad(object):
+    """ Open-loop UDP load: queries are sent at the target rate regardless
+        of the responses. The query id indexes the send time stamps, so at
+        most 65536 queries may be outstanding."""
+    def __init__(self, address, queries, rate, duration, timeout):
+        self.queries = queries
+        self.rate = rate
+        self.duration = duration
+        self.timeout = timeout
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2**22)
+        self.socket.connect(address)
+        self.sent_at = [0.0] * 65536
+        self.send_times = array.array('d')
+        self.sent = 0
+        self.samples = []  # (send time, latency)
+        self.rcodes = collections.Counter()
+        self.done = threading.Event()
+
+    def send(self, start):
+        queries, count = self.queries, len(self.queries)
+        sent_at, send = self.sent_at, self.socket.send
+        send_times = self.send_times
+        perf_counter = time.perf_counter
+        while True:
+            elapsed = perf_counter() - start
+            if elapsed >= self.duration:
+                break
+            due = int(elapsed * self.rate)
+            while self.sent < due:
+                query_id = self.sent & 0xffff
+                data = queries[self.sent % count]
+                struct.pack_into('!H', data, 0, query_id)
+                sent_at[query_id] = perf_counter()
+                send_times.append(sent_at[query_id])
+                try:
+                    send(data)
+                except BlockingIOError:
+                    pass  # counted as loss
+                self.sent += 1
+            time.sleep(0.0005)
+
+    def receive(self):
+        self.socket.settimeout(0.1)
+        sent_at, samples, rcodes = self.sent_at, self.samples, self.rcodes
+        perf_counter = time.perf_counter
+        while not self.done.is_set():
+            try:
+                data = self.socket.recv(4096)
+            except socket.timeout:
+                continue
+            now = perf_counter()
+            query_id, flags = struct.unpack_from('!HH', data)
+            sent = sent_at[query_id]
+            if sent and now - sent <= self.timeout:
+                sent_at[query_id] = 0.0
+                samples.append((sent, now - sent))
+                rcodes[RCODES.get(flags & 0xf, flags & 0xf)] += 1
+
+
+class TcpLoad(object):
+    """ Closed-loop load over one persistent TCP connection"""
+    def __init__(self, address, queries, duration):
+        self.address = address
+        self.queries = queries
+        self.duration = duration
+        self.sent = 0
+        self.samples = []
+        self.rcodes = collections.Counter()
+
+    def receive_exactly(self, connection, length):
+        data = b''
+        while len(data) < length:
+            chunk = connection.recv(length - len(data))
+            if not chunk:
+                raise EOFError('connection closed by server')
+            data += chunk
+        return data
+
+    def run(self, start):
+        connection = socket.create_connection(self.address)
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        perf_counter = time.perf_counter
+        with connection:
+            while perf_counter() - start < self.duration:
+                data = self.queries[self.sent % len(self.queries)]
+                struct.pack_into('!H', data, 0, self.sent & 0xffff)
+                sent = perf_counter()
+                connection.sendall(struct.pack('!H', len(data)) + data)
+                self.sent += 1
+                length = struct.unpack('!H', self.receive_exactly(
+                    connection, 2))[0]
+                response = self.receive_exactly(connection, length)
+                self.samples.append((sent, perf_counter() - sent))
+                flags = struct.unpack_from('!H', response, 2)[0]
+                self.rcodes[RCODES.get(flags & 0xf, flags & 0xf)] += 1
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def summarize(samples, sent, duration, rcodes=None):
+    latencies = sorted(latency for sent_at, latency in samples)
+    result = {
+        'sent': sent,
+        'answered': len(latencies),
+        'qps': len(latencies) / duration,
+        'loss': (sent - len(latencies)) / sent if sent else 0.0,
+    }
+    if latencies:
+        result.update({
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'p999_ms': percentile(latencies, 0.999) * 1000,
+            'max_ms': latencies[-1] * 1000,
+        })
+    if rcodes is not None:
+        result['rcodes'] = dict(rcodes)
+    return result
+
+
+def print_summary(label, summary):
+    print('{0:>22}: {1:9.0f} qps  {2:8} sent  loss {3:7.3%}  p50 {4:7.2f} ms'
+          '  p99 {5:7.2f} ms  p999 {6:7.2f} ms  max {7:7.2f} ms'.format(
+              label, summary['qps'], summary['sent'], summary['loss'],
+              summary.get('p50_ms', 0), summary.get('p99_ms', 0),
+              summary.get('p999_ms', 0), summary.get('max_ms', 0)))
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as directory:
+        port = free_port()
+        address = ('127.0.0.1', port)
+        options = dict(ipv6_every=args.ipv6_every,
+                       cached_every=args.cached_every)
+        server_options = [('workers', args.workers)] if args.workers else []
+        config = generate.write_instances(
+            directory, args.clients, listen='127.0.0.1:{0}'.format(port),
+            server_options=server_options, **options)
+        status_path = os.path.join(directory, ZONE + '.status')
+        os.utime(status_path, (1000, 1000))
+        clients = generate.make_clients(args.clients, domain=ZONE, **options)
+        queries = make_queries(clients, args.mix, args.distinct_queries)
+
+        log_path = os.path.join(directory, 'server.log')
+        with open(log_path, 'w') as log:
+            server = subprocess.Popen(
+                [sys.executable, os.path.join(ROOT, 'openvpn2dns'), config,
+                 '--log', '-'], stdout=log, stderr=subprocess.STDOUT, cwd=ROOT)
+        try:
+            try:
+                wait_ready(address, server)
+            except RuntimeError:
+                with open(log_path) as log:
+                    sys.stderr.write(log.read())
+                raise
+            udp = UdpLoad(address, queries, args.rate, args.duration,
+                          args.timeout)
+            tcp = [TcpLoad(address, queries, args.duration)
+                   for _ in range(args.tcp_connections)]
+            rewrites = []
+
+            def rewrite():
+                rewrites.append(time.perf_counter())
+                generate.write_status_file(
+                    status_path, generate.churn(clients, args.churn))
+                os.utime(status_path, (2000, 2000))
+
+            start = time.perf_counter()
+            threads = [threading.Thread(target=udp.receive)]
+            threads += [threading.Thread(target=load.run, args=(start, ))
+                        for load in tcp]
+            for thread in threads:
+                thread.start()
+            timer = threading.Timer(args.rewrite_at, rewrite)
+            if args.rewrite_at < args.duration:
+                timer.start()
+            if args.rate:
+                udp.send(start)
+            else:
+                time.sleep(args.duration)
+            for thread in threads[1:]:
+                thread.join()
+            time.sleep(args.timeout)
+            udp.done.set()
+            threads[0].join()
+            timer.cancel()
+        finally:
+            server.terminate()
+            server.wait()
+
+    report = {
+        'parameters': {name: value for name, value in vars(args).items()
+                       if name != 'output'},
+        'udp': summarize(udp.samples, udp.sent, args.duration, udp.rcodes),
+        'udp_send_rate': udp.sent / args.duration,
+    }
+    print_summary('udp', report['udp'])
+    if rewrites:
+        window = (rewrites[0], min(rewrites[0] + args.rewrite_window,
+                                   start + args.duration))
+        during = [sample for sample in udp.samples
+                  if window[0] <= sample[0] < window[1]]
+        sent = sum(1 for sent_at in udp.send_times
+                   if window[0] <= sent_at < window[1])
+        report['udp_after_rewrite'] = summarize(during, sent,
+                                                window[1] - window[0])
+        print_summary('udp after rewrite', report['udp_after_rewrite'])
+    if tcp:
+        samples = [sample for load in tcp for sample in load.samples]
+        rcodes = sum((load.rcodes for load in tcp), collections.Counter())
+        report['tcp'] = summarize(samples, sum(load.sent for load in tcp),
+                                  args.duration, rcodes)
+        print_summary('tcp', report['tcp'])
+    print('udp send rate {0:.0f}/s (target {1}/s), response codes: {2}'.format(
+        report['udp_send_rate'], args.rate, dict(udp.rcodes)))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--clients', type=int, default=10000)
+    parser.add_argument('--ipv6-every', type=int, default=2)
+    parser.add_argument('--cached-every', type=int, default=10)
+    parser.add_argument('--rate', type=int, default=5000,
+                        help='UDP queries per second (0: no UDP load)')
+    parser.add_argument('--tcp-connections', type=int, default=0,
+                        help='number of closed-loop TCP connections')
+    parser.add_argument('--mix', type=parse_mix,
+                        default='A=50,AAAA=15,PTR=20,SOA=5,NXDOMAIN=10',
+                        help='weights of the query kinds ({0})'.format(
+                            ', '.join(QUERY_KINDS)))
+    parser.add_argument('--distinct-queries', type=int, default=10000,
+                        help='number of different queries sent in a loop')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds of load')
+    parser.add_argument('--timeout', type=float, default=1,
+                        help='later responses count as lost')
+    parser.add_argument('--rewrite-at', type=float, default=5,
+                        help='seconds after the start the status file is '
+                        'rewritten')
+    parser.add_argument('--rewrite-window', type=float, default=3,
+                        help='seconds after the rewrite reported separately')
+    parser.add_argument('--churn', type=int, default=1000,
+                        help='clients replaced by the rewrite')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='UDP worker processes of the server')
+    parser.add_argument('-o', '--output', help='JSON result file')
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+""" Compares a full parse of a status file with incremental updates.
+
+    The full parse time grows with the number of connected clients, the
+    incremental update time should mainly grow with the number of
+    connected/disconnected clients between two passes."""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from statusfile import StatusFile  # noqa: E402
+import generate  # noqa: E402
+
+
+def best_of(repeat, callback):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        callback()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run(clients_count, churn_counts, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'status')
+        clients = generate.make_clients(clients_count)
+        generate.write_status_file(path, clients)
+
+        def full():
+            StatusFile(path).update()
+        print('{0:>8} clients  full parse            {1:8.2f} ms'.format(
+              clients_count, best_of(repeat, full) * 1000))
+
+        for churn_count in churn_counts:
+            changed = generate.churn(clients, churn_count)
+            status = StatusFile(path)
+
+            def incremental():
+                generate.write_status_file(path, clients)
+                status.update()
+                generate.write_status_file(path, changed)
+                start = time.perf_counter()
+                status.update()
+                return time.perf_counter() - start
+            best = min(incremental() for _ in range(repeat))
+            print('{0:>8} clients  incremental ({1:>6} churn) {2:8.2f} ms'.format(
+                  clients_count, churn_count, best * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, nargs='+',
+                        default=[1000, 10000, 50000])
+    parser.add_argument('--churn', type=int, nargs='+', default=[0, 10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    for count in args.clients:
+        run(count, [c for c in args.churn if c <= count], args.repeat)
@@ -0,0 +1,76 @@
+""" Compares the reload of an instance with full zone rebuilds against
+    delta updates (``delta_updates = yes``) for different amounts of churn.
+    Reports the reload time and the peak of newly allocated memory."""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from config import ConfigParser  # noqa: E402
+from openvpnzone import OpenVpnAuthorityHandler  # noqa: E402
+import generate  # noqa: E402
+
+
+def make_handler(path, delta_updates):
+    cp = ConfigParser()
+    cp.parse_data({
+        'options': [('instance', 'vpn.example.org')],
+        'vpn.example.org': [
+            ('mname', 'dns.example.org'),
+            ('rname', 'dns.example.org'),
+            ('refresh', '1h'),
+            ('retry', '2h'),
+            ('expire', '3h'),
+            ('minimum', '4h'),
+            ('subnet4', '10.0.0.0/8'),
+            ('subnet6', 'fd00::/64'),
+            ('delta_updates', delta_updates),
+            ('status_file', path),
+        ]
+    })
+    return cp.instances['vpn.example.org'], OpenVpnAuthorityHandler(cp)
+
+
+def reload(path, clients, churn_count, mode, trace):
+    generate.write_status_file(path, clients)
+    os.utime(path, (1000, 1000))
+    instance, handler = make_handler(path, mode)
+    generate.write_status_file(path, generate.churn(clients, churn_count))
+    os.utime(path, (2000, 2000))
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    handler.loadInstance(instance)
+    duration = time.perf_counter() - start
+    if trace:
+        duration = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return duration
+
+
+def run(clients_count, churn_counts):
+    clients = generate.make_clients(clients_count)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'status')
+        for churn_count in churn_counts:
+            for mode in ('no', 'yes'):
+                duration = reload(path, clients, churn_count, mode, False)
+                peak = reload(path, clients, churn_count, mode, True)
+                print('{0:>8} clients {1:>6} churn  {2:5}  {3:8.2f} ms  '
+                      '{4:8.1f} KiB allocated'.format(
+                          clients_count, churn_count,
+                          'delta' if mode == 'yes' else 'full',
+                          duration * 1000, peak / 1024))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, nargs='+', default=[30000])
+    parser.add_argument('--churn', type=int, nargs='+', default=[1, 100, 1000])
+    args = parser.parse_args()
+    for count in args.clients:
+        run(count, args.churn)
@@ -0,0 +1,97 @@
+""" Measures the DNS query latency while an instance is reloaded: once with
+    the reload running inside the reactor (``loadInstance``) and once with
+    parsing and zone building in a thread (``reload_instance``). A client
+    thread sends queries back to back over UDP during the whole run."""
+import argparse
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from twisted.internet import defer  # noqa: E402
+from twisted.internet import reactor  # noqa: E402
+from twisted.names import dns  # noqa: E402
+
+from dnsserver import OpenVpnDNSServerFactory  # noqa: E402
+from bench_reload import make_handler  # noqa: E402
+import generate  # noqa: E402
+
+
+def query_loop(address, stop, latencies):
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.settimeout(5)
+    message = dns.Message(id=1)
+    message.queries = [dns.Query(b'client1.vpn.example.org', dns.A, dns.IN)]
+    data = message.toStr()
+    while not stop.is_set():
+        start = time.perf_counter()
+        client.sendto(data, address)
+        client.recv(512)
+        latencies.append((start, time.perf_counter() - start))
+    client.close()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run(clients_count, mode):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'status')
+        clients = generate.make_clients(clients_count)
+        generate.write_status_file(path, clients)
+        os.utime(path, (1000, 1000))
+        instance, handler = make_handler(path, 'no')
+        factory = OpenVpnDNSServerFactory(handler)
+        port = reactor.listenUDP(0, dns.DNSDatagramProtocol(factory),
+                                 interface='127.0.0.1')
+        generate.write_status_file(path, generate.churn(clients, 1000))
+        os.utime(path, (2000, 2000))
+
+        stop = threading.Event()
+        latencies = []
+        client = threading.Thread(target=query_loop, args=(
+            ('127.0.0.1', port.getHost().port), stop, latencies))
+        reload_time = []
+
+        def start_reload():
+            start = time.perf_counter()
+            if mode == 'thread':
+                d = handler.reload_instance(instance)
+            else:
+                d = defer.maybeDeferred(handler.loadInstance, instance)
+            d.addCallback(lambda result: reload_time.append(
+                (start, time.perf_counter())))
+            d.addCallback(lambda result: reactor.callLater(0.2, finish))
+
+        def finish():
+            stop.set()
+            client.join()
+            port.stopListening()
+            reactor.stop()
+
+        client.start()
+        reactor.callLater(0.2, start_reload)
+        reactor.run()
+        start, end = reload_time[0]
+        during = [latency for sent, latency in latencies
+                  if start <= sent <= end]
+        print('{0:>8} clients  {1:7}  reload {2:8.1f} ms  {3:6} queries '
+              'during reload  p50 {4:7.2f} ms  p99 {5:7.2f} ms  max {6:7.2f} ms'
+              .format(clients_count, mode, (end - start) * 1000, len(during),
+                      percentile(during, 0.5) * 1000,
+                      percentile(during, 0.99) * 1000,
+                      max(during) * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=50000)
+    parser.add_argument('mode', choices=('reactor', 'thread'))
+    args = parser.parse_args()
+    run(args.clients, args.mode)
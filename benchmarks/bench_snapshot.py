@@ -0,0 +1,88 @@
+""" Compares serving a zone from an ``InMemoryAuthority`` (dictionary of
+    twisted record objects) with a ``SnapshotAuthority`` (memory mapped
+    binary snapshot). Reports the time and memory needed to make a zone
+    servable in a new process and the lookup latency of both."""
+import argparse
+import gc
+import os
+import pickle
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from twisted.names import dns  # noqa: E402
+
+from openvpnzone import InMemoryAuthority  # noqa: E402
+from snapshot import write_snapshot, Snapshot, SnapshotAuthority  # noqa: E402
+from bench_reload import make_handler  # noqa: E402
+import generate  # noqa: E402
+
+
+def measure(load):
+    """ Returns the duration and the allocated memory of load"""
+    gc.collect()
+    start = time.perf_counter()
+    load()
+    duration = time.perf_counter() - start
+    tracemalloc.start()
+    result = load()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return duration, size, result
+
+
+def lookup_latency(authority, names, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for name in names:
+            authority.query(dns.Query(name, dns.A, dns.IN))
+    return (time.perf_counter() - start) / (repeat * len(names))
+
+
+def run(clients_count, lookups, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        status_path = os.path.join(tmp, 'status')
+        generate.write_status_file(status_path,
+                                   generate.make_clients(clients_count))
+        instance, handler = make_handler(status_path, 'no')
+        zone = handler.authorities[instance.name].forward
+        # a new process gets the zone either as pickle or as snapshot file:
+        pickle_path = os.path.join(tmp, 'zone.pickle')
+        with open(pickle_path, 'wb') as pickle_file:
+            pickle.dump((zone.soa, zone.records), pickle_file,
+                        pickle.HIGHEST_PROTOCOL)
+        snapshot_path = os.path.join(tmp, 'zone.snapshot')
+        write_snapshot(snapshot_path, zone.soa[0], zone.records)
+
+        def load_pickle():
+            with open(pickle_path, 'rb') as pickle_file:
+                return InMemoryAuthority(pickle.load(pickle_file))
+
+        def load_snapshot():
+            return SnapshotAuthority(Snapshot.open(snapshot_path))
+
+        names = random.Random(1).sample(sorted(zone.records), lookups)
+        for label, load, file_path in (
+                ('in-memory', load_pickle, pickle_path),
+                ('snapshot', load_snapshot, snapshot_path)):
+            duration, size, authority = measure(load)
+            latency = lookup_latency(authority, names, repeat)
+            print('{0:>8} clients  {1:9}  load {2:8.2f} ms  {3:9.1f} KiB heap'
+                  '  {4:9.1f} KiB file  lookup {5:6.2f} us'.format(
+                      clients_count, label, duration * 1000, size / 1024,
+                      os.path.getsize(file_path) / 1024, latency * 1e6))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, nargs='+',
+                        default=[1000, 30000])
+    parser.add_argument('--lookups', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    for count in args.clients:
+        run(count, args.lookups, args.repeat)
@@ -0,0 +1,264 @@
+""" Benchmark suite of the reload and lookup path on synthetic status files.
+
+    Every case is timed (best of ``--repeat`` runs) and run once more under
+    tracemalloc to determine the peak of newly allocated memory. The results
+    are written as JSON; ``--compare`` prints the changes against the results
+    of an earlier run (e.g. of another commit)::
+
+        python benchmarks/bench_suite.py --clients 1000 100000 -o new.json
+        python benchmarks/bench_suite.py --compare old.json new.json
+
+    Cases:
+
+    parse-vN  ``extract_zones_from_status_file`` on a status-version N file
+    config    parsing a multi-instance configuration and loading all instances
+    build     ``build_zone_from_clients`` into empty zones
+    changed   ``InMemoryAuthority.changed`` including the digest computation
+    setData   ``InMemoryAuthority.setData`` with 1% of the names changed
+    lookup    authority lookups of existing and unknown names"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from twisted.names import dns  # noqa: E402
+
+from config import ConfigParser  # noqa: E402
+from openvpnzone import (AuthorityTuple, InMemoryAuthority,  # noqa: E402
+                         OpenVpnAuthorityHandler, pack_addresses)
+from statusfile import extract_zones_from_status_file  # noqa: E402
+import generate  # noqa: E402
+
+
+LOOKUPS = 10000
+CHANGED_ADDRESS = pack_addresses([bytes((192, 0, 2, 1))])
+
+
+def measure(repeat, run, setup=None):
+    """ Times ``run`` (best of ``repeat``) and determines its peak memory
+        allocation. ``setup`` is called untimed before every run and its
+        result passed to ``run``.
+
+        :return: (seconds, peak memory in bytes)"""
+    times = []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        start = time.perf_counter()
+        run(argument)
+        times.append(time.perf_counter() - start)
+    argument = setup() if setup else None
+    tracemalloc.start()
+    try:
+        run(argument)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def quiet(callback, *args):
+    """ Calls callback without its "updated zone" output"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return callback(*args)
+
+
+class Suite(object):
+    def __init__(self, directory, clients_count, repeat, instances, options):
+        self.directory = directory
+        self.clients_count = clients_count
+        self.repeat = repeat
+        self.instances = instances
+        self.options = options
+        self.results = []
+
+    def record(self, case, seconds, peak, items, unit, **parameters):
+        result = dict(case=case, clients=self.clients_count, seconds=seconds,
+                      throughput=items / seconds, unit=unit,
+                      peak_memory=peak, **parameters)
+        self.results.append(result)
+        print('{0:>10} {1:>8} clients  {2:10.4f} s  {3:12.0f} {4:10} '
+              'peak {5:8.1f} MiB'.format(
+                  case, self.clients_count, seconds, result['throughput'],
+                  unit, peak / 2**20), file=sys.stderr)
+
+    def run(self):
+        for version, formatter in sorted(generate.FORMATTERS.items()):
+            self.parse(version, formatter)
+        self.config()
+        handler, instance = self.handler()
+        clients = extract_zones_from_status_file(instance.status_file)
+        self.build(handler, instance, clients)
+        authority = handler.authorities[instance.name].forward
+        self.changed(authority)
+        self.set_data(authority)
+        self.lookup(authority)
+        return self.results
+
+    def parse(self, version, formatter):
+        path = os.path.join(self.directory, 'status-v{0}'.format(version))
+        generate.write_status_file(path, generate.make_clients(
+            self.clients_count, **self.options), formatter)
+        seconds, peak = measure(
+            self.repeat, lambda ignored: extract_zones_from_status_file(path))
+        self.record('parse-v{0}'.format(version), seconds, peak,
+                    self.clients_count, 'clients/s')
+
+    def config(self):
+        directory = os.path.join(self.directory, 'config')
+        os.mkdir(directory)
+        path = generate.write_instances(directory, self.clients_count,
+                                        self.instances, **self.options)
+        seconds, peak = measure(self.repeat, lambda ignored: quiet(
+            OpenVpnAuthorityHandler, ConfigParser(path)))
+        self.record('config', seconds, peak, self.clients_count, 'clients/s',
+                    instances=self.instances)
+
+    def handler(self):
+        directory = os.path.join(self.directory, 'single')
+        os.mkdir(directory)
+        path = generate.write_instances(directory, self.clients_count,
+                                        **self.options)
+        handler = quiet(OpenVpnAuthorityHandler, ConfigParser(path))
+        return handler, next(iter(handler.config.instances.values()))
+
+    def build(self, handler, instance, clients):
+        def setup():
+            handler.authorities[instance.name] = AuthorityTuple(
+                InMemoryAuthority(), InMemoryAuthority(), InMemoryAuthority())
+        seconds, peak = measure(self.repeat, lambda ignored: quiet(
+            handler.build_zone_from_clients, instance, clients), setup)
+        self.record('build', seconds, peak, self.clients_count, 'clients/s')
+
+    def changed(self, authority):
+        def setup():
+            return authority.records.copy()
+
+        def run(records):
+            records.update_digests()
+            assert authority.changed(authority.soa, records) is False
+        seconds, peak = measure(self.repeat, run, setup)
+        self.record('changed', seconds, peak, len(authority.records),
+                    'names/s')
+
+    def set_data(self, authority):
+        names = sorted(authority.records)
+        changed = sorted(authority.records.clients)[::100]
+
+        def setup():
+            target = InMemoryAuthority()
+            quiet(target.setData, authority.soa, authority.records)
+            records = authority.records.copy()
+            for name in changed:
+                if name in records.clients:
+                    records.clients[name] = CHANGED_ADDRESS
+            records.update_digests()
+            soa = (authority.soa[0], dns.Record_SOA(
+                serial=authority.soa[1].serial + 1))
+            return target, soa, records
+
+        def run(argument):
+            target, soa, records = argument
+            assert quiet(target.setData, soa, records)
+        seconds, peak = measure(self.repeat, run, setup)
+        self.record('setData', seconds, peak, len(names), 'names/s')
+
+    def lookup(self, authority):
+        names = list(authority.records)
+        rng = random.Random(42)
+        queries = [dns.Query(rng.choice(names), dns.A) for _ in range(LOOKUPS)]
+        queries += [dns.Query(b'unknown%d.' % i + authority.soa[0], dns.A)
+                    for i in range(LOOKUPS // 10)]
+
+        def run(ignored):
+            for query in queries:
+                authority.query(query).addErrback(lambda failure: None)
+        seconds, peak = measure(self.repeat, run)
+        self.record('lookup', seconds, peak, len(queries), 'lookups/s',
+                    names=len(names))
+
+
+def metadata():
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=root,
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def result_key(result):
+    return tuple(sorted((name, value) for name, value in result.items()
+                        if name not in ('seconds', 'throughput', 'peak_memory')))
+
+
+def compare(old, new):
+    """ Prints the throughput and memory changes of the results of two runs"""
+    old_results = {result_key(result): result for result in old['results']}
+    print('{0:>10} {1:>8}  {2:>10}  {3:>10}'.format(
+        'case', 'clients', 'throughput', 'memory'))
+    for result in new['results']:
+        previous = old_results.get(result_key(result))
+        if previous is None:
+            continue
+        print('{0:>10} {1:>8}  {2:+9.1f}%  {3:+9.1f}%'.format(
+            result['case'], result['clients'],
+            (result['throughput'] / previous['throughput'] - 1) * 100,
+            (result['peak_memory'] / max(previous['peak_memory'], 1) - 1) * 100))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--clients', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--instances', type=int, default=4,
+                        help='number of instances of the config case')
+    parser.add_argument('--ipv6-every', type=int, default=2,
+                        help='every n-th client gets an IPv6 address '
+                        '(0: none)')
+    parser.add_argument('--cached-every', type=int, default=10,
+                        help='every n-th client has a cached route (0: none)')
+    parser.add_argument('-o', '--output', help='JSON file (default: stdout)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two result files instead of running')
+    args = parser.parse_args()
+    if args.compare:
+        with open(args.compare[0]) as old, open(args.compare[1]) as new:
+            compare(json.load(old), json.load(new))
+        return
+    options = dict(ipv6_every=args.ipv6_every, cached_every=args.cached_every)
+    report = {'meta': dict(metadata(), repeat=args.repeat, **options),
+              'results': []}
+    for clients_count in args.clients:
+        with tempfile.TemporaryDirectory() as directory:
+            report['results'] += Suite(directory, clients_count, args.repeat,
+                                       args.instances, options).run()
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+""" Generators for synthetic openvpn status files used by the benchmarks"""
+import ipaddress
+import os
+
+
+CONNECTED_SINCE = 'Tue Jul  9 16:49:58 2013'
+LAST_REF = 'Tue Jul  9 16:50:00 2013'
+
+
+def make_clients(count, first=0, domain='vpn.example.org', ipv6_every=2,
+                 cached_every=0):
+    """ Returns a list of (common name, addresses) tuples for ``count`` clients.
+        Client ``i`` gets the i-th address of 10.0.0.0/8, (for every
+        ``ipv6_every``-th client) the i-th address of fd00::/64 and (for every
+        ``cached_every``-th client) a cached route out of 172.16.0.0/12.
+
+        :param int ipv6_every: 0 for IPv4 only clients
+        :param int cached_every: 0 for no cached routes"""
+    net4 = int(ipaddress.IPv4Address('10.0.0.0'))
+    net6 = int(ipaddress.IPv6Address('fd00::'))
+    cached = int(ipaddress.IPv4Address('172.16.0.0'))
+    clients = []
+    for i in range(first, first + count):
+        addresses = [str(ipaddress.IPv4Address(net4 + i + 2))]
+        if ipv6_every and i % ipv6_every == 0:
+            addresses.append(str(ipaddress.IPv6Address(net6 + i + 2)))
+        if cached_every and i % cached_every == 0:
+            addresses.append(str(ipaddress.IPv4Address(
+                cached + i % 2**20)) + 'C')
+        clients.append(('client{0}.{1}'.format(i, domain), addresses))
+    return clients
+
+
+def churn(clients, count, generation=1):
+    """ Replaces the first ``count`` clients with new ones (disconnect +
+        connect)"""
+    replacements = make_clients(count, first=len(clients) * (generation + 1))
+    return replacements + clients[count:]
+
+
+def format_v1(clients):
+    """ Formats the client list as status file (status-version 1)"""
+    lines = ['OpenVPN CLIENT LIST', 'Updated,Wed Jul 17 22:53:32 2013',
+             'Common Name,Real Address,Bytes Received,Bytes Sent,Connected Since']
+    for number, (name, addresses) in enumerate(clients):
+        lines.append('{0},192.0.2.{1}:{2},{3},{4},{5}'.format(
+            name, number % 250 + 1, 1024 + number % 60000, number * 7,
+            number * 3, CONNECTED_SINCE))
+    lines.append('ROUTING TABLE')
+    lines.append('Virtual Address,Common Name,Real Address,Last Ref')
+    for number, (name, addresses) in enumerate(clients):
+        for address in addresses:
+            lines.append('{0},{1},192.0.2.{2}:{3},{4}'.format(
+                address, name, number % 250 + 1, 1024 + number % 60000,
+                LAST_REF))
+    lines += ['GLOBAL STATS', 'Max bcast/mcast queue length,1', 'END', '']
+    return '\n'.join(lines)
+
+
+def format_v2(clients, separator=','):
+    """ Formats the client list as status file (status-version 2)"""
+    def row(*fields):
+        return separator.join(str(field) for field in fields)
+    lines = [
+        row('TITLE', 'OpenVPN 2.4.7 x86_64-pc-linux-gnu'),
+        row('TIME', 'Wed Jul 17 22:53:32 2013', 1374094412),
+        row('HEADER', 'CLIENT_LIST', 'Common Name', 'Real Address',
+            'Virtual Address', 'Virtual IPv6 Address', 'Bytes Received',
+            'Bytes Sent', 'Connected Since', 'Connected Since (time_t)',
+            'Username', 'Client ID', 'Peer ID'),
+    ]
+    for number, (name, addresses) in enumerate(clients):
+        address4 = [a for a in addresses
+                    if ':' not in a and not a.endswith('C')]
+        address6 = [a for a in addresses if ':' in a]
+        lines.append(row(
+            'CLIENT_LIST', name,
+            '192.0.2.{0}:{1}'.format(number % 250 + 1, 1024 + number % 60000),
+            address4[0] if address4 else '', address6[0] if address6 else '',
+            number * 7, number * 3, CONNECTED_SINCE, 1373381398, 'UNDEF',
+            number, number))
+    lines.append(row('HEADER', 'ROUTING_TABLE', 'Virtual Address',
+                     'Common Name', 'Real Address', 'Last Ref',
+                     'Last Ref (time_t)'))
+    for number, (name, addresses) in enumerate(clients):
+        for address in addresses:
+            lines.append(row(
+                'ROUTING_TABLE', address, name,
+                '192.0.2.{0}:{1}'.format(number % 250 + 1, 1024 + number % 60000),
+                LAST_REF, 1373381400))
+    lines += [row('GLOBAL_STATS', 'Max bcast/mcast queue length', 1), 'END', '']
+    return '\n'.join(lines)
+
+
+def format_v3(clients):
+    """ Formats the client list as status file (status-version 3)"""
+    return format_v2(clients, separator='\t')
+
+
+FORMATTERS = {1: format_v1, 2: format_v2, 3: format_v3}
+
+
+def write_status_file(path, clients, formatter=format_v1):
+    with open(path, 'w') as status_file:
+        status_file.write(formatter(clients))
+
+
+def format_config(instances, listen='127.0.0.1:5353', options=()):
+    """ Formats a configuration file serving the given instances
+
+        :param list instances: (zone name, status file path) tuples
+        :param options: additional (name, value) tuples of the options
+            section"""
+    lines = ['[options]', 'listen = {0}'.format(listen)]
+    lines += ['{0} = {1}'.format(name, value) for name, value in options]
+    lines += ['instance = {0}'.format(name) for name, path in instances]
+    for name, path in instances:
+        lines += [
+            '', '[{0}]'.format(name),
+            'mname = dns.example.org',
+            'rname = dns@example.org',
+            'refresh = 1h',
+            'retry = 2h',
+            'expire = 3h',
+            'minimum = 4h',
+            'subnet4 = 10.0.0.0/8',
+            'subnet6 = fd00::/64',
+            'status_file = {0}'.format(path),
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+def write_instances(directory, clients_count, instances=1,
+                    formatter=format_v1, listen='127.0.0.1:5353',
+                    server_options=(), **options):
+    """ Writes a configuration with ``instances`` instances and their status
+        files - the clients are split evenly between the instances.
+
+        :param server_options: passed to :func:`format_config`
+        :param options: passed to :func:`make_clients`
+        :return: path of the configuration file"""
+    entries = []
+    per_instance = clients_count // instances
+    for number in range(instances):
+        name = 'vpn{0}.example.org'.format(number)
+        path = os.path.join(directory, '{0}.status'.format(name))
+        write_status_file(path, make_clients(
+            per_instance, first=number * per_instance, domain=name,
+            **options), formatter)
+        entries.append((name, path))
+    config = os.path.join(directory, 'openvpn2dns.ini')
+    with open(config, 'w') as config_file:
+        config_file.write(format_config(entries, listen, server_options))
+    return config
@@ -83,6 +83,8 @@ class OpenVpnInstance(SetSingleValueMixin):
     def __init__(self, name):
         self.name = name
         self.status_file = None
+        self.management = None
+        self.events = None
         self.notify = []
         self.rname = None
         self.mname = None
@@ -96,7 +98,8 @@ class OpenVpnInstance(SetSingleValueMixin):
         self.suffix = None
         self.subnet4 = None
         self.subnet6 = None
-        self.version = 0
+        self.delta_updates = None
+        self.journal_size = None
 
 
 class ConfigParser(SetSingleValueMixin):
@@ -106,6 +109,7 @@ class ConfigParser(SetSingleValueMixin):
 
         :param str filename: file path to configuration file"""
     def __init__(self, filename=None):
+        self.filename = None
         self.listen_addresses = []
         self.daemon = None
         self.drop = None
@@ -114,6 +118,19 @@ class ConfigParser(SetSingleValueMixin):
         self.log = None
         self.pidfile = None
         self.reactor = None
+        self.workers = None
+        self.reload_min_delay = None
+        self.reload_max_delay = None
+        self.max_concurrent_reloads = None
+        self.metrics = None
+        self.udp_payload_size = None
+        self.event_socket = None
+        self.reconcile_interval = None
+        self.state_directory = None
+        self.snapshot_interval = None
+        self.profile_directory = None
+        self.profile_duration = None
+        self.profile_reloads = None
         self.instances = {}
         if filename:
             self.read_file(filename)
@@ -158,6 +175,7 @@ class ConfigParser(SetSingleValueMixin):
 
     def read_file(self, file_name):
         """ Read and parse the configuration file"""
+        self.filename = os.path.abspath(file_name)
         self.parse_data(self.read_data(file_name))
 
     @staticmethod
@@ -168,12 +186,91 @@ class ConfigParser(SetSingleValueMixin):
             return False
         raise ValueError(f'Could not parse boolean value: "{value!r}"')
 
+    @staticmethod
+    def parse_integer(value):
+        try:
+            return int(value)
+        except ValueError:
+            raise ConfigurationError('Could not parse integer value: "{0}"'
+                                     .format(value))
+
+    @staticmethod
+    def parse_float(value):
+        try:
+            return float(value)
+        except ValueError:
+            raise ConfigurationError('Could not parse number: "{0}"'
+                                     .format(value))
+
+    @staticmethod
+    def parse_address(value):
+        try:
+            address, port = value.rsplit(':', 1)
+            return (address, int(port))
+        except ValueError:
+            raise ConfigurationError('Could not parse address: "{0}"'
+                                     .format(value))
+
+    @classmethod
+    def parse_payload_size(cls, value):
+        size = cls.parse_integer(value)
+        if size != 0 and not 512 <= size <= 65535:
+            raise ConfigurationError('UDP payload size must be 0 or between '
+                                     '512 and 65535: "{0}"'.format(value))
+        return size
+
+    @classmethod
+    def parse_delay(cls, value):
+        delay = cls.parse_float(value)
+        if delay < 0:
+            raise ConfigurationError('Delay must not be negative: "{0}"'
+                                     .format(value))
+        return delay
+
+    @classmethod
+    def parse_concurrent_reloads(cls, value):
+        count = cls.parse_integer(value)
+        if count < 1:
+            raise ConfigurationError('At least one reload must be allowed: '
+                                     '"{0}"'.format(value))
+        return count
+
+    @classmethod
+    def parse_workers(cls, value):
+        count = cls.parse_integer(value)
+        if count < 0:
+            raise ConfigurationError('Number of workers must not be '
+                                     'negative: "{0}"'.format(value))
+        return count
+
+    @classmethod
+    def parse_journal_size(cls, value):
+        size = cls.parse_integer(value)
+        if size < 0:
+            raise ConfigurationError('Journal size must not be negative: '
+                                     '"{0}"'.format(value))
+        return size
+
+    @classmethod
+    def parse_management(cls, value):
+        """ Parses the address of a management interface: host and port
+            or the path of a unix socket"""
+        if os.sep in value or ':' not in value:
+            return os.path.abspath(value)
+        return cls.parse_address(value)
+
     @staticmethod
     def parse_filename(value):
         if not os.path.isfile(value):
             raise ValueError('Could not found config file {0}'.format(value))
         return value
 
+    @staticmethod
+    def parse_directory(value):
+        if not os.path.isdir(value):
+            raise ValueError('Could not found directory {0}'.format(value))
+        return os.path.abspath(value)
+
     @staticmethod
     def parse_userid(value):
         try:
@@ -227,12 +324,48 @@ class ConfigParser(SetSingleValueMixin):
                 self.set_single_option('user', value, self.parse_userid)
             elif option == 'group':
                 self.set_single_option('group', value, self.parse_groupid)
+            elif option == 'workers':
+                self.set_single_option('workers', value, self.parse_workers)
+            elif option in ('reload_min_delay', 'reload_max_delay'):
+                self.set_single_option(option, value, self.parse_delay)
+            elif option == 'max_concurrent_reloads':
+                self.set_single_option(option, value,
+                                       self.parse_concurrent_reloads)
+            elif option == 'metrics':
+                self.set_single_option('metrics', value, self.parse_address)
+            elif option == 'udp_payload_size':
+                self.set_single_option(option, value, self.parse_payload_size)
+            elif option == 'event_socket':
+                self.set_single_option(option, os.path.abspath(value))
+            elif option == 'reconcile_interval':
+                self.set_single_option(option, value, self.parse_float)
+            elif option == 'state_directory':
+                self.set_single_option(option, value, self.parse_directory)
+            elif option == 'snapshot_interval':
+                self.set_single_option(option, value, self.parse_float)
+            elif option == 'profile_directory':
+                self.set_single_option(option, value, self.parse_directory)
+            elif option == 'profile_duration':
+                self.set_single_option(option, value, self.parse_float)
+            elif option == 'profile_reloads':
+                self.set_single_option(option, value, self.parse_integer)
             elif option == 'pidfile':
                 self.set_single_option('pidfile', value, self.parse_boolean)
             else:
                 warnings.warn('Unknown option {0} in options section'
                               .format(option), UnusedOptionWarning,
                               stacklevel=2)
+        if self.reload_min_delay is not None and \
+                self.reload_max_delay is not None and \
+                self.reload_min_delay > self.reload_max_delay:
+            raise ConfigurationError('reload_min_delay must not be greater '
+                                     'than reload_max_delay')
+        if self.event_socket is None:
+            for instance in self.instances.values():
+                if instance.events:
+                    raise ConfigurationError('Instance {0} uses events but no '
+                                             'event_socket is configured'
+                                             .format(instance.name))
 
     def add_listen_address(self, listen):
         """ Add a listen information
@@ -266,11 +399,22 @@ class ConfigParser(SetSingleValueMixin):
                 instance.set_single_option('subnet4', value, self.parse_net)
             elif option == 'subnet6':
                 instance.set_single_option('subnet6', value, self.parse_net)
+            elif option == 'management':
+                instance.set_single_option('management', value,
+                                           self.parse_management)
+            elif option == 'events':
+                instance.set_single_option('events', value, self.parse_boolean)
             # slave name server notifies:
             elif option == 'notify':
                 instance.notify.append((value, 53))
             elif option == 'suffix':
                 instance.suffix = value
+            elif option == 'journal_size':
+                instance.set_single_option('journal_size', value,
+                                           self.parse_journal_size)
+            elif option == 'delta_updates':
+                instance.set_single_option('delta_updates', value,
+                                           self.parse_boolean)
             # SOA entries:
             elif option in ('rname', 'mname', 'refresh', 'retry', 'expire',
                             'minimum'):
@@ -298,6 +442,11 @@ class ConfigParser(SetSingleValueMixin):
             else:
                 warnings.warn('Unknown option {0} in section {1}'.format(option,
                               name), UnusedOptionWarning, stacklevel=2)
+        if instance.journal_size is None:
+            instance.journal_size = 100
+        if instance.events and instance.management is not None:
+            raise ConfigurationError('Instance {0} can not use events and the '
+                                     'management interface'.format(name))
         self.instances[name] = instance
         return instance
 
@@ -0,0 +1,487 @@
+import collections
+import struct
+import time
+from io import BytesIO
+
+from twisted.internet import defer
+from twisted.internet import interfaces
+from twisted.names import dns
+from twisted.names import server
+from zope.interface import implementer
+
+
+CachedAnswer = collections.namedtuple('CachedAnswer', ('rCode', 'auth',
+                                                       'counts', 'body'))
+
+# query types that are never answered from the answer cache:
+UNCACHED_TYPES = frozenset((dns.AXFR, dns.IXFR, dns.MAILA, dns.MAILB, dns.OPT))
+
+# EDNS0 (RFC 6891): the OPT pseudo record has the root name and no options,
+# its class carries the UDP payload size, its ttl the upper bits of the
+# response code and the EDNS version
+OPT_RECORD = struct.Struct('!BHHIH')
+BADVERS = 16
+DEFAULT_UDP_PAYLOAD_SIZE = 1232
+# UDP response size for clients without EDNS (RFC 1035 section 4.2.1)
+MIN_UDP_PAYLOAD_SIZE = 512
+# number of truncated responses remembered to detect TCP retries
+TRUNCATED_QUERIES = 4096
+TCP_RETRY_WINDOW = 30
+# zone transfer messages are completed once they exceed this size:
+TRANSFER_MESSAGE_SIZE = 16384
+
+
+class AnswerCache(object):
+    """ Cache of fully encoded answers of one zone version. An entry holds
+        everything behind the question section of a response, together
+        with the response code and the section counts.
+
+        Negative answers (names without records) are not cached per name:
+        they share one entry per response code, see :meth:`get`.
+
+        :param int max_entries: number of cached answers per zone version
+        :ivar dict negative: response code to the negative answer of the zone
+            version
+        :ivar int hits: number of answers served from the cache
+        :ivar int negatives: number of negative answers served without lookup
+        :ivar int misses: number of answers that had to be looked up"""
+    def __init__(self, max_entries=65536):
+        self.max_entries = max_entries
+        self.entries = {}
+        self.negative = {}
+        self.generation = 0
+        self.hits = 0
+        self.negatives = 0
+        self.misses = 0
+
+    def get(self, key, negative=None):
+        """ Returns the cached answer of key.
+
+            :param negative: callable returning the negative answer for
+                uncached keys (None if the name has records)"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        if negative is not None:
+            entry = negative()
+            if entry is not None:
+                self.negatives += 1
+                return entry
+        self.misses += 1
+        return None
+
+    def put(self, key, entry, generation):
+        """ Stores an entry unless the cache was cleared since the lookup of
+            the entry started (generation)"""
+        if generation == self.generation and len(self.entries) < self.max_entries:
+            self.entries[key] = entry
+
+    def clear(self):
+        """ Drops all entries at once (a new zone version was installed)"""
+        self.entries = {}
+        self.negative = {}
+        self.generation += 1
+
+
+@implementer(interfaces.IPullProducer)
+class ZoneTransferProducer(object):
+    """ Writes the records of a zone transfer to a TCP connection as a
+        sequence of messages of about :data:`TRANSFER_MESSAGE_SIZE` bytes
+        (RFC 5936 section 2.2). As pull producer the next message is only
+        encoded after the transport has written the previous one, so one
+        message per transfer is in memory at a time.
+
+        :param OpenVpnDNSServerFactory factory: factory (for the flags, EDNS
+            and metrics)
+        :param protocol: TCP DNS protocol of the client
+        :param message: the transfer query
+        :param records: iterator over the resource records to transfer
+        :param bytes zone: name of the transferred zone (for the metrics)"""
+    def __init__(self, factory, protocol, message, records, zone=None):
+        self.factory = factory
+        self.protocol = protocol
+        self.message = message
+        self.records = records
+        self.zone = zone
+        strio = BytesIO()
+        message.queries[0].encode(strio)
+        self.question = strio.getvalue()
+        self.opt = factory.optRecord(message)
+        self.flags = 0x8400 | (message.recDes and 0x0100) \
+            | (factory.canRecurse and 0x0080)
+        self.messages = 0
+
+    def start(self):
+        """ Starts the transfer. A transport takes only one producer at a
+            time: further transfers of the connection are queued and started
+            after the running one."""
+        transfers = getattr(self.protocol, 'transfers', None)
+        if transfers is None:
+            transfers = self.protocol.transfers = collections.deque()
+        transfers.append(self)
+        if len(transfers) == 1:
+            self.protocol.transport.registerProducer(self, False)
+
+    def resumeProducing(self):
+        data = self.nextMessage()
+        if data is None:
+            self.finish()
+        else:
+            self.protocol.transport.write(struct.pack('!H', len(data)) + data)
+
+    def stopProducing(self):
+        self.records = iter(())
+
+    def nextMessage(self):
+        """ Encodes the next message of the transfer (None at the end)"""
+        body = BytesIO()
+        body.write(self.question)
+        compression = {}
+        count = 0
+        for record in self.records:
+            record.encode(body, compression)
+            count += 1
+            if body.tell() >= TRANSFER_MESSAGE_SIZE:
+                break
+        if count == 0:
+            return None
+        self.messages += 1
+        return b''.join((struct.pack('!HHHHHH', self.message.id, self.flags,
+                                     1, count, 0, bool(self.opt)),
+                         body.getvalue(), self.opt))
+
+    def finish(self):
+        self.protocol.transport.unregisterProducer()
+        transfers = self.protocol.transfers
+        transfers.popleft()
+        metrics = self.factory.metrics
+        if metrics is not None:
+            metrics.observe_query(self.zone, self.message.queries[0].type,
+                                  dns.OK, self.message.timeReceived, True)
+        if transfers:
+            self.protocol.transport.registerProducer(transfers[0], False)
+
+
+class OpenVpnDNSServerFactory(server.DNSServerFactory):
+    """ DNS server factory for the zones of
+        :class:`openvpnzone.InMemoryAuthority` authorities.
+
+        It supports incremental zone transfers (IXFR, RFC 1995), streams
+        zone transfers over TCP in messages of bounded size and answers
+        regular queries from the pre-encoded answer cache of the zones: only
+        the header and the question section are written per response.
+        Names without records get NXDOMAIN (or NODATA for empty
+        non-terminals) with the SOA record (RFC 2308) without a lookup.
+
+        UDP responses are limited to 512 bytes or to the payload size of
+        EDNS0 clients (at most :attr:`udp_payload_size`), larger responses
+        are sent truncated (only the question, TC flag) - the client retries
+        with TCP.
+
+        :ivar int udp_payload_size: UDP payload size advertised to EDNS0
+            clients (None disables EDNS0)"""
+    zones = None
+    metrics = None
+    udp_payload_size = DEFAULT_UDP_PAYLOAD_SIZE
+
+    def __init__(self, *args, **kwargs):
+        server.DNSServerFactory.__init__(self, *args, **kwargs)
+        # (client host, name, type) of truncated responses to their time:
+        self.truncated = collections.OrderedDict()
+
+    def zoneAuthorities(self):
+        """ Returns a dictionary of the lowercase zone names to their
+            authorities"""
+        if self.zones is None:
+            zones = {}
+            for resolver in self.resolver.resolvers:
+                soa = getattr(resolver, 'soa', None)
+                if soa is not None:
+                    zones.setdefault(soa[0].lower(), resolver)
+            self.zones = zones
+        return self.zones
+
+    def setAuthorities(self, authorities):
+        """ Replaces the served authorities, e.g. after zones were added or
+            removed by a configuration reload"""
+        self.resolver.resolvers = list(authorities)
+        self.zones = None
+
+    def authorityFor(self, zone_name):
+        """ Returns the authority serving the given zone (or None)"""
+        return self.zoneAuthorities().get(zone_name.lower())
+
+    def authorityForName(self, name):
+        """ Returns the authority of the closest zone containing name"""
+        zones = self.zoneAuthorities()
+        name = name.lower()
+        while True:
+            authority = zones.get(name)
+            if authority is not None:
+                return authority
+            if b'.' not in name:
+                return None
+            name = name.split(b'.', 1)[1]
+
+    def handleQuery(self, message, protocol, address):
+        message.edns = None
+        if self.udp_payload_size is not None and message.additional:
+            rCode = self.parseEdns(message)
+            if rCode is not None:
+                response = self._responseFromMessage(message=message,
+                                                     rCode=rCode)
+                self.sendReply(protocol, response, address)
+                return
+        if address is None and self.truncated:
+            self.countTcpRetry(message, protocol)
+        if message.queries and message.queries[0].type == dns.IXFR:
+            return self.handleIncrementalZoneTransfer(message, protocol, address)
+        if address is None and len(message.queries) == 1 and \
+                message.queries[0].type == dns.AXFR:
+            authority = self.authorityFor(message.queries[0].name.name)
+            if getattr(authority, 'iterateZone', None) is not None:
+                return ZoneTransferProducer(
+                    self, protocol, message, authority.iterateZone(),
+                    authority.soa[0]).start()
+        if len(message.queries) == 1 and \
+                message.queries[0].type not in UNCACHED_TYPES:
+            authority = self.authorityForName(message.queries[0].name.name)
+            if getattr(authority, 'answer_cache', None) is not None:
+                return self.handleCachedQuery(authority, message, protocol,
+                                              address)
+        return server.DNSServerFactory.handleQuery(self, message, protocol,
+                                                   address)
+
+    def handleCachedQuery(self, authority, message, protocol, address):
+        """ Answers the query from the answer cache of the authority, the
+            answer is looked up and encoded on cache misses"""
+        query = message.queries[0]
+        cache = authority.answer_cache
+        key = (query.name.name.lower(), query.type, query.cls)
+        entry = cache.get(key, lambda: self.negativeAnswer(authority,
+                                                           query.name.name))
+        if entry is not None:
+            self.sendCachedAnswer(entry, protocol, message, address, authority)
+            return defer.succeed(entry)
+        generation = cache.generation
+        d = authority.query(query)
+        d.addCallbacks(self.encodeAnswer, self.encodeError,
+                       callbackArgs=(message,), errbackArgs=(message,))
+        d.addCallback(self._cacheAnswer, cache, key, generation)
+        d.addCallback(self.sendCachedAnswer, protocol, message, address,
+                      authority)
+        d.addErrback(self.gotResolverError, protocol, message, address)
+        return d
+
+    @staticmethod
+    def parseEdns(message):
+        """ Stores the UDP payload size of the OPT record of the query as
+            ``message.edns``.
+
+            :return: error response code for invalid OPT records or None"""
+        options = [rr for rr in message.additional if rr.type == dns.OPT]
+        if not options:
+            return None
+        message.edns = max(options[0].cls, MIN_UDP_PAYLOAD_SIZE)
+        if len(options) > 1:
+            return dns.EFORMAT
+        if (options[0].ttl >> 16) & 0xff != 0:
+            return BADVERS  # only EDNS version 0
+        return None
+
+    def optRecord(self, message, rCode=dns.OK):
+        """ Returns the encoded OPT record for the response to message
+            (empty for queries without EDNS)"""
+        if getattr(message, 'edns', None) is None:
+            return b''
+        return OPT_RECORD.pack(0, dns.OPT, self.udp_payload_size,
+                               (rCode >> 4) << 24, 0)
+
+    def datagramLimit(self, message):
+        """ Returns the maximal size of the UDP response to message"""
+        edns = getattr(message, 'edns', None)
+        if edns is None:
+            return MIN_UDP_PAYLOAD_SIZE
+        return max(min(edns, self.udp_payload_size), MIN_UDP_PAYLOAD_SIZE)
+
+    def countTruncation(self, message, address):
+        """ Counts a truncated response and remembers the query to detect
+            the TCP retry of the client"""
+        if self.metrics is None:
+            return
+        self.metrics.truncations.inc()
+        query = message.queries[0]
+        self.truncated[(address[0], query.name.name.lower(), query.type)] = \
+            time.time()
+        while len(self.truncated) > TRUNCATED_QUERIES:
+            self.truncated.popitem(last=False)
+
+    def countTcpRetry(self, message, protocol):
+        """ Counts TCP queries repeating a recently truncated query"""
+        if len(message.queries) != 1:
+            return
+        query = message.queries[0]
+        truncated = self.truncated.pop((protocol.transport.getPeer().host,
+                                        query.name.name.lower(), query.type),
+                                       None)
+        if truncated is not None and \
+                time.time() - truncated < TCP_RETRY_WINDOW:
+            self.metrics.tcp_retries.inc()
+
+    def _responseFromMessage(self, message, *args, **kwargs):
+        response = server.DNSServerFactory._responseFromMessage(
+            self, message, *args, **kwargs)
+        response.edns = getattr(message, 'edns', None)
+        return response
+
+    @staticmethod
+    def negativeAnswer(authority, name):
+        """ Returns the negative answer (NXDOMAIN or NODATA with the SOA record
+            in the authority section) of the current zone version if name has
+            no records, None otherwise. The answer is encoded once per zone
+            version without name compression, so it fits behind every
+            question."""
+        lookupNegative = getattr(authority, 'lookupNegative', None)
+        rCode = lookupNegative(name) if lookupNegative is not None else None
+        if rCode is None:
+            return None
+        entry = authority.answer_cache.negative.get(rCode)
+        if entry is None:
+            zone_name, soa = authority.soa
+            ttl = soa.ttl if soa.ttl is not None \
+                else max(soa.minimum, soa.expire)
+            strio = BytesIO()
+            dns.RRHeader(zone_name, dns.SOA, dns.IN, min(ttl, soa.minimum),
+                         soa, auth=True).encode(strio)
+            entry = CachedAnswer(rCode=rCode, auth=True, counts=(0, 1, 0),
+                                 body=strio.getvalue())
+            authority.answer_cache.negative[rCode] = entry
+        return entry
+
+    @staticmethod
+    def _cacheAnswer(entry, cache, key, generation):
+        cache.put(key, entry, generation)
+        return entry
+
+    def encodeAnswer(self, response, message, rCode=dns.OK):
+        """ Encodes a resolver response as :class:`CachedAnswer`"""
+        answers, authority, additional = response
+        response = self._responseFromMessage(
+            message=message, rCode=rCode, answers=list(answers),
+            authority=list(authority), additional=list(additional))
+        response.maxSize = 0  # do not truncate
+        strio = BytesIO()
+        message.queries[0].encode(strio)
+        return CachedAnswer(
+            rCode=rCode, auth=response.auth,
+            counts=(len(response.answers), len(response.authority),
+                    len(response.additional)),
+            body=response.toStr()[12 + len(strio.getvalue()):])
+
+    def encodeError(self, failure, message):
+        """ Encodes non-existing names as :class:`CachedAnswer`, passes
+            all other failures"""
+        failure.trap(dns.AuthoritativeDomainError)
+        return self.encodeAnswer(((), (), ()), message, rCode=dns.ENAME)
+
+    def sendCachedAnswer(self, entry, protocol, message, address,
+                         authority=None):
+        """ Writes a cached answer with the header and question section of the
+            query"""
+        flags = 0x8000 | (entry.auth and 0x0400) | (message.recDes and 0x0100) \
+            | (self.canRecurse and 0x0080) | (entry.rCode & 0x0f)
+        strio = BytesIO()
+        message.queries[0].encode(strio)
+        question = strio.getvalue()
+        opt = self.optRecord(message)
+        answers, authority_count, additional = entry.counts
+        data = b''.join((struct.pack('!HHHHHH', message.id, flags, 1, answers,
+                                     authority_count, additional + bool(opt)),
+                         question, entry.body, opt))
+        if address is not None and len(data) > self.datagramLimit(message):
+            data = b''.join((struct.pack('!HHHHHH', message.id, flags | 0x0200,
+                                         1, 0, 0, bool(opt)), question, opt))
+            self.countTruncation(message, address)
+        if address is None:  # TCP
+            protocol.transport.write(struct.pack('!H', len(data)) + data)
+        else:
+            protocol.transport.write(data, address)
+        if self.metrics is not None:
+            self.metrics.observe_query(
+                authority.soa[0] if authority is not None else None,
+                message.queries[0].type, entry.rCode,
+                message.timeReceived, address is None)
+        return entry
+
+    def sendReply(self, protocol, message, address):
+        edns = getattr(message, 'edns', None) is not None
+        if edns:
+            message.additional.append(dns.RRHeader(
+                b'', dns.OPT, self.udp_payload_size,
+                (message.rCode >> 4) << 24, dns.UnknownRecord(b'')))
+        message.maxSize = 0  # truncated here as a whole
+        if address is not None and message.queries and \
+                len(message.toStr()) > self.datagramLimit(message):
+            message.answers = []
+            message.authority = []
+            message.additional = message.additional[-1:] if edns else []
+            message.trunc = 1
+            self.countTruncation(message, address)
+        server.DNSServerFactory.sendReply(self, protocol, message, address)
+        if self.metrics is not None:
+            zone = qtype = None
+            if message.queries:
+                qtype = message.queries[0].type
+                authority = self.authorityForName(message.queries[0].name.name)
+                if authority is not None:
+                    zone = authority.soa[0]
+            self.metrics.observe_query(zone, qtype, message.rCode,
+                                       message.timeReceived, address is None)
+
+    def handleIncrementalZoneTransfer(self, message, protocol, address):
+        """ Answers a IXFR query. The serial of the client is taken from the
+            SOA record in the authority section of the query."""
+        query = message.queries[0]
+        serials = [rr.payload.serial for rr in message.authority
+                   if rr.type == dns.SOA]
+        if not serials:
+            response = self._responseFromMessage(message=message,
+                                                 rCode=dns.EFORMAT)
+            self.sendReply(protocol, response, address)
+            return
+        authority = self.authorityFor(query.name.name)
+        if authority is None or \
+                not hasattr(authority, 'lookupIncrementalZone'):
+            response = self._responseFromMessage(message=message,
+                                                 rCode=dns.EREFUSED)
+            self.sendReply(protocol, response, address)
+            return
+        d = authority.lookupIncrementalZone(query.name.name, serials[0])
+        if address is not None:  # UDP
+            d.addCallback(self.limitDatagramTransfer, message)
+            d.addCallback(self.gotResolverResponse, protocol, message, address)
+        else:
+            d.addCallback(self.streamTransfer, protocol, message,
+                          authority.soa[0])
+        return d.addErrback(self.gotResolverError, protocol, message, address)
+
+    def streamTransfer(self, response, protocol, message, zone):
+        """ Writes the answers of a transfer response to a TCP connection,
+            see :class:`ZoneTransferProducer`"""
+        ZoneTransferProducer(self, protocol, message, iter(response[0]),
+                             zone).start()
+
+    def limitDatagramTransfer(self, response, message):
+        """ Replaces transfers that do not fit into one datagram with the
+            current SOA record - the client retries with TCP (RFC 1995
+            section 2)"""
+        answers, auth, additional = response
+        if len(answers) <= 1:
+            return response
+        test = self._responseFromMessage(message=message, answers=answers)
+        test.maxSize = 0  # do not truncate
+        if len(test.toStr()) + len(self.optRecord(message)) <= \
+                self.datagramLimit(message):
+            return response
+        return ([answers[0]], (), ())
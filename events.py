@@ -0,0 +1,162 @@
+import os.path
+import time
+
+from twisted.internet import protocol
+from twisted.protocols import basic
+
+from statusfile import ClientListSource, \
+    extract_zones_from_status_file, parse_address
+
+
+class EventSource(ClientListSource):
+    """ Client list of one openvpn instance maintained from the events of
+        the ``client-connect``, ``client-disconnect`` and ``learn-address``
+        hook scripts (see ``scripts/openvpn2dns-event``).
+
+        Missed events are repaired by a reconciliation with the status file:
+        the next :meth:`update` after :meth:`reconcile` parses it and takes
+        over the clients without newer events.
+
+        :param str status_file: path of the status file for reconciliations
+            (None to rely on the events only)
+        :param callable changed: called after every event"""
+    def __init__(self, status_file=None, changed=None):
+        self.status_file = status_file
+        self.changed = changed
+        ClientListSource.__init__(self)
+        # current client list (name -> addresses) and address -> name:
+        self.current = {}
+        self.owners = {}
+        # name -> time of its last event:
+        self.event_times = {}
+        # names changed since the last update call:
+        self.pending = set()
+        self.reconcile_requested = status_file is not None
+
+    def touch(self, name):
+        self.pending.add(name)
+        self.event_times[name] = time.time()
+
+    def learn(self, name, address):
+        previous = self.owners.get(address)
+        self.owners[address] = name
+        if previous is not None and previous != name \
+                and previous in self.current:
+            self.current[previous].remove(address)
+            self.touch(previous)
+        self.current.setdefault(name, [])
+        if address not in self.current[name]:
+            self.current[name].append(address)
+
+    def add(self, name, addresses):
+        """ Adds the client (if needed) and the addresses to it"""
+        with self.lock:
+            for address in addresses:
+                self.learn(name, address)
+            self.current.setdefault(name, [])
+            self.touch(name)
+        if self.changed is not None:
+            self.changed()
+
+    def remove(self, name, addresses=None):
+        """ Removes the addresses from a client or the whole client (if no
+            addresses are given). The name None removes the addresses from
+            the client that owns them."""
+        with self.lock:
+            if addresses is None:
+                for address in self.current.pop(name, ()):
+                    self.owners.pop(address, None)
+                self.touch(name)
+            else:
+                for address in addresses:
+                    owner = self.owners.get(address)
+                    if owner is None or (name is not None and owner != name):
+                        continue
+                    del self.owners[address]
+                    self.current[owner].remove(address)
+                    self.touch(owner)
+        if self.changed is not None:
+            self.changed()
+
+    def reconcile(self):
+        """ Requests a reconciliation with the status file by the next
+            :meth:`update`"""
+        self.reconcile_requested = self.status_file is not None
+        return self.reconcile_requested
+
+    def reconcile_with_status_file(self):
+        """ Replaces the clients without events since the last status file
+            rewrite by the content of the status file"""
+        self.reconcile_requested = False
+        mtime = os.path.getmtime(self.status_file)
+        clients = extract_zones_from_status_file(self.status_file)
+        with self.lock:
+            for name in set(self.current) | set(clients):
+                if self.event_times.get(name, 0) > mtime:
+                    continue  # the status file is older than the event
+                self.pending.add(name)
+                if name in clients:
+                    self.current[name] = list(clients[name])
+                else:
+                    del self.current[name]
+            self.owners = {address: name
+                           for name, addresses in self.current.items()
+                           for address in addresses}
+            self.event_times = {name: event_time for name, event_time
+                                in self.event_times.items()
+                                if event_time > mtime}
+
+    def take_pending(self):
+        if self.reconcile_requested:
+            self.reconcile_with_status_file()
+        with self.lock:
+            pending, self.pending = self.pending, set()
+            return {name: list(self.current[name])
+                    if name in self.current else None for name in pending}
+
+
+class EventProtocol(basic.LineOnlyReceiver):
+    """ Receives the events of the hook scripts, one per line. The fields
+        are separated by tabs::
+
+            add <instance> <common name> [<address> ...]
+            remove <instance> <common name> [<address> ...]
+
+        A remove event without addresses removes the client, the common name
+        ``-`` removes the addresses from any client."""
+    delimiter = b'\n'
+    MAX_LENGTH = 4096
+
+    def lineReceived(self, line):
+        fields = line.rstrip(b'\r').decode('utf-8', 'replace').split('\t')
+        try:
+            self.factory.eventReceived(*fields)
+        except (TypeError, ValueError, KeyError) as e:
+            print('invalid client event {0!r}: {1}'.format(line, e))
+
+
+class EventFactory(protocol.ServerFactory):
+    """ Factory for the connections to the event socket.
+
+        :param dict sources: instance name to :class:`EventSource`"""
+    protocol = EventProtocol
+    noisy = False
+
+    def __init__(self, sources):
+        self.sources = sources
+
+    def eventReceived(self, event, instance, name, *addresses):
+        source = self.sources[instance]
+        if event not in ('add', 'remove'):
+            raise ValueError('unknown event {0}'.format(event))
+        if name == '-' and (event == 'add' or not addresses):
+            raise ValueError('common name needed')
+        parsed = [parse_address(address) for address in addresses]
+        # subnets (iroutes) and MAC addresses are not served:
+        parsed = [address for address in parsed if address is not None]
+        if addresses and not parsed:
+            return
+        if event == 'add':
+            source.add(name, parsed)
+        else:
+            source.remove(None if name == '-' else name, parsed or None)
@@ -0,0 +1,216 @@
+from twisted.internet import protocol
+from twisted.protocols import basic
+
+from statusfile import ClientListSource, parse_address
+
+
+class ManagementProtocol(basic.LineOnlyReceiver):
+    """ Client side of the openvpn management interface.
+
+        After connecting, the complete client list is requested with
+        ``status 3``. Afterwards the real-time ``>CLIENT:ESTABLISHED``,
+        ``>CLIENT:ADDRESS`` and ``>CLIENT:DISCONNECT`` notifications are
+        passed to the factory (:class:`ManagementSource`)."""
+    delimiter = b'\n'
+    MAX_LENGTH = 65536
+
+    def connectionMade(self):
+        # lines of the requested client list (None once it is received):
+        self.status = []
+        # (event, client id) of the notification whose ENV lines are read:
+        self.event = None
+        self.env = {}
+        self.factory.resetDelay()
+        self.sendLine(b'status 3')
+
+    def lineReceived(self, line):
+        line = line.rstrip(b'\r')
+        if line.startswith(b'>'):
+            self.notificationReceived(line[1:])
+        elif self.status is not None:
+            if line == b'END':
+                lines, self.status = self.status, None
+                self.factory.synchronize(lines)
+            else:
+                self.status.append(line)
+        elif line.startswith(b'ERROR:'):
+            print('openvpn management interface: {0}'.format(
+                  line.decode('utf-8', 'replace')))
+
+    def notificationReceived(self, line):
+        source, _, data = line.partition(b':')
+        if source != b'CLIENT':  # INFO, LOG, BYTECOUNT ...
+            return
+        event, _, arguments = data.partition(b',')
+        try:
+            if event == b'ENV':
+                self.envReceived(arguments)
+            elif event in (b'ESTABLISHED', b'DISCONNECT', b'CONNECT',
+                           b'REAUTH', b'CR_RESPONSE'):
+                self.event = (event, int(arguments.split(b',', 1)[0]))
+                self.env = {}
+            elif event == b'ADDRESS':
+                cid, address = arguments.split(b',')[:2]
+                self.factory.clientAddress(int(cid), address.decode('utf-8'))
+        except ValueError:
+            print('invalid openvpn management notification: {0}'.format(
+                  line.decode('utf-8', 'replace')))
+
+    def envReceived(self, variable):
+        if self.event is None:
+            return
+        if variable != b'END':
+            name, _, value = variable.partition(b'=')
+            self.env[name] = value.decode('utf-8')
+            return
+        (event, cid), self.event = self.event, None
+        env, self.env = self.env, {}
+        if event == b'ESTABLISHED':
+            self.factory.clientEstablished(cid, env)
+        elif event == b'DISCONNECT':
+            self.factory.clientDisconnected(cid)
+
+
+class ManagementSource(protocol.ReconnectingClientFactory,
+                       ClientListSource):
+    """ Client list of one openvpn instance, maintained from the
+        notifications of its management interface (handled in the reactor
+        thread). The connection is reestablished with exponential backoff,
+        every (re)connect synchronizes the complete client list.
+
+        :param address: (host, port) tuple or path of the unix socket of the
+            management interface
+        :param callable changed: called after every change of the client list
+        :param clock: reactor (for connecting)"""
+    protocol = ManagementProtocol
+    maxDelay = 30
+    noisy = False
+
+    def __init__(self, address, changed=None, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.address = address
+        self.changed = changed
+        self.clock = clock
+        ClientListSource.__init__(self)
+        # client id -> [common name (None until established), addresses]:
+        self.connections = {}
+        # common name -> client ids:
+        self.names = {}
+        # address -> client id:
+        self.owners = {}
+
+    def start(self):
+        """ Connects to the management interface"""
+        if isinstance(self.address, tuple):
+            return self.clock.connectTCP(self.address[0], self.address[1], self)
+        return self.clock.connectUNIX(self.address, self)
+
+    def clientConnectionFailed(self, connector, reason):
+        print('connecting openvpn management interface {0} failed: {1}'.format(
+              self.address, reason.getErrorMessage()))
+        protocol.ReconnectingClientFactory.clientConnectionFailed(
+            self, connector, reason)
+
+    def touch(self, names):
+        """ Records the current address lists of the clients"""
+        names = [name for name in names if name is not None]
+        if not names:
+            return
+        with self.lock:
+            for name in names:
+                cids = self.names.get(name)
+                if not cids:
+                    self.pending[name] = None
+                    continue
+                addresses = []
+                for cid in cids:
+                    for address in self.connections[cid][1]:
+                        if address not in addresses:
+                            addresses.append(address)
+                self.pending[name] = addresses
+        if self.changed is not None:
+            self.changed()
+
+    def connect(self, cid, name):
+        connection = self.connections.setdefault(cid, [None, []])
+        if connection[0] is not None and connection[0] != name:
+            self.names[connection[0]].remove(cid)
+        connection[0] = name
+        if cid not in self.names.setdefault(name, []):
+            self.names[name].append(cid)
+        return connection
+
+    def learn(self, cid, address):
+        """ Moves the address to the connection, returns the common name of
+            its previous connection"""
+        previous = self.owners.get(address)
+        self.owners[address] = cid
+        self.connections[cid][1].append(address)
+        if previous is None or previous == cid:
+            return None
+        self.connections[previous][1].remove(address)
+        return self.connections[previous][0]
+
+    def clientEstablished(self, cid, env):
+        name = env.get(b'common_name')
+        if not name:
+            return
+        connection = self.connect(cid, name)
+        touched = {name}
+        for variable in (b'ifconfig_pool_remote_ip', b'ifconfig_pool_remote_ip6'):
+            address = parse_address(env.get(variable, ''))
+            if address is not None and address not in connection[1]:
+                touched.add(self.learn(cid, address))
+        self.touch(touched)
+
+    def clientAddress(self, cid, text):
+        """ Handles an address learned for a client - possibly before its
+            connection is established"""
+        address = parse_address(text)
+        if address is None:  # subnet or MAC address
+            return
+        connection = self.connections.setdefault(cid, [None, []])
+        if address not in connection[1]:
+            self.touch({connection[0], self.learn(cid, address)})
+
+    def clientDisconnected(self, cid):
+        connection = self.connections.pop(cid, None)
+        if connection is None:
+            return
+        name, addresses = connection
+        for address in addresses:
+            if self.owners.get(address) == cid:
+                del self.owners[address]
+        if name is not None:
+            self.names[name].remove(cid)
+            if not self.names[name]:
+                del self.names[name]
+        self.touch({name})
+
+    def synchronize(self, lines):
+        """ Replaces the client state with the content of a ``status 3``
+            response"""
+        touched = set(self.names)
+        self.connections.clear()
+        self.names.clear()
+        self.owners.clear()
+        cid_column = None
+        for line in lines:
+            fields = line.decode('utf-8').split('\t')
+            if fields[0] == 'HEADER' and fields[1:2] == ['CLIENT_LIST']:
+                if 'Client ID' in fields:
+                    cid_column = fields.index('Client ID') - 1
+            elif fields[0] == 'CLIENT_LIST':
+                name = fields[1]
+                try:
+                    cid = int(fields[cid_column])
+                except (TypeError, IndexError, ValueError):
+                    cid = ('status', name)  # openvpn before 2.4
+                self.connect(cid, name)
+            elif fields[0] == 'ROUTING_TABLE' and len(fields) > 2:
+                address = parse_address(fields[1])
+                cids = self.names.get(fields[2])
+                if address is not None and cids:
+                    self.learn(cids[0], address)
+        self.touch(touched | set(self.names))
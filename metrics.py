@@ -0,0 +1,209 @@
+import bisect
+import time
+
+from twisted.internet import protocol
+from twisted.names import dns
+from twisted.protocols import basic
+
+
+# upper bounds (seconds) of the latency histogram buckets:
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1)
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                    30)
+
+QTYPE_NAMES = dict(dns.QUERY_TYPES)
+QTYPE_NAMES.update(dns.EXT_QUERIES)
+RCODE_NAMES = {dns.OK: 'NOERROR', dns.EFORMAT: 'FORMERR',
+               dns.ESERVER: 'SERVFAIL', dns.ENAME: 'NXDOMAIN',
+               dns.ENOTIMP: 'NOTIMP', dns.EREFUSED: 'REFUSED'}
+
+
+def format_label(value):
+    if value is None:
+        return ''
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', 'replace')
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, format_label(value))
+                          for name, value in zip(names, values)) + '}'
+
+
+class Counter(object):
+    """ Monotonic counter per label value tuple"""
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name, format_labels(self.labels, labels), value
+
+
+class Histogram(object):
+    """ Histogram with fixed buckets per label value tuple"""
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, value, labels=()):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def samples(self):
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield (self.name + '_bucket',
+                       format_labels(self.labels + ('le',), labels + (bound,)),
+                       cumulative)
+            label_text = format_labels(self.labels, labels)
+            yield self.name + '_sum', label_text, total
+            yield self.name + '_count', label_text, cumulative
+
+
+class Collector(object):
+    """ Metric whose values are determined at scrape time.
+
+        :param callable callback: returns (label values, value) tuples"""
+    def __init__(self, name, help, type, labels, callback):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.labels = labels
+        self.callback = callback
+
+    def samples(self):
+        for labels, value in self.callback():
+            yield self.name, format_labels(self.labels, labels), value
+
+
+class Metrics(object):
+    """ Registry of all metrics, rendered in the Prometheus text format.
+
+        Updating counters and histograms costs a dictionary lookup and (for
+        histograms) one bisect - they run in the reactor thread only and
+        need no locking."""
+    def __init__(self):
+        self.metrics = []
+        self.queries = self.counter(
+            'openvpn2dns_queries_total', 'Answered DNS queries',
+            ('zone', 'qtype', 'rcode'))
+        self.latency = self.histogram(
+            'openvpn2dns_response_seconds',
+            'Time between receiving a query and sending the response',
+            ('transport', ))
+        self.truncations = self.counter(
+            'openvpn2dns_truncated_total',
+            'UDP responses truncated to the payload size of the client')
+        self.tcp_retries = self.counter(
+            'openvpn2dns_tcp_retries_total',
+            'TCP queries repeating a truncated UDP query')
+        self.reload_duration = self.histogram(
+            'openvpn2dns_reload_seconds', 'Duration of the reload phases',
+            ('instance', 'phase'), buckets=DURATION_BUCKETS)
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collect(self, name, help, type, labels, callback):
+        return self.register(Collector(name, help, type, labels, callback))
+
+    def observe_query(self, zone, qtype, rcode, received, tcp):
+        """ Counts one answered query.
+
+            :param zone: name of the answering zone (or None)
+            :param float received: time stamp of the query (time.time())"""
+        key = (zone, QTYPE_NAMES.get(qtype, qtype),
+               RCODE_NAMES.get(rcode, rcode))
+        queries = self.queries.values
+        queries[key] = queries.get(key, 0) + 1
+        if received is not None:
+            self.latency.observe(time.time() - received,
+                                 ('tcp', ) if tcp else ('udp', ))
+
+    def observe_reload(self, instance, timings):
+        """ Records the durations of the reload phases of an instance
+
+            :param dict timings: phase name to duration in seconds"""
+        for phase, duration in timings.items():
+            self.reload_duration.observe(duration, (instance, phase))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP {0} {1}'.format(metric.name, metric.help))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric.type))
+            for name, labels, value in metric.samples():
+                lines.append('{0}{1} {2}'.format(name, labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsProtocol(basic.LineReceiver):
+    """ Minimal HTTP/1.0 server answering ``GET /metrics``"""
+    MAX_LENGTH = 8192
+
+    def connectionMade(self):
+        self.request = None
+
+    def lineReceived(self, line):
+        if self.request is None:
+            self.request = line.split()
+            return
+        if line:  # header
+            return
+        if len(self.request) >= 2 and self.request[0] in (b'GET', b'HEAD') \
+                and self.request[1].split(b'?')[0] == b'/metrics':
+            body = self.factory.metrics.render().encode('utf-8')
+            self.respond(b'200 OK', body, self.request[0] == b'HEAD')
+        else:
+            self.respond(b'404 Not Found', b'not found\n')
+
+    def respond(self, status, body, head=False):
+        self.transport.write(b'HTTP/1.0 ' + status + b'\r\n'
+                             b'Content-Type: text/plain; version=0.0.4\r\n'
+                             b'Content-Length: ' + str(len(body)).encode() +
+                             b'\r\nConnection: close\r\n\r\n')
+        if not head:
+            self.transport.write(body)
+        self.transport.loseConnection()
+
+    def lineLengthExceeded(self, line):
+        self.transport.loseConnection()
+
+
+class MetricsFactory(protocol.ServerFactory):
+    protocol = MetricsProtocol
+    noisy = False
+
+    def __init__(self, metrics):
+        self.metrics = metrics
@@ -0,0 +1,171 @@
+import random
+import socket
+
+from twisted.internet import abstract
+from twisted.internet import defer
+from twisted.names import dns
+
+
+class PendingNotify(object):
+    """ Notify of one zone to one slave that is not acknowledged yet.
+
+        :ivar int id: message id of the last sent notify
+        :ivar int attempts: number of sent notifies for the current serial"""
+    __slots__ = ('server', 'zone', 'soa', 'id', 'attempts', 'timer', 'address')
+
+    def __init__(self, server, zone, soa):
+        self.server = server
+        self.zone = zone
+        self.soa = soa
+        self.id = None
+        self.attempts = 0
+        self.timer = None
+        self.address = None
+
+
+class NotifyDispatcher(object):
+    """ Sends the zone change notifies (RFC 1996) to the slave servers.
+
+        All notifies are sent through one UDP socket per address family.
+        There is at most one pending notify per slave and zone: a newer
+        zone version replaces the pending notify. Unacknowledged notifies
+        are retransmitted with exponential backoff.
+
+        :param float timeout: time to wait for the first acknowledgement
+        :param int max_attempts: number of sent notifies before giving up
+        :param clock: reactor (for timers and sockets)
+        :ivar int sent: number of sent notifies (including retransmits)
+        :ivar int acked: number of acknowledged notifies
+        :ivar int retried: number of retransmits
+        :ivar int failed: number of notifies given up or rejected"""
+    def __init__(self, timeout=2, max_attempts=5, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.pending = {}
+        self.ids = {}
+        self.protocols = {}
+        self.sent = 0
+        self.acked = 0
+        self.retried = 0
+        self.failed = 0
+
+    def notify(self, server, zone, soa=None):
+        """ Notifies the slave server about a new version of the zone.
+
+            :param tuple server: host name or address and port of the slave
+            :param bytes zone: zone name
+            :param soa: new SOA record of the zone (sent in the answer
+                section)"""
+        key = (server, zone)
+        pending = self.pending.get(key)
+        if pending is not None:
+            self.cancel(pending)
+        pending = self.pending[key] = PendingNotify(server, zone, soa)
+        d = self.resolve(server[0])
+        d.addCallback(self.resolved, pending)
+        d.addErrback(self.resolveFailed, pending)
+
+    def resolve(self, host):
+        if abstract.isIPAddress(host) or abstract.isIPv6Address(host):
+            return defer.succeed(host)
+        return self.clock.resolve(host)
+
+    def resolved(self, address, pending):
+        if self.pending.get((pending.server, pending.zone)) is not pending:
+            return  # replaced by a newer notify in the meantime
+        pending.address = (address, pending.server[1])
+        self.send(pending)
+
+    def resolveFailed(self, reason, pending):
+        print('Could not resolve notify target {0}: {1}'.format(
+              pending.server[0], reason.getErrorMessage()))
+        if self.pending.get((pending.server, pending.zone)) is pending:
+            self.failed += 1
+            self.cancel(pending)
+
+    def protocolFor(self, address):
+        """ Returns the (shared) protocol for the address family of address"""
+        family = socket.AF_INET6 if ':' in address else socket.AF_INET
+        protocol = self.protocols.get(family)
+        if protocol is None:
+            protocol = dns.DNSDatagramProtocol(self)
+            self.clock.listenUDP(0, protocol, interface='::'
+                                 if family == socket.AF_INET6 else '')
+            self.protocols[family] = protocol
+        return protocol
+
+    def send(self, pending):
+        if pending.id is not None:
+            self.ids.pop(pending.id, None)
+        pending.id = self.pickID()
+        self.ids[pending.id] = pending
+        message = dns.Message(pending.id, opCode=dns.OP_NOTIFY, auth=True)
+        message.queries = [dns.Query(pending.zone, dns.SOA, dns.IN)]
+        if pending.soa is not None:
+            message.answers = [dns.RRHeader(pending.zone, dns.SOA, dns.IN,
+                                            0, pending.soa, auth=True)]
+        pending.attempts += 1
+        self.sent += 1
+        try:
+            self.protocolFor(pending.address[0]).writeMessage(
+                message, pending.address)
+        except Exception as e:
+            print('Sending notify to {0} failed: {1}'.format(
+                  pending.server[0], e))
+        pending.timer = self.clock.callLater(
+            self.timeout * 2 ** (pending.attempts - 1), self.retry, pending)
+
+    def pickID(self):
+        while True:
+            id = random.randrange(2 ** 16)
+            if id not in self.ids:
+                return id
+
+    def retry(self, pending):
+        pending.timer = None
+        if pending.attempts >= self.max_attempts:
+            print('Giving up notify of {0} for zone {1}'.format(
+                  pending.server[0], pending.zone))
+            self.failed += 1
+            self.cancel(pending)
+            return
+        self.retried += 1
+        self.send(pending)
+
+    def cancel(self, pending):
+        """ Forgets a pending notify"""
+        if pending.timer is not None and pending.timer.active():
+            pending.timer.cancel()
+        pending.timer = None
+        self.ids.pop(pending.id, None)
+        key = (pending.server, pending.zone)
+        if self.pending.get(key) is pending:
+            del self.pending[key]
+
+    def messageReceived(self, message, protocol, address=None):
+        """ Handles the responses of the slaves (called by
+            :class:`twisted.names.dns.DNSDatagramProtocol`)"""
+        pending = self.ids.get(message.id)
+        if pending is None or not message.answer or \
+                message.opCode != dns.OP_NOTIFY or \
+                address[0] != pending.address[0]:
+            return
+        if message.rCode == dns.OK:
+            self.acked += 1
+        else:
+            print('Notify of {0} for zone {1} rejected (rcode {2})'.format(
+                  pending.server[0], pending.zone, message.rCode))
+            self.failed += 1
+        self.cancel(pending)
+
+    def stop(self):
+        """ Cancels all pending notifies and closes the sockets"""
+        for pending in list(self.pending.values()):
+            self.cancel(pending)
+        for protocol in self.protocols.values():
+            if protocol.transport is not None:
+                protocol.transport.stopListening()
+        self.protocols = {}
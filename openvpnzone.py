@@ -1,109 +1,736 @@
 import os.path
 import signal
+import socket
+import struct
+import tempfile
+import time
+import bisect
+import hashlib
+import itertools
 import collections
+import collections.abc
+import functools
+from io import BytesIO
 
 from twisted.names import dns
 from twisted.names.authority import FileAuthority
-from twisted.names.client import Resolver
 from twisted.internet import inotify
 from twisted.internet import defer
-from twisted.internet.task import deferLater
+from twisted.internet import task
+from twisted.internet import threads
+from twisted.python import failure
 from twisted.python import filepath
-from IPy import IP
-
-
-def extract_zones_from_status_file(status_path):
-    """ Parses a openvpn status file and extracts the list of connected clients
-        and there ip address """
-    with open(status_path, 'r') as status_file:
-        mode = None
-        mode_changes = {
-            'OpenVPN CLIENT LIST': 'clients',
-            'ROUTING TABLE': 'routes',
-            'GLOBAL STATS': None
-        }
-        clients = {}
-        skip_next_lines = 0
-        for status_line in status_file:
-            if skip_next_lines > 0:
-                skip_next_lines -= 1
+
+from address import parse_reverse_name, reverse_name, reverse_name_range
+from dnsserver import AnswerCache
+from events import EventSource
+from management import ManagementSource
+from metrics import Metrics
+from notify import NotifyDispatcher
+from profiling import ProfileSession
+from scheduler import ReloadScheduler
+from snapshot import Snapshot, SnapshotRecords, write_snapshot
+from statusfile import StatusFile
+from statusfile import extract_zones_from_status_file  # noqa: F401
+from zonenames import NameIndex, is_subdomain, serial_newer
+
+
+def record_fingerprint(record):
+    """ Canonical byte representation of one record. The serial of SOA
+        records is left out: a new serial alone is no zone change."""
+    cls = record.__class__
+    if cls is dns.Record_A or cls is dns.Record_AAAA:
+        rdata = record.address
+    elif cls is dns.Record_PTR or cls is dns.Record_NS or cls is dns.Record_CNAME:
+        rdata = record.name.name.lower()
+    elif cls is dns.Record_SOA:
+        rdata = b' '.join((record.mname.name.lower(), record.rname.name.lower(),
+                           struct.pack('!LLLL', record.refresh, record.retry,
+                                       record.expire, record.minimum)))
+    else:
+        strio = BytesIO()
+        record.encode(strio)
+        rdata = strio.getvalue()
+    ttl = record.ttl if record.ttl is not None else -1
+    return struct.pack('!HlH', record.TYPE, ttl, len(rdata)) + rdata
+
+
+def name_digest(name, records):
+    """ Digest over the name and all its records (independent of the record
+        order)"""
+    if not isinstance(name, bytes):
+        name = name.encode('utf-8')
+    fingerprints = [record_fingerprint(record) for record in records]
+    if len(fingerprints) > 1:
+        fingerprints.sort()
+    fingerprints.append(name.lower())
+    return hashlib.blake2b(b''.join(fingerprints), digest_size=16).digest()
+
+
+class ZoneRecords(collections.defaultdict):
+    """ Record dictionary of one zone (lowercase name -> list of records)
+        that carries digests of its content.
+
+        The zone digest is the xor of all name digests. So it does not depend
+        on the name order, and adding or removing one name changes it without
+        a walk over the whole zone.
+
+        :ivar int digest: digest of the whole zone content
+        :ivar dict name_digests: digest per owner name"""
+    def __init__(self, records=()):
+        collections.defaultdict.__init__(self, list, records)
+        self.digest = None
+        self.name_digests = None
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),), self.__dict__)
+
+    def update_digests(self):
+        """ (Re)computes the digests after the records have been changed.
+
+            :return: self"""
+        self.name_digests = {}
+        digest = 0
+        for name, records in self.items():
+            if not records:  # no records, no name
                 continue
-            status_line = status_line.strip()
-            if status_line in mode_changes:
-                mode = mode_changes[status_line]
-                skip_next_lines = 1
-                if mode == 'clients':
-                    skip_next_lines += 1
+            self.name_digests[name] = name_digest(name, records)
+            digest ^= int.from_bytes(self.name_digests[name], 'big')
+        self.digest = digest
+        return self
+
+    def copy(self):
+        records = self.__class__(self)
+        records.digest = self.digest
+        if self.name_digests is not None:
+            records.name_digests = dict(self.name_digests)
+        return records
+
+    @classmethod
+    def of(cls, records):
+        """ Returns a :class:`ZoneRecords` with valid digests for the given
+            record dictionary - ``records`` itself if it has digests already"""
+        if isinstance(records, ZoneRecords) and records.digest is not None:
+            return records
+        return cls(records).update_digests()
+
+    def add(self, name, record):
+        """ Adds one record. The record list of the name is replaced instead of
+            modified, previous references to it stay consistent."""
+        self[name] = self.get(name, []) + [record]
+
+    def remove(self, name, record):
+        """ Removes one record (by identity), see :meth:`add`"""
+        records = [r for r in self.get(name, ()) if r is not record]
+        if records:
+            self[name] = records
+        else:
+            self.pop(name, None)
+
+    def update_names(self, names, digests=None):
+        """ Updates the digests after the records of the given names have
+            been changed.
+
+            :param dict digests: precomputed new name digests (None for
+                removed names)
+            :return: set of the names whose content really changed"""
+        changed = set()
+        for name in names:
+            old_digest = self.name_digests.pop(name, None)
+            if digests is not None:
+                new_digest = digests[name]
+            else:
+                new_digest = name_digest(name, self[name]) \
+                    if self.get(name) else None
+            if old_digest == new_digest:
+                if new_digest is not None:
+                    self.name_digests[name] = new_digest
                 continue
-            if mode == 'clients':
-                clients[status_line.split(',')[0]] = []
-            if mode == 'routes':
-                address, client = status_line.split(',')[0:2]
-                if '/' in address:  # subnet
-                    continue
-                try:
-                    address = IP(address)
-                except ValueError:  # cached route ...
-                    continue
-                if address.len() > 1:  # subnet
-                    continue
-                if client not in clients:
-                    raise ValueError('Error in status file')
-                clients[client].append(address)
-        return clients
+            changed.add(name)
+            if old_digest is not None:
+                self.digest ^= int.from_bytes(old_digest, 'big')
+            if new_digest is not None:
+                self.name_digests[name] = new_digest
+                self.digest ^= int.from_bytes(new_digest, 'big')
+        return changed
+
+    def changed_names(self, other):
+        """ Returns the set of owner names whose records differ between the two
+            record dictionaries"""
+        other = ZoneRecords.of(other)
+        return {name for name, digest in
+                self.name_digests.items() ^ other.name_digests.items()}
+
+
+ADDRESS_FINGERPRINTS = {
+    4: struct.pack('!HlH', dns.A, -1, 4),
+    16: struct.pack('!HlH', dns.AAAA, -1, 16),
+}
+
+
+def pack_addresses(addresses):
+    """ Packs the addresses of one client into one bytes string: every packed
+        address prefixed with its length, sorted.
+
+        :param addresses: packed addresses"""
+    return b''.join(sorted(bytes((len(packed), )) + packed
+                           for packed in addresses))
+
+
+def unpack_addresses(value):
+    """ Returns the packed addresses of a :func:`pack_addresses` string"""
+    addresses = []
+    position = 0
+    while position < len(value):
+        length = value[position]
+        addresses.append(value[position + 1:position + 1 + length])
+        position += 1 + length
+    return addresses
+
+
+def with_name(value, name):
+    """ Adds a name to a reverse client entry (one name or sorted tuple of
+        names)"""
+    if value is None:
+        return name
+    names = value if type(value) is tuple else (value, )
+    if name in names:
+        return value
+    return tuple(sorted(names + (name, )))
+
+
+def without_name(value, name):
+    """ Removes a name from a reverse client entry, see :func:`with_name`"""
+    if type(value) is not tuple:
+        return None if value == name else value
+    names = tuple(other for other in value if other != name)
+    return names if len(names) > 1 else names[0]
+
+
+class ClientRecords(collections.abc.Mapping):
+    """ Record dictionary of one zone (lowercase name -> list of records)
+        that stores the records of the clients compactly: one bytes string
+        or name reference per client entry instead of twisted record objects.
+        The record objects are only created when the records of a name are
+        requested (answer not cached yet, zone transfer).
+
+        The digests are the same as the ones of a :class:`ZoneRecords` with
+        the same content, but only the zone digest is kept. It is computed on
+        first use: reloads compare the client entries directly (see
+        :meth:`changed_names`) and usually never need it.
+
+        :param ZoneRecords static: SOA and configured records
+        :ivar dict clients: client entries (see subclasses)"""
+    def __init__(self, static=None):
+        self.static = ZoneRecords() if static is None else static
+        self.clients = {}
+        self._digest = None
+        self._static_index = None
+        self._index = None
+
+    @property
+    def digest(self):
+        """ Digest of the whole zone content"""
+        if self._digest is None:
+            self.update_digests()
+        return self._digest
+
+    def key(self, name):
+        """ Returns the client key of an owner name (None if the name can not
+            belong to a client)"""
+        raise NotImplementedError()
+
+    def owner(self, key):
+        """ Returns the owner name of a client key"""
+        raise NotImplementedError()
+
+    def client_records(self, value):
+        """ Creates the record objects of a client entry"""
+        raise NotImplementedError()
+
+    def fingerprints(self, value):
+        """ Returns the record fingerprints (see :func:`record_fingerprint`)
+            of a client entry"""
+        raise NotImplementedError()
+
+    def count_records(self, value):
+        """ Returns the number of records of a client entry"""
+        raise NotImplementedError()
+
+    def client_descendants(self, name):
+        """ Whether there are client entries below the (lowercase) name"""
+        raise NotImplementedError()
+
+    def __getitem__(self, name):
+        value = self.clients.get(self.key(name))
+        static = self.static.get(name)
+        if value is None:
+            if static:
+                return static
+            raise KeyError(name)
+        if static:
+            return static + self.client_records(value)
+        return self.client_records(value)
+
+    def __setitem__(self, name, records):
+        """ Sets the static records of a name (e.g. the SOA of the apex)"""
+        self.static[name] = records
+        self._static_index = None
+
+    def __contains__(self, name):
+        return self.key(name) in self.clients or bool(self.static.get(name))
+
+    def static_names(self):
+        """ Returns the names with only static records"""
+        return [name for name, records in self.static.items()
+                if records and self.key(name) not in self.clients]
+
+    def __iter__(self):
+        for name in self.static_names():
+            yield name
+        owner = self.owner
+        for key in self.clients:
+            yield owner(key)
+
+    def __len__(self):
+        return len(self.clients) + len(self.static_names())
+
+    def has_descendants(self, name):
+        """ Whether there are names below the (lowercase) name - e.g. to
+            tell empty non-terminals from non-existing names"""
+        if self._static_index is None:
+            self._static_index = NameIndex(
+                name for name, records in self.static.items() if records)
+        return self._static_index.has_descendants(name) or \
+            self.client_descendants(name)
+
+    def record_count(self):
+        """ Returns the number of records of the zone"""
+        return sum(len(records) for records in self.static.values()) + \
+            sum(map(self.count_records, self.clients.values()))
+
+    def copy(self):
+        records = self.__class__(ZoneRecords(self.static))
+        records.static.digest = self.static.digest
+        records.static.name_digests = self.static.name_digests
+        records.clients = dict(self.clients)
+        records._digest = self._digest
+        return records
+
+    def entry_digest(self, key, value):
+        """ Returns the digest (as integer) of the owner name of key with the
+            client entry value (None for no client entry)"""
+        owner = self.owner(key)
+        static = self.static.get(owner)
+        if static:
+            if value is not None:
+                static = static + self.client_records(value)
+            return int.from_bytes(name_digest(owner, static), 'big')
+        if value is None:
+            return 0
+        fingerprints = self.fingerprints(value)
+        if len(fingerprints) > 1:
+            fingerprints.sort()
+        fingerprints.append(owner)
+        return int.from_bytes(hashlib.blake2b(
+            b''.join(fingerprints), digest_size=16).digest(), 'big')
+
+    def update_digests(self):
+        """ (Re)computes the zone digest after the records have been changed.
+
+            :return: self"""
+        self.static.update_digests()
+        digest = 0
+        for name in self.static_names():
+            digest ^= int.from_bytes(self.static.name_digests[name], 'big')
+        for key, value in self.clients.items():
+            digest ^= self.entry_digest(key, value)
+        self._digest = digest
+        return self
+
+    def digest_change(self, key, value):
+        """ Returns the change (to xor) of the zone digest if the client entry
+            of key is replaced by value (None removes the entry) - None if
+            the digest has not been computed yet"""
+        if self._digest is None:
+            return None
+        return self.entry_digest(key, self.clients.get(key)) ^ \
+            self.entry_digest(key, value)
+
+    def apply(self, changes):
+        """ Replaces client entries in place.
+
+            :param dict changes: key to (new value or None, digest change)
+                tuples, see :meth:`digest_change` (a change of None drops the
+                digest, it is recomputed on demand)
+            :return: the set of changed names and the record lists of these
+                names before the change"""
+        changed = set()
+        previous = {}
+        for key, (value, digest_change) in changes.items():
+            old_value = self.clients.get(key)
+            if old_value == value:
+                continue
+            owner = self.owner(key)
+            previous[owner] = self.get(owner, ())
+            if value is None:
+                del self.clients[key]
+            else:
+                self.clients[key] = value
+            self._index = None
+            if self._digest is not None:
+                self._digest = None if digest_change is None \
+                    else self._digest ^ digest_change
+            changed.add(owner)
+        return changed, previous
+
+    def changed_names(self, other):
+        """ Returns the set of owner names whose records differ between the two
+            record dictionaries"""
+        if other.__class__ is not self.__class__:
+            return ZoneRecords(self).update_digests().changed_names(other)
+        names = ZoneRecords.of(self.static).changed_names(other.static)
+        owner = self.owner
+        clients, other_clients = self.clients, other.clients
+        for key in clients.keys() ^ other_clients.keys():
+            names.add(owner(key))
+        for key, value in clients.items():
+            other_value = other_clients.get(key)
+            if other_value is not None and other_value != value:
+                names.add(owner(key))
+        return names
+
+
+class ForwardRecords(ClientRecords):
+    """ Forward zone: the client entries map the client names to their
+        addresses (see :func:`pack_addresses`)"""
+    def key(self, name):
+        return name
+
+    def owner(self, key):
+        return key
+
+    def client_records(self, value):
+        return [dns.Record_A(socket.inet_ntop(socket.AF_INET, packed))
+                if len(packed) == 4 else
+                dns.Record_AAAA(socket.inet_ntop(socket.AF_INET6, packed))
+                for packed in unpack_addresses(value)]
+
+    def fingerprints(self, value):
+        return [ADDRESS_FINGERPRINTS[len(packed)] + packed
+                for packed in unpack_addresses(value)]
+
+    def count_records(self, value):
+        return len(unpack_addresses(value))
+
+    def client_descendants(self, name):
+        if self._index is None:
+            self._index = NameIndex(self.clients)
+        return self._index.has_descendants(name)
+
+    def add(self, name, addresses):
+        """ Adds addresses of a client
+
+            :param list addresses: packed addresses"""
+        current = self.clients.get(name)
+        if current is not None:
+            addresses = unpack_addresses(current) + list(addresses)
+        self.clients[name] = pack_addresses(addresses)
+        self._index = None
+
+
+class ReverseRecords(ClientRecords):
+    """ Reverse zone: the client entries map the packed addresses to the
+        client name (or a sorted tuple of names if multiple clients use the
+        same address). The names are shared with the forward zone."""
+    def key(self, name):
+        return parse_reverse_name(name)
+
+    def owner(self, key):
+        return reverse_name(key)
+
+    def client_records(self, value):
+        if type(value) is tuple:
+            return [dns.Record_PTR(name) for name in value]
+        return [dns.Record_PTR(value)]
+
+    def fingerprints(self, value):
+        return [struct.pack('!HlH', dns.PTR, -1, len(name)) + name
+                for name in (value if type(value) is tuple else (value, ))]
+
+    def count_records(self, value):
+        return len(value) if type(value) is tuple else 1
+
+    def client_descendants(self, name):
+        bounds = reverse_name_range(name)
+        if bounds is None or bounds[0] == bounds[1]:
+            return False
+        if self._index is None:  # sorted packed addresses
+            self._index = sorted(self.clients)
+        position = bisect.bisect_left(self._index, bounds[0])
+        return position < len(self._index) and \
+            self._index[position] <= bounds[1]
+
+    def add(self, packed, name):
+        """ Adds the reverse entry of one client address"""
+        self.clients[packed] = with_name(self.clients.get(packed), name)
+        self._index = None
+
+
+def zone_digest(records):
+    """ Returns the digest of a record dictionary (computed if needed)"""
+    if isinstance(records, ClientRecords):
+        return records.digest
+    if getattr(records, 'digest', None) is not None:
+        return records.digest
+    return ZoneRecords.of(records).digest
+
+
+def count_records(records):
+    """ Returns the number of records of a record dictionary"""
+    if isinstance(records, ClientRecords):
+        return records.record_count()
+    return sum(map(len, records.values()))
+
+
+def diff_names(records, other):
+    """ Returns the set of owner names whose records differ between the two
+        record dictionaries"""
+    if isinstance(records, ClientRecords):
+        return records.changed_names(other)
+    return ZoneRecords.of(records).changed_names(other)
+
+
+JournalEntry = collections.namedtuple('JournalEntry', ('old_soa', 'new_soa',
+                                                       'deleted', 'added'))
 
 
 class InMemoryAuthority(FileAuthority):
-    """ In memory authority class - handles the data of one zone"""
-    def __init__(self, data=None):
+    """ In memory authority class - handles the data of one zone
+
+        Every update is recorded in a bounded journal (deleted and added
+        records per serial) to answer incremental zone transfers.
+
+        :param int journal_size: number of zone versions kept in the journal
+        :ivar set changed_names: owner names changed by the last update (None
+            after the initial data)"""
+    def __init__(self, data=None, journal_size=100):
+        self.changed_names = None
+        self.name_index = None
+        self.journal = collections.deque(maxlen=journal_size)
+        self.answer_cache = AnswerCache()
         FileAuthority.__init__(self, data)
 
     def loadFile(self, data):
         if type(data) is tuple and len(data) == 2:
             self.setData(*data)
 
-    def setData(self, soa, records):
+    def setData(self, soa, records, changed_names=None):
         """ set authority data
 
             :param twisted.names.dns.Record_SOA soa: SOA record for this zone.
                 you must add the soa to the records list yourself!!
             :param dict records: dictionary with record entries for this
-                domain."""
-        if soa == self.soa or self.changed(soa, records) is False:
+                domain.
+            :param set changed_names: the names whose records differ from the
+                current records, if already known (an empty set skips the
+                digest comparison)"""
+        if soa == self.soa:
+            return False
+        if changed_names is not None and self.records is not None:
+            if not changed_names:
+                return False
+        elif self.changed(soa, records) is False:
             return False
+        if changed_names is not None and self.records is not None:
+            self.changed_names = set(changed_names)
+        elif self.records is not None:
+            self.changed_names = diff_names(self.records, records)
+        else:
+            self.changed_names = None
         if type(soa) is tuple:
-            print('updated zone {0} to serial {1}'.format(soa[0], soa[1].serial))
+            print('updated zone {0} to serial {1}{2}'.format(
+                soa[0], soa[1].serial,
+                '' if self.changed_names is None else
+                ' ({0} names changed)'.format(len(self.changed_names))))
+        old_soa, previous = self.soa, self.records
         self.soa = soa
         self.records = records
+        self.name_index = None
+        self.answer_cache.clear()
+        self.addJournalEntry(old_soa, previous)
+        return True
+
+    def patchData(self, soa, changed_names, previous):
+        """ Sets a new SOA after the records of :attr:`records` have been
+            patched in place (see :meth:`ZoneRecords.update_names`).
+
+            :param tuple soa: zone name and new SOA record
+            :param set changed_names: names whose records have changed
+            :param dict previous: the record lists of the changed names before
+                they were patched
+            :return: whether the zone has changed"""
+        if not changed_names:
+            return False
+        apex = soa[0].lower()
+        self.records[apex] = [soa[1] if record is self.soa[1] else record
+                              for record in self.records.get(apex, ())]
+        self.changed_names = set(changed_names)
+        print('updated zone {0} to serial {1} ({2} names changed)'.format(
+            soa[0], soa[1].serial, len(self.changed_names)))
+        old_soa = self.soa
+        self.soa = soa
+        self.name_index = None
+        self.answer_cache.clear()
+        self.addJournalEntry(old_soa, previous)
         return True
 
+    def takeOver(self, records):
+        """ Replaces the records by an equal record dictionary (e.g. the
+            rebuilt zone of a loaded snapshot). The zone version and its SOA
+            record stay the same."""
+        apex = self.soa[0].lower()
+        records[apex] = [self.soa[1] if record.TYPE == dns.SOA else record
+                         for record in records.get(apex, ())]
+        self.records = records
+        self.name_index = None
+
+    def inherit(self, other):
+        """ Continues the zone of another authority (e.g. of a recreated
+            instance): its current version, a copy of its records and its
+            journal are taken over."""
+        self.soa = other.soa
+        self.records = None if other.records is None else other.records.copy()
+        self.name_index = None
+        self.answer_cache.clear()
+        self.journal.extend(other.journal)
+
+    def resizeJournal(self, size):
+        """ Changes the number of zone versions kept in the journal (the
+            oldest entries are dropped)"""
+        self.journal = collections.deque(self.journal, maxlen=size)
+
+    def addJournalEntry(self, old_soa, previous):
+        """ Records the differences of the last update in the journal.
+
+            :param tuple old_soa: zone name and SOA before the update
+            :param dict previous: record dictionary before the update (only
+                the entries of :attr:`changed_names` are needed)"""
+        if self.journal.maxlen == 0:
+            return
+        if self.changed_names is None or type(old_soa) is not tuple:
+            self.journal.clear()  # the history is not continuous anymore
+            return
+        deleted = []
+        added = []
+        for name in self.changed_names:
+            old = {record_fingerprint(record): record
+                   for record in previous.get(name, ())
+                   if record.TYPE != dns.SOA}
+            new = {record_fingerprint(record): record
+                   for record in self.records.get(name, ())
+                   if record.TYPE != dns.SOA}
+            deleted += [(name, old[key]) for key in old if key not in new]
+            added += [(name, new[key]) for key in new if key not in old]
+        self.journal.append(JournalEntry(old_soa[1], self.soa[1],
+                                         deleted, added))
+
+    def _header(self, name, record):
+        if record.ttl is not None:
+            ttl = record.ttl
+        else:
+            ttl = max(self.soa[1].minimum, self.soa[1].expire)
+        return dns.RRHeader(name, record.TYPE, dns.IN, ttl, record, auth=True)
+
+    def iterateZone(self):
+        """ Returns an iterator over the resource records of a complete zone
+            transfer (AXFR): the SOA record, all other records and the SOA
+            record again. The record headers are created while iterating.
+            The iterator works on a copy of the record dictionary (not of
+            the records), zone updates during a transfer do not affect it."""
+        zone_name, soa = self.soa
+        default_ttl = max(soa.minimum, soa.expire)
+        soa_header = dns.RRHeader(zone_name, dns.SOA, dns.IN,
+                                  soa.ttl if soa.ttl is not None
+                                  else default_ttl, soa, auth=True)
+        records = self.records.copy()
+
+        def headers():
+            for name, name_records in records.items():
+                for record in name_records:
+                    if record.TYPE != dns.SOA:
+                        yield dns.RRHeader(name, record.TYPE, dns.IN,
+                                           record.ttl if record.ttl is not None
+                                           else default_ttl, record, auth=True)
+        return itertools.chain((soa_header, ), headers(), (soa_header, ))
+
+    def lookupZone(self, name, timeout=10):
+        name = dns.domainString(name)
+        if self.soa is None or self.soa[0].lower() != name.lower():
+            return defer.fail(failure.Failure(dns.DomainError(name)))
+        return defer.succeed((list(self.iterateZone()), (), ()))
+
+    def lookupIncrementalZone(self, name, serial, timeout=10):
+        """ Determines the records of an incremental zone transfer (IXFR,
+            RFC 1995) starting from the given serial. Falls back to a
+            complete zone transfer if the serial is not in the journal
+            anymore.
+
+            :param bytes name: zone name
+            :param int serial: serial of the zone version known to the client
+            :return: deferred firing with the answer, authority, additional
+                tuple of a zone transfer"""
+        name = dns.domainString(name)
+        if self.soa is None or self.soa[0].lower() != name.lower():
+            return defer.fail(failure.Failure(dns.DomainError(name)))
+        soa_header = self._header(self.soa[0], self.soa[1])
+        if serial == self.soa[1].serial or serial_newer(serial, self.soa[1].serial):
+            return defer.succeed(([soa_header], (), ()))
+        entries = []
+        for entry in self.journal:
+            if entries or entry.old_soa.serial == serial:
+                entries.append(entry)
+        if not entries:
+            return self.lookupZone(name, timeout)
+        answers = [soa_header]
+        for entry in entries:
+            answers.append(self._header(self.soa[0], entry.old_soa))
+            answers.extend(self._header(n, r) for n, r in entry.deleted)
+            answers.append(self._header(self.soa[0], entry.new_soa))
+            answers.extend(self._header(n, r) for n, r in entry.added)
+        answers.append(soa_header)
+        return defer.succeed((answers, (), ()))
+
+    def lookupNegative(self, name):
+        """ Classifies a name without records in the zone, cheaper than a
+            lookup: the names below the name are found in a sorted index
+            (built on first use per zone version).
+
+            :return: ``dns.ENAME`` for names that do not exist,
+                ``dns.OK`` for empty non-terminals (names without records
+                but with names below them) and None for names with records
+                or outside of the zone"""
+        if self.soa is None:
+            return None
+        name = name.lower()
+        if name in self.records or not is_subdomain(name, self.soa[0]):
+            return None
+        if hasattr(self.records, 'has_descendants'):  # not a plain dict
+            nonterminal = self.records.has_descendants(name)
+        else:
+            if self.name_index is None:
+                self.name_index = NameIndex(
+                    name.lower() for name, records in self.records.items()
+                    if records)
+            nonterminal = self.name_index.has_descendants(name)
+        return dns.OK if nonterminal else dns.ENAME
+
     def changed(self, soa, records):
-        """ Checks whether the new record list differs from the old one"""
+        """ Checks whether the new record list differs from the old one.
+            Constant time for record dictionaries with digests."""
         if self.records is None:  # previously set data
             return True
-        if len(self.records) != len(records):
-            return True
-        for name in self.records:
-            if name not in records:
-                return True
-            if len(self.records[name]) != len(records[name]):
-                return True
-            for record in self.records[name]:
-                for new_record in records[name]:
-                    if new_record == record:
-                        break
-                    if new_record.__class__ is dns.Record_SOA and \
-                            record.__class__ is dns.Record_SOA and \
-                            new_record.mname == record.mname and \
-                            new_record.rname == record.rname and \
-                            new_record.refresh == record.refresh and \
-                            new_record.retry == record.retry and \
-                            new_record.expire == record.expire and \
-                            new_record.minimum == record.minimum:
-                        break
-                else:
-                    return True
-        return False
+        return zone_digest(self.records) != zone_digest(records)
 
 
 AuthorityTuple = collections.namedtuple('AuthorityTuple', ('forward',
@@ -111,46 +738,314 @@ AuthorityTuple = collections.namedtuple('AuthorityTuple', ('forward',
 
 
 class OpenVpnAuthorityHandler(list):
+    # instance options whose change needs new authorities and client sources
+    # (all other changes except the UPDATE_OPTIONS rebuild the zones):
+    RECREATE_OPTIONS = ('status_file', 'management', 'events', 'subnet4',
+                        'subnet6')
+    # instance options applied without touching the zones:
+    UPDATE_OPTIONS = ('notify', 'journal_size')
+
     def __init__(self, config):
         self.config = config
         self.send_notify = False
+        self.notifier = NotifyDispatcher()
+        self.metrics = Metrics()
+        self.profiler = None
+        # callables informed about every new zone version (authority):
+        self.listeners = []
+        # callables informed after zones were added or removed (with the
+        # handler itself):
+        self.zone_set_listeners = []
         # authorities for the data itself:
         self.authorities = {}
-        for instance in self.config.instances:
-            self.authorities[instance] = AuthorityTuple(
-                forward=InMemoryAuthority(),
-                backward4=InMemoryAuthority(),
-                backward6=InMemoryAuthority()
-            )
-            self.append(self.authorities[instance].forward)
-            if self.config.instances[instance].subnet4:
-                self.append(self.authorities[instance].backward4)
-            if self.config.instances[instance].subnet6:
-                self.append(self.authorities[instance].backward6)
-        # load data:
-        self.loadInstances()
-        # watch for file changes:
+        # client list sources (status file, management interface or events):
+        self.status_files = {}
+        # status file path -> instance:
+        self.status_paths = {}
+        # instance name -> events.EventSource (fed by the event socket):
+        self.event_sources = {}
+        # instance name -> connector of its management interface connection:
+        self.connectors = {}
+        # instances whose zones can be patched with client deltas:
+        self.patchable = set()
+        # instances whose zones must be rebuilt by the next reload (changed
+        # configuration):
+        self.outdated = set()
+        # authorities with zone versions not yet written to the state
+        # directory:
+        self.unsaved = set()
+        # running snapshot write (Deferred) or None:
+        self.saving = None
+        self.inotify = None
+        for instance in self.config.instances.values():
+            self.add_instance(instance)
+        options = dict(min_delay=config.reload_min_delay,
+                       max_delay=config.reload_max_delay,
+                       max_concurrent=config.max_concurrent_reloads)
+        self.scheduler = ReloadScheduler(self.status_file_change_done, **{
+            name: value for name, value in options.items()
+            if value is not None})
+        # load data - instances with zone snapshots are served from them
+        # until their client lists are read in the background:
+        for instance in self.config.instances.values():
+            if not self.load_snapshots(instance):
+                self.loadInstance(instance)
+            elif instance.management is None:  # read after connecting
+                self.scheduler.changed(instance, 'warm start')
+        self.register_metrics()
         signal.signal(signal.SIGUSR1, self.handle_signal)
-        notifier = inotify.INotify()
-        notifier.startReading()
+        signal.signal(signal.SIGUSR2, self.handle_profile_signal)
+        signal.signal(signal.SIGHUP, self.handle_reload_signal)
+        self.inotify = inotify.INotify()
+        self.inotify.startReading()
         for instance in self.config.instances.values():
-            notifier.watch(filepath.FilePath(instance.status_file),
-                           callbacks=[self.status_file_changed])
+            self.watch_instance(instance)
+        # repair missed events:
+        self.reconciler = task.LoopingCall(self.reconcile_events)
+        self.update_reconciler()
+        self.persister = task.LoopingCall(self.save_snapshots)
+        interval = config.snapshot_interval
+        if interval is None:
+            interval = 60
+        if config.state_directory is not None and interval > 0:
+            self.persister.start(interval, now=False)
         print('Serving {0} zones: {1}'.format(len(self),
               ', '.join([z.soa[0].decode('utf-8') for z in self])))
 
+    def add_instance(self, instance):
+        """ Creates the client list source and the (empty) authorities of the
+            instance"""
+        self.register_instance(instance, *self.create_instance(instance))
+
+    def create_instance(self, instance):
+        """ Creates the client list source and the (empty) authorities of the
+            instance without serving them
+
+            :return: (source, :class:`AuthorityTuple`) tuple"""
+        name = instance.name
+        if instance.management is not None:
+            source = ManagementSource(instance.management, functools.partial(
+                self.source_changed, name, 'management'))
+        elif instance.events:
+            source = EventSource(instance.status_file, functools.partial(
+                self.source_changed, name, 'event'))
+        else:
+            source = StatusFile(instance.status_file)
+        return source, AuthorityTuple(
+            forward=InMemoryAuthority(journal_size=instance.journal_size),
+            backward4=InMemoryAuthority(journal_size=instance.journal_size),
+            backward6=InMemoryAuthority(journal_size=instance.journal_size)
+        )
+
+    def load_detached_instance(self, instance, previous=None):
+        """ Creates an instance and loads its zones without serving them (see
+            :meth:`reload_config`)
+
+            :param tuple previous: (source, :class:`AuthorityTuple`) tuple of
+                the replaced instance - zones with the same name continue
+                their versions (serials and journal). Management interfaces
+                are not connected yet, their zones are built from the previous
+                client list until the first synchronisation.
+            :return: (source, :class:`AuthorityTuple`) tuple"""
+        source, authorities = self.create_instance(instance)
+        clients = source.clients
+        if previous is not None:
+            for zone, zone_name in self.zone_names(instance):
+                old = getattr(previous[1], zone)
+                if old.soa is not None and old.soa[0] == zone_name:
+                    getattr(authorities, zone).inherit(old)
+            if instance.management is not None:
+                clients = previous[0].clients
+        if clients is source.clients:
+            source.update()
+        self.prepare_zones(instance, clients, authorities=authorities)()
+        return source, authorities
+
+    def register_instance(self, instance, source, authorities):
+        """ Serves the authorities of the instance"""
+        name = instance.name
+        self.status_files[name] = source
+        if isinstance(source, EventSource):
+            self.event_sources[name] = source
+        elif isinstance(source, StatusFile):
+            self.status_paths[instance.status_file] = instance
+        self.authorities[name] = authorities
+        self.append(self.authorities[name].forward)
+        if instance.subnet4:
+            self.append(self.authorities[name].backward4)
+        if instance.subnet6:
+            self.append(self.authorities[name].backward6)
+
+    def remove_instance(self, instance):
+        """ Removes the authorities and the client list source of the
+            instance"""
+        self.unwatch_instance(instance)
+        for authority in self.authorities.pop(instance.name):
+            if authority in self:
+                self.remove(authority)
+        del self.status_files[instance.name]
+        self.event_sources.pop(instance.name, None)
+        if self.status_paths.get(instance.status_file) is instance:
+            del self.status_paths[instance.status_file]
+        self.patchable.discard(instance.name)
+        self.outdated.discard(instance.name)
+        self.scheduler.forget(instance)
+
+    def watch_instance(self, instance):
+        """ Starts to follow the changes of the client list of the instance"""
+        if instance.management is not None:
+            self.connectors[instance.name] = \
+                self.status_files[instance.name].start()
+        elif not instance.events:
+            self.inotify.watch(filepath.FilePath(instance.status_file),
+                               callbacks=[self.status_file_changed])
+
+    def unwatch_instance(self, instance):
+        connector = self.connectors.pop(instance.name, None)
+        if connector is not None:
+            self.status_files[instance.name].stopTrying()
+            connector.disconnect()
+        if self.inotify is not None and instance.management is None \
+                and not instance.events:
+            try:
+                self.inotify.ignore(filepath.FilePath(instance.status_file))
+            except KeyError:  # not watched (e.g. missing status file)
+                pass
+
+    def update_reconciler(self):
+        """ (Re)starts or stops the periodic reconciliation of the event
+            sources"""
+        interval = self.config.reconcile_interval
+        if interval is None:
+            interval = 300
+        if self.reconciler.running and (not self.event_sources or
+                                        self.reconciler.interval != interval):
+            self.reconciler.stop()
+        if self.event_sources and interval > 0 and not self.reconciler.running:
+            self.reconciler.start(interval, now=False)
+
+    def register_metrics(self):
+        """ Registers the gauges and counters of the zones, instances and
+            notifies - they are determined at scrape time"""
+        def zones():
+            for authority in self:
+                if authority.soa is not None:
+                    yield authority.soa[0].decode('utf-8'), authority
+
+        def notifies():
+            for result in ('sent', 'acked', 'retried', 'failed'):
+                yield (result, ), getattr(self.notifier, result)
+
+        def answer_cache():
+            for zone, authority in zones():
+                yield (zone, 'hit'), authority.answer_cache.hits
+                yield (zone, 'negative'), authority.answer_cache.negatives
+                yield (zone, 'miss'), authority.answer_cache.misses
+        self.metrics.collect(
+            'openvpn2dns_clients', 'Connected clients per instance', 'gauge',
+            ('instance', ), lambda: (((name, ), len(status_file.clients))
+                                     for name, status_file
+                                     in self.status_files.items()))
+        self.metrics.collect(
+            'openvpn2dns_zone_serial', 'Current SOA serial', 'gauge',
+            ('zone', ), lambda: (((zone, ), authority.soa[1].serial)
+                                 for zone, authority in zones()))
+        self.metrics.collect(
+            'openvpn2dns_zone_names', 'Owner names per zone', 'gauge',
+            ('zone', ), lambda: (((zone, ), len(authority.records))
+                                 for zone, authority in zones()))
+        self.metrics.collect(
+            'openvpn2dns_zone_records', 'Records per zone', 'gauge',
+            ('zone', ), lambda: (((zone, ), count_records(authority.records))
+                                 for zone, authority in zones()))
+        self.metrics.collect(
+            'openvpn2dns_notifies_total', 'Zone change notifies by result',
+            'counter', ('result', ), notifies)
+        self.metrics.collect(
+            'openvpn2dns_answer_cache_total', 'Answer cache lookups',
+            'counter', ('zone', 'result'), answer_cache)
+        self.metrics.collect(
+            'openvpn2dns_reloads_total', 'Started instance reloads', 'counter',
+            (), lambda: [((), self.scheduler.reloads)])
+
     def loadInstances(self):
         """ (re)load data of all instances"""
         for instance in self.config.instances:
             self.loadInstance(self.config.instances[instance])
 
     def loadInstance(self, instance):
-        clients = extract_zones_from_status_file(instance.status_file)
-        self.build_zone_from_clients(instance, clients)
+        """ (re)load the data of one instance (synchronously)"""
+        install = self.prepare_instance(instance)
+        if install is not None:
+            install()
+
+    def reload_instance(self, instance):
+        """ Reloads the data of one instance without blocking the reactor:
+            the status file is parsed and the new zone versions are built in
+            a thread, they are installed in the reactor thread in one step.
+
+            :return: deferred firing after the installation"""
+        profiler = self.profiler
+        if profiler is not None and profiler.active:
+            d = threads.deferToThread(profiler.run, self.prepare_instance,
+                                      instance)
+        else:
+            d = threads.deferToThread(self.prepare_instance, instance)
+        d.addCallback(lambda install: install() if install is not None else None)
+        if profiler is not None:
+            d.addCallback(profiler.reload_done)
+        return d
+
+    def prepare_instance(self, instance):
+        """ Parses the status file of the instance and builds the changed zone
+            data. The served zones are not touched: this may run in a thread
+            (but only one at a time per instance).
+
+            :return: a callable installing the new zone versions or None if
+                nothing has changed"""
+        status_file = self.status_files[instance.name]
+        outdated = instance.name in self.outdated
+        self.outdated.discard(instance.name)
+        start = time.perf_counter()
+        try:
+            delta = status_file.update()
+        except Exception:
+            self.patchable.discard(instance.name)  # rebuild next time
+            raise
+        timings = {'parse': time.perf_counter() - start}
+        if not delta and not outdated and isinstance(
+                self.authorities[instance.name].forward.records,
+                ClientRecords):
+            self.metrics.observe_reload(instance.name, timings)
+            return None  # no client connected, disconnected or moved
+        if self.patches(instance) and instance.name in self.patchable \
+                and not outdated:
+            install = self.prepare_client_delta(instance, delta, timings)
+        else:
+            install = self.prepare_zones(instance, status_file.clients, timings)
+
+        def install_and_measure():
+            start = time.perf_counter()
+            install()
+            timings['swap'] = time.perf_counter() - start
+            self.metrics.observe_reload(instance.name, timings)
+        return install_and_measure
+
+    @staticmethod
+    def event_driven(instance):
+        """ Whether the client list of the instance is fed by events
+            (management interface or hook scripts) instead of the status
+            file"""
+        return instance.management is not None or bool(instance.events)
+
+    def patches(self, instance):
+        """ Whether the zones of the instance are patched with client deltas
+            (always for event driven instances)"""
+        return bool(instance.delta_updates) or self.event_driven(instance)
 
     @staticmethod
     def create_record_base(zone_name, soa, initial_data):
-        records = collections.defaultdict(list)
+        records = ZoneRecords()
         if zone_name is None:
             return records
         records[zone_name.encode('utf-8')].append(soa)
@@ -162,132 +1057,493 @@ class OpenVpnAuthorityHandler(list):
             records[name.encode('utf-8')].append(record)
         return records
 
-    def build_zone_from_clients(self, instance, clients):
-        """ Basic zone generation (uses only the client list),
-            additional data like SOA information must be passed
-            as keyword option """
-        soa = dns.Record_SOA(
+    def create_soa(self, instance, authorities=None):
+        """ Creates the SOA record for the next zone version. The serial is the
+            modification time of the status file, but always increases for
+            every zone of the instance (needed for incremental zone
+            transfers)
+
+            :param AuthorityTuple authorities: the authorities of the instance
+                (defaults to the served ones)"""
+        if self.event_driven(instance):
+            serial = int(time.time())
+        else:
+            serial = int(os.path.getmtime(instance.status_file))
+        if authorities is None:
+            authorities = self.authorities[instance.name]
+        for authority in authorities:  # newer than all zones of the instance
+            if authority.soa is not None \
+                    and not serial_newer(serial, authority.soa[1].serial):
+                serial = (authority.soa[1].serial + 1) % 2**32
+        return dns.Record_SOA(
             mname=instance.mname,
             rname=instance.rname,
-            serial=int(os.path.getmtime(instance.status_file)),
+            serial=serial,
             refresh=instance.refresh,
             retry=instance.retry,
             expire=instance.expire,
             minimum=instance.minimum,
         )
-        forward_records = self.create_record_base(instance.name, soa,
-                                                  instance.forward_records)
-        backward4_records = self.create_record_base(instance.subnet4, soa,
-                                                    instance.backward4_records)
-        backward6_records = self.create_record_base(instance.subnet6, soa,
-                                                    instance.backward6_records)
+
+    @staticmethod
+    def client_name(instance, client):
+        """ Returns the (lowercase) owner name of a client"""
+        if instance.suffix is not None:
+            if instance.suffix == '@':
+                client += '.' + instance.name
+            else:
+                client += '.' + instance.suffix
+        return client.lower().encode('utf-8')
+
+    def create_zones(self, instance, soa):
+        """ Creates the empty record dictionaries of the served zones of the
+            instance
+
+            :return: dictionary of zone (``forward``, ``backward4`` or
+                ``backward6``) to :class:`ClientRecords`"""
+        zones = {'forward': ForwardRecords(self.create_record_base(
+            instance.name, soa, instance.forward_records))}
+        if instance.subnet4:
+            zones['backward4'] = ReverseRecords(self.create_record_base(
+                instance.subnet4, soa, instance.backward4_records))
+        if instance.subnet6:
+            zones['backward6'] = ReverseRecords(self.create_record_base(
+                instance.subnet6, soa, instance.backward6_records))
+        return zones
+
+    @staticmethod
+    def add_client(zones, name, addresses):
+        """ Adds the entries of one client to the zones
+
+            :param dict zones: see :meth:`create_zones`
+            :param bytes name: owner name of the client
+            :param list addresses: :class:`address.Address` objects"""
+        zones['forward'].add(name, [address.packed for address in addresses])
+        for address in addresses:
+            reverse = zones.get('backward4' if address.version == 4
+                                else 'backward6')
+            if reverse is not None:
+                reverse.add(address.packed, name)
+
+    def build_zone_from_clients(self, instance, clients):
+        """ Basic zone generation (uses only the client list),
+            additional data like SOA information must be passed
+            as keyword option """
+        self.prepare_zones(instance, clients)()
+
+    def prepare_zones(self, instance, clients, timings=None, authorities=None):
+        """ Builds new zones of the instance from the client list, see
+            :meth:`prepare_instance`.
+
+            :param dict timings: receives the durations of the build and diff
+                phases
+            :param AuthorityTuple authorities: the authorities receiving the
+                zones (defaults to the served ones, only their changes are
+                announced)
+            :return: callable installing the zones"""
+        start = time.perf_counter()
+        served = authorities is None
+        if served:
+            authorities = self.authorities[instance.name]
+        soa = self.create_soa(instance, authorities)
+        zones = self.create_zones(instance, soa)
         for client, addresses in clients.items():
-            if instance.suffix is not None:
-                if instance.suffix == '@':
-                    client += '.' + instance.name
-                else:
-                    client += '.' + instance.suffix
-            client = client.lower().encode('utf-8')
-            for address in addresses:
-                reverse = IP(address).reverseName()[:-1].encode('utf-8')
-                if address.version() == 4:
-                    forward_records[client] \
-                        .append(dns.Record_A(str(address)))
-                    backward4_records[reverse] \
-                        .append(dns.Record_PTR(client))
-                elif address.version() == 6:
-                    forward_records[client] \
-                        .append(dns.Record_AAAA(str(address)))
-                    backward6_records[reverse] \
-                        .append(dns.Record_PTR(client))
-        # push data to authorities:
+            self.add_client(zones, self.client_name(instance, client),
+                            addresses)
+        built = time.perf_counter()
+        for records in zones.values():
+            records.static.update_digests()
+        changed_names = {}
+        for zone, zone_name in self.zone_names(instance):
+            current = getattr(authorities, zone).records
+            if current is not None:
+                changed_names[zone] = diff_names(current, zones[zone])
+        if timings is not None:
+            timings['build'] = built - start
+            timings['diff'] = time.perf_counter() - built
+
+        def install():
+            if served and self.patches(instance):
+                self.patchable.add(instance.name)
+            for zone, zone_name in self.zone_names(instance):
+                target = getattr(authorities, zone)
+                if target.setData((zone_name, soa), zones[zone],
+                                  changed_names.get(zone)):
+                    if served:
+                        self.zone_changed(instance, zone, zone_name)
+                elif not isinstance(target.records, ClientRecords):
+                    # unchanged zone loaded from a snapshot:
+                    target.takeOver(zones[zone])
+        return install
+
+    def apply_client_delta(self, instance, delta):
+        """ Patches the zones of the instance with the changes of the client
+            list - the entries of unchanged clients are kept.
+
+            :param config.OpenVpnInstance instance: instance
+            :param statusfile.StatusDelta delta: changed clients"""
+        self.prepare_client_delta(instance, delta)()
+
+    def prepare_client_delta(self, instance, delta, timings=None):
+        """ Computes the new client entries of the changed clients, see
+            :meth:`prepare_instance`.
+
+            :param dict timings: receives the durations of the build and diff
+                phases
+            :return: callable patching the zones"""
+        start = time.perf_counter()
         authority = self.authorities[instance.name]
-        if authority.forward.setData((instance.name.encode('utf-8'), soa), forward_records):
-            self.notify(instance, instance.name.encode('utf-8'))
+        zones = {zone: getattr(authority, zone).records
+                 for zone, zone_name in self.zone_names(instance)}
+        # new entries of the touched client keys:
+        entries = {zone: {} for zone in zones}
+
+        def current(zone, key):
+            if key in entries[zone]:
+                return entries[zone][key]
+            return zones[zone].clients.get(key)
+        for client in itertools.chain(delta.added, delta.removed, delta.changed):
+            name = self.client_name(instance, client)
+            for packed in unpack_addresses(current('forward', name) or b''):
+                zone = 'backward4' if len(packed) == 4 else 'backward6'
+                if zone in zones:
+                    entries[zone][packed] = without_name(current(zone, packed),
+                                                         name)
+            entries['forward'][name] = None
+        for client, addresses in itertools.chain(delta.added.items(),
+                                                 delta.changed.items()):
+            name = self.client_name(instance, client)
+            entries['forward'][name] = pack_addresses(
+                unpack_addresses(current('forward', name) or b'') +
+                [address.packed for address in addresses])
+            for address in addresses:
+                zone = 'backward4' if address.version == 4 else 'backward6'
+                if zone in zones:
+                    entries[zone][address.packed] = with_name(
+                        current(zone, address.packed), name)
+        soa = self.create_soa(instance)
+        built = time.perf_counter()
+        changes = {zone: {key: (value, zones[zone].digest_change(key, value))
+                          for key, value in entries[zone].items()}
+                   for zone in zones}
+        if timings is not None:
+            timings['build'] = built - start
+            timings['diff'] = time.perf_counter() - built
+
+        def install():
+            for zone, zone_name in self.zone_names(instance):
+                changed_names, previous = zones[zone].apply(changes[zone])
+                if getattr(authority, zone).patchData((zone_name, soa),
+                                                      changed_names, previous):
+                    self.zone_changed(instance, zone, zone_name)
+        return install
+
+    @staticmethod
+    def zone_names(instance):
+        """ Returns a list of (zone, zone name) tuples of all served zones of
+            the instance"""
+        names = [('forward', instance.name.encode('utf-8'))]
         if instance.subnet4:
-            if authority.backward4.setData((instance.subnet4.encode('utf-8'), soa), backward4_records):
-                self.notify(instance, instance.subnet4.encode('utf-8'))
+            names.append(('backward4', instance.subnet4.encode('utf-8')))
         if instance.subnet6:
-            if authority.backward6.setData((instance.subnet6.encode('utf-8'), soa), backward6_records):
-                self.notify(instance, instance.subnet6.encode('utf-8'))
+            names.append(('backward6', instance.subnet6.encode('utf-8')))
+        return names
+
+    def zone_changed(self, instance, zone, zone_name):
+        """ Informs the listeners and the slave servers about a new zone
+            version
+
+            :param config.OpenVpnInstance instance: instance
+            :param str zone: ``forward``, ``backward4`` or ``backward6``
+            :param bytes zone_name: name of the zone"""
+        authority = getattr(self.authorities[instance.name], zone)
+        self.unsaved.add(authority)
+        for listener in self.listeners:
+            listener(authority)
+        self.notify(instance, zone, zone_name)
+
+    def snapshot_path(self, zone_name):
+        """ Returns the path of the snapshot file of a zone in the state
+            directory"""
+        return os.path.join(self.config.state_directory,
+                            zone_name.decode('utf-8') + '.snapshot')
+
+    def load_snapshots(self, instance):
+        """ Serves the zones of the instance from their snapshots in the
+            state directory (warm start). The snapshots are mapped into
+            memory, records are only decoded on lookup. The serials continue
+            from the snapshots.
+
+            :return: whether the snapshots of all zones were loaded"""
+        if self.config.state_directory is None:
+            return False
+        loaded = []
+        for zone, zone_name in self.zone_names(instance):
+            path = self.snapshot_path(zone_name)
+            if not os.path.exists(path):
+                return False
+            try:
+                snapshot = Snapshot.open(path)
+                if snapshot.zone != zone_name.lower():
+                    raise ValueError('snapshot of zone {0}'.format(
+                        snapshot.zone.decode('utf-8')))
+                records = SnapshotRecords(snapshot)
+                soa = [record for record in records.get(snapshot.zone, ())
+                       if record.TYPE == dns.SOA]
+                if not soa:
+                    raise ValueError('snapshot without SOA record')
+            except (OSError, ValueError, struct.error) as e:
+                print('ignoring zone snapshot {0}: {1}'.format(path, e))
+                return False
+            loaded.append((zone, (zone_name, soa[0]), records))
+        authority = self.authorities[instance.name]
+        for zone, soa, records in loaded:
+            getattr(authority, zone).setData(soa, records)
+        return True
+
+    def save_snapshots(self):
+        """ Writes the changed zones to the state directory (called
+            periodically and at shutdown). The records are copied and
+            written in a thread to keep the reactor responsive.
+
+            :return: deferred firing once the snapshots are written"""
+        if self.config.state_directory is None:
+            return defer.succeed(None)
+        if self.saving is not None:  # write the newer changes afterwards
+            d = defer.Deferred()
+            self.saving.addBoth(
+                lambda ignored: self.save_snapshots().chainDeferred(d))
+            return d
+        unsaved, self.unsaved = self.unsaved, set()
+        snapshots = []
+        for authority in unsaved:
+            if authority not in self or authority.soa is None:
+                continue  # removed by a configuration reload
+            snapshots.append((self.snapshot_path(authority.soa[0]),
+                              authority.soa[0], authority.records.copy()))
+        if not snapshots:
+            return defer.succeed(None)
+        d = self.saving = threads.deferToThread(self.write_snapshots,
+                                                snapshots)
+        d.addErrback(self.snapshots_failed)
+        d.addBoth(self.snapshots_saved)
+        return d
+
+    @staticmethod
+    def write_snapshots(snapshots):
+        """ Writes the given zone snapshots (runs in a thread)
+
+            :param list snapshots: (path, zone name, records) tuples"""
+        for path, name, records in snapshots:
+            try:
+                write_snapshot(path, name, records)
+            except OSError as e:
+                print('writing zone snapshot {0} failed: {1}'.format(path, e))
+
+    def snapshots_failed(self, fail):
+        print('writing zone snapshots failed: {0}'.format(
+            fail.getErrorMessage()))
+
+    def snapshots_saved(self, result):
+        self.saving = None
+        return result
 
     def handle_signal(self, a, b):
-        self.loadInstances()
+        from twisted.internet import reactor
+        for instance in self.config.instances.values():
+            reactor.callFromThread(self.scheduler.changed, instance, 'SIGUSR1')
+
+    def handle_reload_signal(self, a, b):
+        from twisted.internet import reactor
+        reactor.callFromThread(self.reload_config)
+
+    def reload_config(self, config=None):
+        """ Applies a changed configuration (SIGHUP): new instances are
+            added, removed instances torn down and changed instances rebuilt
+            - the zones (and serials) of unchanged instances are kept. Global
+            options are only applied at restart.
+
+            Added and recreated instances are loaded before anything is
+            changed. An instance that fails to load keeps its previous
+            configuration (or is not added). Rebuilds of changed instances
+            are scheduled like reloads.
+
+            :param config.ConfigParser config: the new configuration (reread
+                from the configuration file if None)
+            :return: dictionary of the instance names to the applied change
+                (``added``, ``removed``, ``recreated``, ``rebuilt`` or
+                ``updated``)"""
+        if config is None:
+            try:
+                config = self.config.__class__(self.config.filename)
+            except Exception as e:
+                print('reloading configuration {0} failed: {1}'.format(
+                      self.config.filename, e))
+                return None
+        old_instances = self.config.instances
+        for option, value in vars(config).items():
+            if option not in ('instances', 'data', 'reconcile_interval') \
+                    and getattr(self.config, option, None) != value:
+                print('changed option {0} is applied at restart'.format(option))
+                setattr(config, option, getattr(self.config, option, None))
+        changes = {}
+        for name, instance in config.instances.items():
+            old = old_instances.get(name)
+            if old is None:
+                changes[name] = 'added'
+            elif vars(old) == vars(instance):
+                # keep the instance object (pending reloads, status paths):
+                config.instances[name] = old
+            elif any(getattr(old, option) != getattr(instance, option)
+                     for option in self.RECREATE_OPTIONS):
+                changes[name] = 'recreated'
+            elif {option: value for option, value in vars(old).items()
+                    if option not in self.UPDATE_OPTIONS} \
+                    == {option: value for option, value in vars(instance)
+                        .items() if option not in self.UPDATE_OPTIONS}:
+                changes[name] = 'updated'  # e.g. new notify targets
+            else:
+                changes[name] = 'rebuilt'
+        # load the new instances before touching the served ones:
+        loaded = {}
+        for name, change in sorted(changes.items()):
+            if change not in ('added', 'recreated'):
+                continue
+            try:
+                previous = None
+                if change == 'recreated':
+                    previous = (self.status_files[name],
+                                self.authorities[name])
+                loaded[name] = self.load_detached_instance(
+                    config.instances[name], previous)
+            except Exception as e:
+                print('configuration reload: loading instance {0} failed: {1}'
+                      .format(name, e))
+                del changes[name]
+                if name in old_instances:
+                    config.instances[name] = old_instances[name]
+                else:
+                    del config.instances[name]
+        for name, instance in old_instances.items():
+            if name not in config.instances:
+                changes[name] = 'removed'
+        self.config = config
+        for name, change in changes.items():
+            if change in ('removed', 'recreated'):
+                self.remove_instance(old_instances[name])
+        for name, change in changes.items():
+            instance = config.instances.get(name)
+            if change in ('added', 'recreated'):
+                source, authorities = loaded[name]
+                self.register_instance(instance, source, authorities)
+                if change == 'recreated' and instance.management is not None:
+                    # rebuilt by the first synchronisation:
+                    self.outdated.add(name)
+                elif self.patches(instance):
+                    self.patchable.add(name)
+                self.watch_instance(instance)
+                for zone, zone_name in self.zone_names(instance):
+                    self.zone_changed(instance, zone, zone_name)
+            elif change in ('rebuilt', 'updated'):
+                # update the instance object in place (keeps pending and
+                # running reloads):
+                old = old_instances[name]
+                if old.journal_size != instance.journal_size:
+                    for authority in self.authorities[name]:
+                        authority.resizeJournal(instance.journal_size)
+                vars(old).update(vars(instance))
+                config.instances[name] = old
+                if change == 'rebuilt':
+                    self.outdated.add(name)
+                    self.scheduler.changed(old, 'SIGHUP')
+        self.update_reconciler()
+        if any(change in ('added', 'removed', 'recreated')
+               for change in changes.values()):
+            for listener in self.zone_set_listeners:
+                listener(self)
+        for name, change in sorted(changes.items()):
+            print('configuration reload: instance {0} {1}'.format(name, change))
+        return changes
+
+    def handle_profile_signal(self, a, b):
+        from twisted.internet import reactor
+        reactor.callFromThread(self.toggle_profiling)
+
+    def toggle_profiling(self):
+        """ Starts a profile session or stops the running one (SIGUSR2).
+            A session stops itself after ``profile_duration`` seconds or
+            ``profile_reloads`` reloads.
+
+            :return: the started session or None if a session was stopped"""
+        if self.profiler is not None and self.profiler.active:
+            self.profiler.stop()
+            self.profiler = None
+            return None
+        duration = self.config.profile_duration
+        self.profiler = ProfileSession(
+            self.config.profile_directory or tempfile.gettempdir(),
+            duration=60 if duration is None else duration,
+            reloads=self.config.profile_reloads)
+        self.profiler.start()
+        return self.profiler
 
     def status_file_changed(self, ignored, filepath, mask):
         """ This is a callback for the twisted INotify module to inform about
-            file changes on status files. This methods searches for the
-            associated instances and schedules a loadInstances with a timeout
-            of one second to handle multiple file changes only once."""
-        instance = None
-        for one_instance in self.config.instances.values():
-            if one_instance.status_file == filepath.path:
-                instance = one_instance
-                break
+            file changes on status files. The reload of the associated
+            instance is scheduled by the :class:`scheduler.ReloadScheduler`
+            that handles multiple file changes only once."""
+        instance = self.status_paths.get(filepath.path)
         if instance is None:
             print('unknown status file: {0}'.format(filepath.path))
             return
-        from twisted.internet import reactor
-        instance.version += 1
-        deferLater(reactor, 1, self.status_file_change_done,
-                   instance, instance.version,
-                   ','.join(inotify.humanReadableMask(mask)))
+        self.scheduler.changed(instance,
+                               ','.join(inotify.humanReadableMask(mask)))
 
-    def status_file_change_done(self, instance, version, reason=None):
-        """ This is a callback for twisted deferLater and scheduled by
-            status_file_changed. If the update id of the instance is the same
-            one as passed as argument the file is not changed within the last
-            second and we reload the instance.
+    def source_changed(self, name, reason):
+        """ Called by the :class:`management.ManagementSource` or
+            :class:`events.EventSource` of the instance after every client
+            change - the changes are applied by a scheduled reload like status
+            file changes (events of one burst are applied together)"""
+        instance = self.config.instances.get(name)
+        if instance is not None:
+            self.scheduler.changed(instance, reason)
+
+    def reconcile_events(self):
+        """ Schedules the reconciliation of all event sources with their
+            status files"""
+        for name, source in self.event_sources.items():
+            if source.reconcile():
+                self.scheduler.changed(self.config.instances[name], 'reconcile')
+
+    def status_file_change_done(self, instance, reason=None):
+        """ This is the reload callback of the scheduler: the status file of
+            the instance has not changed for the coalescing window.
 
             :param config.OpenVpnInstance instance: instance
-            :param int version: version
             :param str reason: textual reason for the reload"""
-        if instance.version > version:  # file was modified again
-            return
+        if self.config.instances.get(instance.name) is not instance:
+            return None  # removed or replaced by a configuration reload
         print('rereading instance {2}: {0} changed ({1}), '.format(
-              instance.status_file, reason, instance.name))
-        self.loadInstance(instance)
+              'client list' if self.event_driven(instance)
+              else instance.status_file, reason, instance.name))
+        return self.reload_instance(instance)
+
+    def notify(self, instance, zone, name):
+        """ Notifies the slave servers of the instance about the current
+            version of one zone
 
-    def notify(self, instance, name):
+            :param str zone: ``forward``, ``backward4`` or ``backward6``
+            :param bytes name: name of the zone"""
         if self.send_notify is not True:
             return
+        soa = getattr(self.authorities[instance.name], zone).soa
         for server in instance.notify:
             print('Notify {0} new data for zone {1}'.format(server[0], name))
-            r = NotifyResolver(servers=[server])
-            r.sendNotify(name)
+            self.notifier.notify(server, name, soa[1] if soa else None)
 
     def start_notify(self):
         self.send_notify = True
         for instance in self.config.instances.values():
-            self.notify(instance, instance.name.encode('utf-8'))
-            if instance.subnet4:
-                self.notify(instance, instance.subnet4.encode('utf-8'))
-            if instance.subnet6:
-                self.notify(instance, instance.subnet6.encode('utf-8'))
-
-
-class NotifyResolver(Resolver):
-    def sendNotify(self, zone):
-        protocol = self._connectedProtocol()
-
-        id = protocol.pickID()
+            for zone, zone_name in self.zone_names(instance):
+                self.notify(instance, zone, zone_name)
 
-        m = dns.Message(id, opCode=dns.OP_NOTIFY)
-        m.queries = [dns.Query(zone, dns.SOA, dns.IN)]
-
-        try:
-            protocol.writeMessage(m, self.servers[0])
-        except:
-            return defer.fail()
-
-        resultDeferred = defer.Deferred()
-        cancelCall = protocol.callLater(10, protocol._clearFailed, resultDeferred, id)
-        protocol.liveMessages[id] = (resultDeferred, cancelCall)
-
-        d = resultDeferred
-
-        def cbQueried(result):
-            protocol.transport.stopListening()
-            return result
-        d.addBoth(cbQueried)
-        return d
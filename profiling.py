@@ -0,0 +1,111 @@
+import cProfile
+import io
+import os.path
+import pstats
+import threading
+import time
+
+
+class ProfileSession(object):
+    """ cProfile session of a running daemon.
+
+        cProfile only profiles the thread that enables it: the reactor
+        thread is profiled for the whole session, code running in other
+        threads (the parsing and building of reloads) has to be passed to
+        :meth:`run`. All profiles are combined when the session stops.
+
+        :param str directory: directory for the stats files
+        :param float duration: seconds after which the session stops (None
+            for no limit)
+        :param int reloads: number of reloads after which the session stops
+            (None for no limit)
+        :param int top: number of functions in the logged summary
+        :param clock: reactor for the duration timer"""
+    def __init__(self, directory, duration=None, reloads=None, top=25,
+                 clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.directory = directory
+        self.duration = duration
+        self.reloads = reloads
+        self.top = top
+        self.clock = clock
+        self.profile = cProfile.Profile()
+        self.thread_profiles = []
+        self.lock = threading.Lock()
+        self.timer = None
+        self.reloads_done = 0
+        self.started = None
+        self.active = False
+
+    def start(self):
+        self.started = time.time()
+        self.active = True
+        if self.duration:
+            self.timer = self.clock.callLater(self.duration, self.stop)
+        self.profile.enable()
+        print('profiling started ({0})'.format(self.limits()))
+
+    def limits(self):
+        limits = []
+        if self.duration:
+            limits.append('{0} seconds'.format(self.duration))
+        if self.reloads:
+            limits.append('{0} reloads'.format(self.reloads))
+        return ' or '.join(limits) or 'until the next signal'
+
+    def run(self, callable, *args, **kwargs):
+        """ Calls callable (in any thread) and profiles it if the session is
+            active"""
+        if not self.active:
+            return callable(*args, **kwargs)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # Python 3.12+: the session covers all threads
+            return callable(*args, **kwargs)
+        try:
+            return callable(*args, **kwargs)
+        finally:
+            profile.disable()
+            with self.lock:
+                self.thread_profiles.append(profile)
+
+    def reload_done(self, result=None):
+        """ Counts a finished reload (usable as deferred callback)"""
+        if self.active:
+            self.reloads_done += 1
+            if self.reloads and self.reloads_done >= self.reloads:
+                self.stop()
+        return result
+
+    def stop(self):
+        """ Stops the session, writes the stats file and logs the functions
+            with the highest cumulative time
+
+            :return: path of the stats file"""
+        if not self.active:
+            return None
+        self.profile.disable()
+        self.active = False
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+        stats = pstats.Stats(self.profile, stream=io.StringIO())
+        with self.lock:
+            for profile in self.thread_profiles:
+                stats.add(profile)
+        path = os.path.join(self.directory, 'openvpn2dns-{0}-{1}.pstats'.format(
+            os.getpid(), time.strftime('%Y%m%d-%H%M%S',
+                                       time.localtime(self.started))))
+        stats.dump_stats(path)
+        summary = io.StringIO()
+        stats.stream = summary
+        stats.sort_stats('cumulative').print_stats(self.top)
+        print('profiling stopped after {0:.1f} seconds and {1} reloads, '
+              'stats written to {2}'.format(time.time() - self.started,
+                                            self.reloads_done, path))
+        for line in summary.getvalue().splitlines():
+            if line.strip():
+                print(line)
+        return path
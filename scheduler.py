@@ -0,0 +1,152 @@
+import collections
+
+from twisted.internet import defer
+
+
+class ReloadState(object):
+    """ Reload bookkeeping of one instance.
+
+        :ivar float first: time of the first change since the last reload
+        :ivar float last: time of the last change
+        :ivar float gap: moving average of the time between two changes of
+            one write burst (None until observed)
+        :ivar timer: the pending reload timer (at most one)
+        :ivar bool running: whether a reload of the instance is running
+        :ivar bool queued: whether the instance waits for a free reload slot
+        :ivar bool forgotten: whether the state is dropped after the running
+            reload"""
+    __slots__ = ('first', 'last', 'gap', 'reasons', 'timer', 'running',
+                 'queued', 'forgotten')
+
+    def __init__(self):
+        self.first = None
+        self.last = None
+        self.gap = None
+        self.reasons = set()
+        self.timer = None
+        self.running = False
+        self.queued = False
+        self.forgotten = False
+
+
+class ReloadScheduler(object):
+    """ Coalesces the change events of the status files into reloads.
+
+        A reload starts once no change was seen for a coalescing window. The
+        window adapts to the observed write pattern of every instance: it is
+        twice the average gap between the changes of one write burst, bound
+        by min_delay and max_delay. A continuously changing file is reloaded
+        at least every max_delay seconds. Every instance has at most one
+        pending timer and at most max_concurrent reloads run at the same
+        time.
+
+        :param callable reload: called with the instance and a textual
+            reason, may return a deferred
+        :param float min_delay: minimal coalescing window in seconds
+        :param float max_delay: maximal delay between the first change and
+            the reload
+        :param int max_concurrent: maximal number of concurrent reloads
+        :param clock: reactor for timers"""
+    GAP_WEIGHT = 0.3
+
+    def __init__(self, reload, min_delay=0.1, max_delay=2, max_concurrent=4,
+                 clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.reload = reload
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_concurrent = max_concurrent
+        self.clock = clock
+        self.states = collections.defaultdict(ReloadState)
+        self.queue = collections.deque()
+        self.running = 0
+        self.reloads = 0
+
+    def window(self, state):
+        """ Returns the current coalescing window of the instance"""
+        if state.gap is None:
+            return self.min_delay
+        return min(max(2 * state.gap, self.min_delay), self.max_delay)
+
+    def deadline(self, state):
+        return min(state.last + self.window(state), state.first + self.max_delay)
+
+    def changed(self, instance, reason=None):
+        """ Records a change of the status file of the instance"""
+        state = self.states[instance]
+        now = self.clock.seconds()
+        if state.last is not None and now - state.last < self.max_delay:
+            gap = now - state.last
+            state.gap = gap if state.gap is None else \
+                (1 - self.GAP_WEIGHT) * state.gap + self.GAP_WEIGHT * gap
+        if state.first is None:
+            state.first = now
+        state.last = now
+        if reason:
+            state.reasons.add(reason)
+        if state.timer is None and not state.queued:
+            state.timer = self.clock.callLater(
+                max(self.deadline(state) - now, 0), self.due, instance)
+
+    def due(self, instance):
+        state = self.states[instance]
+        state.timer = None
+        remaining = self.deadline(state) - self.clock.seconds()
+        if remaining > 0:  # changed again meanwhile
+            state.timer = self.clock.callLater(remaining, self.due, instance)
+            return
+        if state.running or self.running >= self.max_concurrent:
+            state.queued = True
+            self.queue.append(instance)
+            return
+        self.start(instance)
+
+    def start(self, instance):
+        state = self.states[instance]
+        reason = ','.join(sorted(state.reasons))
+        state.first = None
+        state.reasons = set()
+        state.running = True
+        self.running += 1
+        self.reloads += 1
+        d = defer.maybeDeferred(self.reload, instance, reason)
+        d.addErrback(self.reloadFailed, instance)
+        d.addBoth(self.finished, instance)
+        return d
+
+    def reloadFailed(self, reason, instance):
+        print('reloading instance {0} failed: {1}'.format(
+              getattr(instance, 'name', instance), reason.getErrorMessage()))
+
+    def forget(self, instance):
+        """ Drops the state of an instance (e.g. removed by a configuration
+            reload), its pending reload is cancelled"""
+        state = self.states.get(instance)
+        if state is None:
+            return
+        if state.timer is not None:
+            state.timer.cancel()
+            state.timer = None
+        if state.queued:
+            self.queue.remove(instance)
+            state.queued = False
+        if state.running:
+            state.forgotten = True  # dropped by finished
+        else:
+            del self.states[instance]
+
+    def finished(self, ignored, instance):
+        state = self.states[instance]
+        state.running = False
+        if state.forgotten:
+            del self.states[instance]
+        self.running -= 1
+        for i in range(len(self.queue)):
+            candidate = self.queue.popleft()
+            if self.states[candidate].running:
+                self.queue.append(candidate)  # wait for the running reload
+                continue
+            self.states[candidate].queued = False
+            self.start(candidate)
+            break
@@ -59,6 +59,8 @@ setup(
         #'Twisted >= 17', diabled as only twisted-names is needed
         'IPy >= 0.73'
     ],
-    py_modules=('config', 'openvpnzone', 'version'),
-    scripts=('openvpn2dns', )
+    py_modules=('address', 'config', 'dnsserver', 'events', 'management',
+                'metrics', 'notify', 'openvpnzone', 'profiling', 'scheduler',
+                'snapshot', 'statusfile', 'version', 'workers', 'zonenames'),
+    scripts=('openvpn2dns', 'scripts/openvpn2dns-event')
 )
@@ -0,0 +1,250 @@
+import collections.abc
+import mmap
+import os
+import struct
+from io import BytesIO
+
+from twisted.internet import defer
+from twisted.names import dns
+from twisted.names.authority import FileAuthority
+
+from dnsserver import AnswerCache
+from zonenames import NameIndex, is_subdomain, serial_newer
+
+
+# Binary zone snapshot (all integers in network byte order):
+#
+#   header     magic, format version, length of the zone name, number of
+#              names, size of the name table
+#   zone name
+#   index      one (start and end of the name in the name table, offset of
+#              its records) entry per name - sorted by the lowercase names
+#   name table the concatenated lowercase names
+#   records    per name: number of records, then per record type, ttl
+#              (NO_TTL for the zone default), rdata length and the encoded
+#              (uncompressed) rdata
+MAGIC = b'O2DS'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('!4sHHII')
+INDEX_ENTRY = struct.Struct('!III')
+RECORD_COUNT = struct.Struct('!H')
+RECORD_HEADER = struct.Struct('!HIH')
+NO_TTL = 0xffffffff
+
+_record_types = dns.Message()
+
+
+def encode_snapshot(zone_name, records):
+    """ Encodes one zone version as binary snapshot.
+
+        :param bytes zone_name: name of the zone
+        :param dict records: the record dictionary of the zone (lowercase
+            names to lists of records, the SOA record included)
+        :return: the snapshot as bytes"""
+    names = sorted(((name.lower(), name_records)
+                    for name, name_records in records.items() if name_records),
+                   key=lambda entry: entry[0])
+    index = BytesIO()
+    table = BytesIO()
+    data = BytesIO()
+    for lower, name_records in names:
+        start = table.tell()
+        table.write(lower)
+        index.write(INDEX_ENTRY.pack(start, table.tell(), data.tell()))
+        data.write(RECORD_COUNT.pack(len(name_records)))
+        for record in name_records:
+            rdata = BytesIO()
+            record.encode(rdata)
+            rdata = rdata.getvalue()
+            data.write(RECORD_HEADER.pack(
+                record.TYPE, NO_TTL if record.ttl is None else record.ttl,
+                len(rdata)))
+            data.write(rdata)
+    table = table.getvalue()
+    return b''.join((HEADER.pack(MAGIC, FORMAT_VERSION, len(zone_name),
+                                 len(names), len(table)),
+                     zone_name, index.getvalue(), table, data.getvalue()))
+
+
+def write_snapshot(path, zone_name, records):
+    """ Writes a snapshot file. The file is replaced atomically: processes
+        that still map the previous version keep reading it unchanged."""
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as snapshot_file:
+        snapshot_file.write(encode_snapshot(zone_name, records))
+    os.replace(tmp_path, path)
+
+
+class Snapshot(object):
+    """ Read-only view of a binary zone snapshot. The buffer is not parsed:
+        names are found by a binary search over the index and only the
+        records of the requested names are decoded.
+
+        :param buffer: snapshot data (bytes or a memory mapping)
+        :raises ValueError: buffer is no snapshot (of a supported version)"""
+    def __init__(self, buffer):
+        if len(buffer) < HEADER.size:
+            raise ValueError('Truncated zone snapshot')
+        magic, version, zone_length, count, table_size = \
+            HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a zone snapshot')
+        if version != FORMAT_VERSION:
+            raise ValueError('Unsupported zone snapshot version {0}'
+                             .format(version))
+        self.buffer = buffer
+        self.zone = bytes(buffer[HEADER.size:HEADER.size + zone_length])
+        self.count = count
+        self.index_offset = HEADER.size + zone_length
+        self.table_offset = self.index_offset + count * INDEX_ENTRY.size
+        self.records_offset = self.table_offset + table_size
+
+    @classmethod
+    def open(cls, path):
+        """ Maps a snapshot file into memory"""
+        with open(path, 'rb') as snapshot_file:
+            return cls(mmap.mmap(snapshot_file.fileno(), 0,
+                                 access=mmap.ACCESS_READ))
+
+    def __len__(self):
+        return self.count
+
+    def name(self, position):
+        """ Returns the (lowercase) name at the position of the index"""
+        start, end, offset = INDEX_ENTRY.unpack_from(
+            self.buffer, self.index_offset + position * INDEX_ENTRY.size)
+        return self.buffer[self.table_offset + start:self.table_offset + end]
+
+    def find(self, name):
+        """ Returns the index position of name or -1"""
+        name = name.lower()
+        buffer, unpack = self.buffer, INDEX_ENTRY.unpack_from
+        index, table = self.index_offset, self.table_offset
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            start, end, offset = unpack(buffer,
+                                        index + middle * INDEX_ENTRY.size)
+            if buffer[table + start:table + end] < name:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.name(low) == name:
+            return low
+        return -1
+
+    def lookup(self, name):
+        """ Returns the encoded records of name.
+
+            :return: list of (type, ttl, rdata) tuples - ttl is None for the
+                zone default, empty for unknown names"""
+        position = self.find(name)
+        if position < 0:
+            return []
+        return self.rdata(position)
+
+    def rdata(self, position):
+        offset = self.records_offset + INDEX_ENTRY.unpack_from(
+            self.buffer, self.index_offset + position * INDEX_ENTRY.size)[2]
+        count, = RECORD_COUNT.unpack_from(self.buffer, offset)
+        offset += RECORD_COUNT.size
+        records = []
+        for i in range(count):
+            type, ttl, length = RECORD_HEADER.unpack_from(self.buffer, offset)
+            offset += RECORD_HEADER.size
+            records.append((type, None if ttl == NO_TTL else ttl,
+                            self.buffer[offset:offset + length]))
+            offset += length
+        return records
+
+    def records(self, position):
+        """ Decodes the records at the index position into twisted record
+            objects"""
+        records = []
+        for type, ttl, rdata in self.rdata(position):
+            record = _record_types.lookupRecordType(type)()
+            record.decode(BytesIO(rdata), len(rdata))
+            record.ttl = ttl
+            records.append(record)
+        return records
+
+
+class SnapshotRecords(collections.abc.Mapping):
+    """ Record dictionary interface of a :class:`Snapshot` - as expected by
+        :class:`twisted.names.authority.FileAuthority`."""
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.name_index = None
+
+    def __getitem__(self, name):
+        position = self.snapshot.find(name)
+        if position < 0:
+            raise KeyError(name)
+        return self.snapshot.records(position)
+
+    def __contains__(self, name):
+        return self.snapshot.find(name) >= 0
+
+    def __iter__(self):
+        for position in range(self.snapshot.count):
+            yield self.snapshot.name(position)
+
+    def __len__(self):
+        return self.snapshot.count
+
+    def copy(self):
+        return self  # snapshots are never modified
+
+    def has_descendants(self, name):
+        """ Whether there are names below the (lowercase) name"""
+        if self.name_index is None:
+            self.name_index = NameIndex(self)
+        return self.name_index.has_descendants(name)
+
+
+class SnapshotAuthority(FileAuthority):
+    """ Authority serving a zone directly from a :class:`Snapshot`.
+
+        :param Snapshot snapshot: initial zone version"""
+    def __init__(self, snapshot=None):
+        self.answer_cache = AnswerCache()
+        FileAuthority.__init__(self, snapshot)
+
+    def loadFile(self, snapshot):
+        if snapshot is not None:
+            self.setSnapshot(snapshot)
+
+    def setSnapshot(self, snapshot):
+        """ Serves the given snapshot from now on"""
+        records = SnapshotRecords(snapshot)
+        soa = [record for record in records.get(snapshot.zone, ())
+               if record.TYPE == dns.SOA]
+        if not soa:
+            raise ValueError('Zone snapshot without SOA record')
+        self.soa = (snapshot.zone, soa[0])
+        self.records = records
+        self.answer_cache.clear()
+
+    def lookupNegative(self, name):
+        """ Classifies a name without records, see
+            :meth:`openvpnzone.InMemoryAuthority.lookupNegative`"""
+        if self.soa is None:
+            return None
+        name = name.lower()
+        if name in self.records or not is_subdomain(name, self.soa[0]):
+            return None
+        return dns.OK if self.records.has_descendants(name) else dns.ENAME
+
+    def lookupIncrementalZone(self, name, serial, timeout=10):
+        """ Snapshots have no journal: up to date clients get the SOA record,
+            all others a complete zone transfer"""
+        name = dns.domainString(name)
+        if self.soa is not None and self.soa[0].lower() == name.lower() and \
+                (serial == self.soa[1].serial or
+                 serial_newer(serial, self.soa[1].serial)):
+            soa = self.soa[1]
+            ttl = soa.ttl if soa.ttl is not None \
+                else max(soa.minimum, soa.expire)
+            return defer.succeed(([dns.RRHeader(self.soa[0], dns.SOA, dns.IN,
+                                                ttl, soa, auth=True)], (), ()))
+        return self.lookupZone(name, timeout)
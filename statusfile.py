@@ -0,0 +1,283 @@
+import re
+import threading
+
+from address import Address
+
+
+V1_CLIENT_LIST = b'OpenVPN CLIENT LIST\n'
+V1_ROUTING_TABLE = b'\nROUTING TABLE\n'
+V1_GLOBAL_STATS = b'\nGLOBAL STATS\n'
+
+# first field of every client row, first two fields of every routing row. The
+# remaining fields (traffic counters, last reference) change on every rewrite
+# and are therefore not part of the row fingerprint.
+V1_CLIENT_ROW = re.compile(br'([^,\n]*),[^\n]*\n')
+V1_ROUTE_ROW = re.compile(br'([^,\n]*,[^,\n]*),[^\n]*\n')
+
+# status-version 2 and 3 prefix every row with its type, the fields are
+# separated by commas (version 2) or tabs (version 3):
+V2_TITLE = b'TITLE,'
+V2_CLIENT_ROW = re.compile(br'\nCLIENT_LIST,([^,\n]*),')
+V2_ROUTE_ROW = re.compile(br'\nROUTING_TABLE,([^,\n]*,[^,\n]*),')
+V3_TITLE = b'TITLE\t'
+V3_CLIENT_ROW = re.compile(br'\nCLIENT_LIST\t([^\t\n]*)\t')
+V3_ROUTE_ROW = re.compile(br'\nROUTING_TABLE\t([^\t\n]*\t[^\t\n]*)\t')
+
+
+def detect_version(data):
+    """ Detects the status-version of the status file content.
+
+        :return: 1, 2, 3 or None for unknown (or empty) content"""
+    if data.startswith(V1_CLIENT_LIST):
+        return 1
+    if data.startswith(V2_TITLE):
+        return 2
+    if data.startswith(V3_TITLE):
+        return 3
+    return None
+
+
+def parse_address(address):
+    """ Converts the virtual address of a routing table row into an address
+        object. Returns None for rows that do not describe a single client
+        address (subnets, cached routes)."""
+    if '/' in address:  # subnet
+        return None
+    try:
+        return Address.parse(address)
+    except ValueError:  # cached route ...
+        return None
+
+
+class StatusDelta(object):
+    """ Changes of the client list between two passes over one status file.
+
+        :ivar dict added: new clients with their addresses
+        :ivar dict removed: disconnected clients with their former addresses
+        :ivar dict changed: clients whose address list has changed, with their
+            new addresses"""
+    def __init__(self, added=None, removed=None, changed=None):
+        self.added = added or {}
+        self.removed = removed or {}
+        self.changed = changed or {}
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __repr__(self):
+        return '<StatusDelta +{0} -{1} ~{2}>'.format(
+            len(self.added), len(self.removed), len(self.changed))
+
+
+class ClientListSource(object):
+    """ Base class of the client lists maintained from events instead of
+        status file passes. The event handlers record the new address list
+        of every touched client in :attr:`pending` (under :attr:`lock`),
+        :meth:`update` (e.g. called in a reload thread) applies them.
+
+        :ivar dict clients: client list as of the last :meth:`update` call
+        :ivar dict pending: client name to its new address list (None for
+            disconnected clients)"""
+    def __init__(self):
+        self.clients = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def take_pending(self):
+        """ Returns and resets the pending changes (see :attr:`pending`)"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        return pending
+
+    def update(self):
+        """ Applies the pending changes to :attr:`clients`.
+
+            :return: the changes as :class:`StatusDelta`"""
+        delta = StatusDelta()
+        for client, addresses in self.take_pending().items():
+            previous = self.clients.get(client)
+            if addresses is None:
+                if previous is not None:
+                    del self.clients[client]
+                    delta.removed[client] = previous
+            elif previous is None:
+                self.clients[client] = addresses
+                delta.added[client] = addresses
+            elif sorted(previous) != sorted(addresses):
+                self.clients[client] = addresses
+                delta.changed[client] = addresses
+        return delta
+
+
+class StatusFile(object):
+    """ Incremental parser for one openvpn status file.
+
+        Every call of :meth:`update` reads the status file, remembers the byte
+        offsets of its sections and a fingerprint of every client and routing
+        row. Only rows whose fingerprint was not seen in the previous pass are
+        parsed; the client list in :attr:`clients` is patched accordingly and
+        the difference is returned as :class:`StatusDelta`.
+
+        :param str path: file path to the status file"""
+    def __init__(self, path):
+        self.path = path
+        self.clients = {}
+        self.offsets = {}
+        self.version = None
+        self.client_rows = frozenset()
+        self.route_rows = frozenset()
+
+    def read(self):
+        """ Reads the whole status file with one read call.
+
+            The file is deliberately not memory mapped: openvpn rewrites and
+            truncates it in place, accessing a mapping beyond the new end of
+            the file would kill the process with SIGBUS."""
+        with open(self.path, 'rb') as status_file:
+            data = status_file.read()
+        if b'\r\n' in data[:64]:  # written on windows
+            data = data.replace(b'\r\n', b'\n')
+        return data
+
+    def find_section(self, data, header, start=0):
+        """ Searches a section header, but tries the offset of the previous
+            pass first. Returns the offset of the section header or -1"""
+        offset = self.offsets.get(header)
+        if offset is None or not data.startswith(header, offset):
+            offset = data.find(header, start)
+        self.offsets[header] = offset
+        return offset
+
+    def split_rows(self, data, version):
+        """ Extracts the client and routing row fingerprints.
+
+            :return: tuple of a list with the client names and a list with
+                the "virtual address<separator>common name" strings of all
+                routes"""
+        if version == 1:
+            return self.split_rows_v1(data)
+        if version == 2:
+            return (V2_CLIENT_ROW.findall(data), V2_ROUTE_ROW.findall(data))
+        if version == 3:
+            return (V3_CLIENT_ROW.findall(data), V3_ROUTE_ROW.findall(data))
+        return [], []
+
+    def split_rows_v1(self, data):
+        """ Section based row extraction for status-version 1"""
+        routes = self.find_section(data, V1_ROUTING_TABLE)
+        if routes < 0:
+            routes = len(data)
+        stats = self.find_section(data, V1_GLOBAL_STATS, routes)
+        if stats < 0:
+            stats = len(data)
+        # skip the updated and column header lines of the client list:
+        clients_start = data.find(b'\n', data.find(b'\n', len(V1_CLIENT_LIST)) + 1)
+        client_rows = V1_CLIENT_ROW.findall(data, clients_start + 1, routes + 1)
+        # skip the column header line of the routing table:
+        routes_start = data.find(b'\n', routes + len(V1_ROUTING_TABLE))
+        if routes_start < 0 or routes_start > stats:
+            return client_rows, []
+        route_rows = V1_ROUTE_ROW.findall(data, routes_start + 1, stats + 1)
+        return client_rows, route_rows
+
+    def update(self):
+        """ Reads the status file again and applies the changes to
+            :attr:`clients`.
+
+            :raises ValueError: the status file references unknown clients
+            :return: the changes as :class:`StatusDelta`"""
+        try:
+            return self._update()
+        except Exception:
+            # forget the partially applied pass, parse from scratch next time
+            self.clients.clear()
+            self.client_rows = frozenset()
+            self.route_rows = frozenset()
+            raise
+
+    def _update(self):
+        data = self.read()
+        version = detect_version(data)
+        previous = {}
+        if None not in (version, self.version) and version != self.version:
+            # fingerprints are format specific: start from scratch
+            previous.update(self.clients)
+            self.clients.clear()
+            self.client_rows = frozenset()
+            self.route_rows = frozenset()
+        if version is not None:
+            self.version = version
+        separator = b'\t' if self.version == 3 else b','
+        client_list, route_list = self.split_rows(data, version)
+        client_rows = frozenset(client_list)
+        route_rows = frozenset(route_list)
+        if not self.client_rows and not self.route_rows:
+            # first pass - keep file order
+            new_clients, new_routes = client_list, route_list
+        else:
+            new_clients = client_rows - self.client_rows
+            new_routes = route_rows - self.route_rows
+        gone_clients = self.client_rows - client_rows
+        gone_routes = self.route_rows - route_rows
+
+        clients = self.clients
+
+        def touch(client):
+            if client not in previous:
+                previous[client] = clients.get(client)
+
+        for client in gone_clients:
+            client = client.decode('utf-8')
+            touch(client)
+            del clients[client]
+        for client in new_clients:
+            client = client.decode('utf-8')
+            touch(client)
+            clients[client] = []
+        for route in gone_routes:
+            address, client = route.split(separator, 1)
+            address = parse_address(address.decode('utf-8'))
+            if address is None:
+                continue
+            client = client.decode('utf-8')
+            if client not in clients:  # client is already gone
+                continue
+            touch(client)
+            clients[client] = [a for a in clients[client] if a != address]
+        for route in new_routes:
+            address, client = route.split(separator, 1)
+            address = parse_address(address.decode('utf-8'))
+            if address is None:
+                continue
+            client = client.decode('utf-8')
+            if client not in clients:
+                raise ValueError('Error in status file')
+            touch(client)
+            clients[client] = clients[client] + [address]
+
+        self.client_rows = client_rows
+        self.route_rows = route_rows
+
+        delta = StatusDelta()
+        for client, old_addresses in previous.items():
+            new_addresses = clients.get(client)
+            if old_addresses is None and new_addresses is None:
+                continue
+            elif old_addresses is None:
+                delta.added[client] = new_addresses
+            elif new_addresses is None:
+                delta.removed[client] = old_addresses
+            elif sorted(old_addresses) != sorted(new_addresses):
+                delta.changed[client] = new_addresses
+        return delta
+
+
+def extract_zones_from_status_file(status_path):
+    """ Parses a openvpn status file and extracts the list of connected clients
+        and there ip address """
+    status_file = StatusFile(status_path)
+    status_file.update()
+    return status_file.clients
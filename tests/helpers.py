@@ -0,0 +1,111 @@
+# -*- coding: UTF-8 -*-
+""" Helpers shared by the test modules"""
+import os
+import struct
+
+from twisted.internet import address
+from twisted.names import dns
+
+from config import ConfigParser
+from dnsserver import OpenVpnDNSServerFactory
+from openvpnzone import InMemoryAuthority, OpenVpnAuthorityHandler, \
+    ZoneRecords
+
+
+def make_soa(serial):
+    return dns.Record_SOA(
+        mname='dns.example.org',
+        rname='admin.example.org',
+        serial=int(serial),
+        refresh='1h',
+        retry='2h',
+        expire='3h',
+        minimum='4h'
+    )
+
+
+def zone(serial, **names):
+    soa = make_soa(serial)
+    records = {b'vpn.example.org': [soa]}
+    for name, address in names.items():
+        records[name.encode('ascii') + b'.vpn.example.org'] = [dns.Record_A(address)]
+    return (b'vpn.example.org', soa), ZoneRecords(records).update_digests()
+
+
+def write_status(path, clients):
+    """ Writes a minimal v1 status file with the given (name, address)
+        tuples"""
+    lines = ['OpenVPN CLIENT LIST', 'Updated,Wed Jul 17 22:53:32 2013',
+             'Common Name,Real Address,Bytes Received,Bytes Sent,Connected Since']
+    for name, address in clients:
+        lines.append('{0},192.0.2.2:43156,1,2,Tue Jul  9 16:49:58 2013'.format(name))
+    lines += ['ROUTING TABLE', 'Virtual Address,Common Name,Real Address,Last Ref']
+    for name, address in clients:
+        lines.append('{0},{1},192.0.2.2:43156,Tue Jul  9 16:50:00 2013'.format(address, name))
+    lines += ['GLOBAL STATS', 'Max bcast/mcast queue length,1', 'END', '']
+    path.write_text('\n'.join(lines))
+
+
+class FakeTransport(object):
+    def __init__(self, protocol):
+        self.protocol = protocol
+
+    def write(self, data, address=None):
+        if address is None:  # strip TCP length prefix
+            assert struct.unpack('!H', data[:2])[0] == len(data) - 2
+            data = data[2:]
+        message = dns.Message()
+        message.fromStr(data)
+        self.protocol.messages.append((message, address))
+
+    def getPeer(self):
+        return address.IPv4Address('TCP', '127.0.0.1', 40000)
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+        while self.producer is not None:  # pull until the transfer is done
+            producer.resumeProducing()
+
+    def unregisterProducer(self):
+        self.producer = None
+
+
+class FakeProtocol(object):
+    def __init__(self):
+        self.messages = []
+        self.transport = FakeTransport(self)
+
+    def writeMessage(self, message, address=None):
+        self.messages.append((message, address))
+
+
+def make_factory():
+    a = InMemoryAuthority()
+    a.setData(*zone(1, one='127.0.0.1'))
+    a.setData(*zone(2, one='127.0.0.1', two='127.0.0.2'))
+    return OpenVpnDNSServerFactory([a])
+
+
+def delta_handler(tmp_path, clients, delta_updates='yes'):
+    path = tmp_path / 'status'
+    write_status(path, clients)
+    os.utime(str(path), (1000, 1000))
+    cp = ConfigParser()
+    cp.parse_data({
+        'options': [
+            ('instance', 'vpn.example.org'),
+        ],
+        'vpn.example.org': [
+            ('mname', 'dns.example.org'),
+            ('rname', 'dns.example.org'),
+            ('refresh', '1h'),
+            ('retry', '2h'),
+            ('expire', '3h'),
+            ('minimum', '4h'),
+            ('subnet4', '198.51.100.0/24'),
+            ('suffix', '@'),
+            ('delta_updates', delta_updates),
+            ('status_file', str(path)),
+        ]
+    })
+    return path, cp.instances['vpn.example.org'], OpenVpnAuthorityHandler(cp)
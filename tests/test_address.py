@@ -0,0 +1,80 @@
+# -*- coding: UTF-8 -*-
+import pytest
+
+from address import Address, parse_reverse_name, reverse_name_range
+
+
+def test_ipv4():
+    address = Address.parse('198.51.100.8')
+    assert address.version == 4
+    assert address.packed == b'\xc6\x33\x64\x08'
+    assert address.text == '198.51.100.8'
+    assert str(address) == '198.51.100.8'
+    assert address.reverse == b'8.100.51.198.in-addr.arpa'
+    assert int(address) == 0xc6336408
+
+
+def test_ipv6():
+    address = Address.parse('fddc:abcd:1234:0::1008')
+    assert address.version == 6
+    assert address.text == 'fddc:abcd:1234::1008'
+    assert address.reverse == b'8.0.0.1.0.0.0.0.0.0.0.0.0.0.0.0' \
+        b'.0.0.0.0.4.3.2.1.d.c.b.a.c.d.d.f.ip6.arpa'
+
+
+@pytest.mark.parametrize('text', ['198.51.100.12C', '9.0.0.0/8', 'fe80::1::2',
+                                  'one.vpn.example.org', ''])
+def test_invalid(text):
+    with pytest.raises(ValueError):
+        Address.parse(text)
+
+
+def test_comparison():
+    assert Address.parse('198.51.100.8') == Address.parse('198.51.100.8')
+    assert Address.parse('198.51.100.8') != Address.parse('198.51.100.9')
+    assert hash(Address.parse('::1')) == hash(Address.parse('0::1'))
+    assert sorted([Address.parse('::1'), Address.parse('198.51.100.9'),
+                   Address.parse('198.51.100.8')]) \
+        == [Address.parse('198.51.100.8'), Address.parse('198.51.100.9'),
+            Address.parse('::1')]
+
+
+@pytest.mark.parametrize('text', ['198.51.100.8', 'fddc:abcd:1234::1008'])
+def test_parse_reverse_name(text):
+    address = Address.parse(text)
+    assert parse_reverse_name(address.reverse) == address.packed
+    assert parse_reverse_name(address.reverse.upper()) == address.packed
+
+
+@pytest.mark.parametrize('name', [b'100.51.198.in-addr.arpa',
+                                  b'08.100.51.198.in-addr.arpa',
+                                  b'256.100.51.198.in-addr.arpa',
+                                  b'x.100.51.198.in-addr.arpa',
+                                  b'8.100.51.198.in-addr.arpa.example.org',
+                                  b'0.0.0.0.4.3.2.1.d.c.b.a.c.d.d.f.ip6.arpa',
+                                  b'one.vpn.example.org'])
+def test_parse_invalid_reverse_name(name):
+    assert parse_reverse_name(name) is None
+
+
+@pytest.mark.parametrize('name,bounds', [
+    (b'100.51.198.in-addr.arpa', ('198.51.100.0', '198.51.100.255')),
+    (b'8.100.51.198.IN-ADDR.ARPA', ('198.51.100.8', '198.51.100.8')),
+    (b'in-addr.arpa', ('0.0.0.0', '255.255.255.255')),
+    (b'd.c.d.f.ip6.arpa', ('fdcd::', 'fdcd:ffff:ffff:ffff:ffff:ffff:ffff:ffff')),
+    (b'1.d.c.d.f.ip6.arpa', ('fdcd:1000::',
+                             'fdcd:1fff:ffff:ffff:ffff:ffff:ffff:ffff')),
+])
+def test_reverse_name_range(name, bounds):
+    assert reverse_name_range(name) \
+        == tuple(Address.parse(text).packed for text in bounds)
+
+
+@pytest.mark.parametrize('name', [b'08.100.51.198.in-addr.arpa',
+                                  b'256.51.198.in-addr.arpa',
+                                  b'1.8.100.51.198.in-addr.arpa',
+                                  b'dc.d.f.ip6.arpa',
+                                  b'x.d.f.ip6.arpa',
+                                  b'one.vpn.example.org'])
+def test_invalid_reverse_name_range(name):
+    assert reverse_name_range(name) is None
@@ -2,13 +2,20 @@
 import os.path
 import socket
 
+from twisted.internet import defer
+from twisted.internet import inotify
+from twisted.internet import threads
+from twisted.internet.task import Clock
 from twisted.names import dns
 from twisted.names.resolve import ResolverChain
 from twisted.python.failure import Failure
+from twisted.python.filepath import FilePath
 from IPy import IP
+import pytest
 
 from config import ConfigParser
 from openvpnzone import OpenVpnAuthorityHandler
+from tests.helpers import delta_handler, write_status
 
 
 def test_soa():
@@ -313,3 +320,426 @@ def test_suffix_at():
     assert rr.name.name == b'one.two.vpn.example.org'
     assert rr.payload.__class__ == dns.Record_A
     assert rr.payload.address == socket.inet_aton('198.51.100.12')
+
+
+def test_delta_updates(tmp_path):
+    path, instance, handler = delta_handler(
+        tmp_path, [('one', '198.51.100.8'), ('two', '198.51.100.12')])
+    forward = handler.authorities['vpn.example.org'].forward
+    backward4 = handler.authorities['vpn.example.org'].backward4
+    records = forward.records
+    two = forward.records.clients[b'two.vpn.example.org']
+    write_status(path, [('two', '198.51.100.12'), ('three', '198.51.100.16')])
+    os.utime(str(path), (2000, 2000))
+    handler.loadInstance(instance)
+    # patched in place:
+    assert forward.records is records
+    assert forward.records.clients[b'two.vpn.example.org'] is two
+    assert b'one.vpn.example.org' not in forward.records
+    assert forward.records[b'three.vpn.example.org'] \
+        == [dns.Record_A('198.51.100.16')]
+    assert forward.changed_names \
+        == {b'one.vpn.example.org', b'three.vpn.example.org'}
+    assert b'8.100.51.198.in-addr.arpa' not in backward4.records
+    assert backward4.records[b'16.100.51.198.in-addr.arpa'] \
+        == [dns.Record_PTR(b'three.vpn.example.org')]
+    assert forward.soa[1].serial == 2000
+    assert backward4.soa[1].serial == 2000
+    assert forward.records[b'vpn.example.org'] == [forward.soa[1]]
+
+
+def test_delta_updates_match_full_rebuild(tmp_path):
+    path, instance, handler = delta_handler(
+        tmp_path, [('one', '198.51.100.8'), ('two', '198.51.100.12')])
+    write_status(path, [('two', '198.51.100.13'), ('three', '198.51.100.16'),
+                        ('four', 'fddc:abcd:1234::1008')])
+    handler.loadInstance(instance)
+    authorities = handler.authorities['vpn.example.org']
+    (tmp_path / 'full').mkdir()
+    full_handler = delta_handler(tmp_path / 'full', [
+        ('two', '198.51.100.13'), ('three', '198.51.100.16'),
+        ('four', 'fddc:abcd:1234::1008')], delta_updates='no')[2]
+    full_authorities = full_handler.authorities['vpn.example.org']
+    for zone in ('forward', 'backward4'):
+        assert getattr(authorities, zone).records.digest \
+            == getattr(full_authorities, zone).records.digest
+
+
+def test_serial_increases_without_mtime_change(tmp_path):
+    path, instance, handler = delta_handler(tmp_path, [('one', '198.51.100.8')])
+    write_status(path, [('two', '198.51.100.12')])
+    os.utime(str(path), (1000, 1000))
+    handler.loadInstance(instance)
+    assert handler.authorities['vpn.example.org'].forward.soa[1].serial == 1001
+
+
+def test_status_file_changes_are_coalesced(tmp_path):
+    path, instance, handler = delta_handler(tmp_path, [('one', '198.51.100.8')])
+    handler.scheduler.clock = Clock()
+    loads = []
+    handler.reload_instance = loads.append
+    for i in range(3):
+        handler.status_file_changed(None, FilePath(str(path)), inotify.IN_MODIFY)
+    handler.status_file_changed(None, FilePath(str(tmp_path / 'other')),
+                                inotify.IN_MODIFY)
+    assert len(handler.scheduler.clock.getDelayedCalls()) == 1
+    handler.scheduler.clock.advance(1)
+    assert loads == [instance]
+
+
+@pytest.mark.parametrize('delta_updates', ['yes', 'no'])
+def test_prepared_zones_are_installed_in_one_step(tmp_path, delta_updates):
+    path, instance, handler = delta_handler(
+        tmp_path, [('one', '198.51.100.8')], delta_updates=delta_updates)
+    forward = handler.authorities['vpn.example.org'].forward
+    soa, names = forward.soa, set(forward.records)
+    write_status(path, [('two', '198.51.100.12')])
+    os.utime(str(path), (2000, 2000))
+    install = handler.prepare_instance(instance)
+    # nothing served has changed yet:
+    assert forward.soa is soa
+    assert set(forward.records) == names
+    install()
+    assert forward.soa[1].serial == 2000
+    assert forward.changed_names \
+        == {b'one.vpn.example.org', b'two.vpn.example.org'}
+    assert handler.prepare_instance(instance) is None  # unchanged
+
+
+def test_reload_instance_installs_prepared_zones(tmp_path, monkeypatch):
+    path, instance, handler = delta_handler(tmp_path, [('one', '198.51.100.8')])
+    monkeypatch.setattr(threads, 'deferToThread', defer.maybeDeferred)
+    write_status(path, [('two', '198.51.100.12')])
+    os.utime(str(path), (2000, 2000))
+    d = handler.reload_instance(instance)
+    assert d.called
+    assert handler.authorities['vpn.example.org'].forward.soa[1].serial == 2000
+
+
+def reload_config(tmp_path, instances):
+    """ Returns a configuration with the given instances (name to a list of
+        additional options), their status files contain one client"""
+    data = {'options': [('instance', name) for name in instances]}
+    for name, options in instances.items():
+        path = tmp_path / name
+        if not path.exists():
+            write_status(path, [('one', '198.51.100.8')])
+            os.utime(str(path), (1000, 1000))
+        data[name] = [
+            ('mname', 'dns.example.org'),
+            ('rname', 'dns.example.org'),
+            ('refresh', '1h'),
+            ('retry', '2h'),
+            ('expire', '3h'),
+            ('minimum', '4h'),
+            ('suffix', '@'),
+            ('status_file', str(path)),
+        ] + options
+        data['entries'] = [('www', 'A 192.0.2.80')]
+    cp = ConfigParser()
+    cp.parse_data(data)
+    return cp
+
+
+def test_reload_config(tmp_path):
+    handler = OpenVpnAuthorityHandler(reload_config(tmp_path, {
+        'a.example.org': [], 'b.example.org': [], 'c.example.org': [],
+        'd.example.org': [('notify', 'ns.example.org')],
+        'e.example.org': [('subnet4', '198.51.100.0/24')]}))
+    sets = []
+    handler.zone_set_listeners.append(lambda zones: sets.append(list(zones)))
+    a = handler.authorities['a.example.org'].forward
+    records = a.records
+    d = handler.authorities['d.example.org'].forward
+    c = handler.authorities['c.example.org'].forward
+    e = handler.authorities['e.example.org']
+    handler.scheduler.clock = Clock()
+    changes = handler.reload_config(reload_config(tmp_path, {
+        'a.example.org': [],
+        'c.example.org': [('add_entries', 'entries')],
+        'd.example.org': [('notify', 'ns2.example.org')],
+        'e.example.org': [('subnet4', '198.51.101.0/24')],
+        'f.example.org': []}))
+    assert changes == {'b.example.org': 'removed',
+                       'c.example.org': 'rebuilt',
+                       'd.example.org': 'updated',
+                       'e.example.org': 'recreated',
+                       'f.example.org': 'added'}
+    # unchanged zones are kept:
+    assert handler.authorities['a.example.org'].forward is a
+    assert a.records is records and a.soa[1].serial == 1000
+    assert d.soa[1].serial == 1000
+    assert handler.config.instances['d.example.org'].notify \
+        == [('ns2.example.org', 53)]
+    # rebuilt in place with a new serial by a scheduled reload:
+    assert handler.authorities['c.example.org'].forward is c
+    assert c.soa[1].serial == 1000
+    assert len(handler.scheduler.clock.getDelayedCalls()) == 1
+    handler.loadInstance(handler.config.instances['c.example.org'])
+    assert c.soa[1].serial == 1001
+    assert c.records[b'www.c.example.org'] == [dns.Record_A('192.0.2.80')]
+    assert handler.authorities['e.example.org'] is not e
+    assert e.backward4 not in handler
+    assert 'b.example.org' not in handler.authorities
+    assert {authority.soa[0] for authority in handler} == {
+        b'a.example.org', b'c.example.org', b'd.example.org', b'e.example.org',
+        b'101.51.198.in-addr.arpa', b'f.example.org'}
+    assert sets == [list(handler)]
+    c = ResolverChain(handler)
+    assert c.query(dns.Query(b'one.f.example.org', dns.A, dns.IN)).result[0][0] \
+        .payload == dns.Record_A('198.51.100.8')
+
+
+def test_reload_config_ignores_removed_instances(tmp_path):
+    cp = reload_config(tmp_path, {'a.example.org': [], 'b.example.org': []})
+    handler = OpenVpnAuthorityHandler(cp)
+    b = cp.instances['b.example.org']
+    handler.reload_config(reload_config(tmp_path, {'a.example.org': []}))
+    assert handler.status_file_change_done(b, 'IN_MODIFY') is None
+    assert handler.reload_config(reload_config(tmp_path, {
+        'a.example.org': []})) == {}
+
+
+def test_notify_with_serial_of_the_changed_zone(tmp_path):
+    handler = OpenVpnAuthorityHandler(reload_config(tmp_path, {
+        'a.example.org': [('subnet4', '198.51.100.0/24'),
+                          ('notify', '192.0.2.53')]}))
+    handler.scheduler.clock = Clock()
+    notifies = []
+    handler.notifier.notify = lambda server, zone, soa: notifies.append(
+        (zone, soa.serial))
+    handler.start_notify()
+    assert notifies == [(b'a.example.org', 1000),
+                        (b'100.51.198.in-addr.arpa', 1000)]
+    del notifies[:]
+    handler.reload_config(reload_config(tmp_path, {
+        'a.example.org': [('subnet4', '198.51.100.0/24'),
+                          ('notify', '192.0.2.53'),
+                          ('add_backward4_entries', 'entries')]}))
+    handler.loadInstance(handler.config.instances['a.example.org'])
+    assert handler.authorities['a.example.org'].forward.soa[1].serial == 1000
+    assert notifies == [(b'100.51.198.in-addr.arpa', 1001)]
+
+
+def test_reload_config_keeps_pending_reloads(tmp_path):
+    cp = reload_config(tmp_path, {'a.example.org': []})
+    handler = OpenVpnAuthorityHandler(cp)
+    handler.scheduler.clock = Clock()
+    instance = cp.instances['a.example.org']
+    write_status(tmp_path / 'a.example.org', [('one', '198.51.100.8'),
+                                               ('two', '198.51.100.12')])
+    handler.scheduler.changed(instance, 'IN_MODIFY')
+    assert handler.reload_config(reload_config(tmp_path, {
+        'a.example.org': [('add_entries', 'entries')]})) \
+        == {'a.example.org': 'rebuilt'}
+    # updated in place, one reload for both changes:
+    assert handler.config.instances['a.example.org'] is instance
+    assert instance.forward_records
+    assert len(handler.scheduler.clock.getDelayedCalls()) == 1
+    handler.loadInstance(instance)
+    records = handler.authorities['a.example.org'].forward.records
+    assert b'two.a.example.org' in records
+    assert b'www.a.example.org' in records
+
+
+def test_reload_config_keeps_instances_failing_to_load(tmp_path):
+    cp = reload_config(tmp_path, {'a.example.org': []})
+    handler = OpenVpnAuthorityHandler(cp)
+    sets = []
+    handler.zone_set_listeners.append(lambda zones: sets.append(list(zones)))
+    a = handler.authorities['a.example.org']
+    new = reload_config(tmp_path, {'a.example.org': [], 'b.example.org': []})
+    new.instances['a.example.org'].status_file = str(tmp_path / 'missing')
+    new.instances['b.example.org'].status_file = str(tmp_path / 'missing')
+    assert handler.reload_config(new) == {}
+    assert handler.config.instances['a.example.org'] \
+        is cp.instances['a.example.org']
+    assert 'b.example.org' not in handler.config.instances
+    assert handler.authorities == {'a.example.org': a}
+    assert list(handler) == [a.forward]
+    assert a.forward.soa[1].serial == 1000
+    assert sets == []
+
+
+def test_reload_config_from_file(tmp_path):
+    path = tmp_path / 'openvpn2dns.ini'
+    path.write_text('[options]\ninstance = a.example.org\n'
+                    '[a.example.org]\nmname = dns.example.org\n'
+                    'rname = dns.example.org\nrefresh = 1h\nretry = 2h\n'
+                    'expire = 3h\nminimum = 4h\n'
+                    'status_file = tests/samples/empty.ovpn-status-v1\n')
+    handler = OpenVpnAuthorityHandler(ConfigParser(str(path)))
+    path.write_text('[options]\ninstance = b.example.org\n')
+    assert handler.reload_config() is None  # missing instance section
+    assert set(handler.config.instances) == {'a.example.org'}
+
+
+def warm_handler(tmp_path, clients):
+    """ Starts a handler with a state directory, the status file contains
+        the given clients"""
+    path = tmp_path / 'status'
+    write_status(path, clients)
+    os.utime(str(path), (1000, 1000))
+    (tmp_path / 'state').mkdir(exist_ok=True)
+    cp = ConfigParser()
+    cp.parse_data({
+        'options': [
+            ('instance', 'vpn.example.org'),
+            ('state_directory', str(tmp_path / 'state')),
+        ],
+        'vpn.example.org': [
+            ('mname', 'dns.example.org'),
+            ('rname', 'dns.example.org'),
+            ('refresh', '1h'),
+            ('retry', '2h'),
+            ('expire', '3h'),
+            ('minimum', '4h'),
+            ('subnet4', '198.51.100.0/24'),
+            ('suffix', '@'),
+            ('delta_updates', 'yes'),
+            ('status_file', str(path)),
+        ]
+    })
+    handler = OpenVpnAuthorityHandler(cp)
+    handler.persister.stop()
+    instance = cp.instances['vpn.example.org']
+    state = handler.scheduler.states.get(instance)
+    if state is not None:  # warm start: cancel the background reload
+        state.timer.cancel()
+    return instance, handler
+
+
+def test_warm_start_from_snapshots(tmp_path, monkeypatch):
+    monkeypatch.setattr(threads, 'deferToThread', defer.maybeDeferred)
+    instance, handler = warm_handler(tmp_path, [('one', '198.51.100.8'),
+                                                ('two', '198.51.100.12')])
+    assert not handler.scheduler.states  # cold start
+    handler.save_snapshots()
+    assert sorted(p.name for p in (tmp_path / 'state').iterdir()) == [
+        '100.51.198.in-addr.arpa.snapshot', 'vpn.example.org.snapshot']
+    instance, handler = warm_handler(tmp_path, [('two', '198.51.100.12'),
+                                                ('three', '198.51.100.16')])
+    forward = handler.authorities['vpn.example.org'].forward
+    backward4 = handler.authorities['vpn.example.org'].backward4
+    # served from the snapshots before the status file is read:
+    assert forward.soa[1].serial == 1000
+    assert forward.records[b'one.vpn.example.org'] \
+        == [dns.Record_A('198.51.100.8')]
+    assert forward.lookupNegative(b'three.vpn.example.org') == dns.ENAME
+    assert len(forward.lookupZone(b'vpn.example.org').result[0]) == 4
+    assert backward4.records[b'8.100.51.198.in-addr.arpa'] \
+        == [dns.Record_PTR(b'one.vpn.example.org')]
+    handler.loadInstance(instance)
+    # the serial continues, the changes are journaled:
+    assert forward.soa[1].serial == 1001
+    assert forward.changed_names == {b'one.vpn.example.org',
+                                     b'three.vpn.example.org'}
+    answers = forward.lookupIncrementalZone(b'vpn.example.org', 1000).result[0]
+    assert [answer.payload.TYPE for answer in answers] \
+        == [dns.SOA, dns.SOA, dns.A, dns.SOA, dns.A, dns.SOA]
+    # patched from now on:
+    records = forward.records
+    write_status(tmp_path / 'status', [('two', '198.51.100.12')])
+    os.utime(str(tmp_path / 'status'), (2000, 2000))
+    handler.loadInstance(instance)
+    assert forward.records is records
+    assert b'three.vpn.example.org' not in forward.records
+    handler.save_snapshots()
+    instance, handler = warm_handler(tmp_path, [('two', '198.51.100.12')])
+    assert handler.authorities['vpn.example.org'].forward.soa[1].serial == 2000
+
+
+def test_warm_start_keeps_unchanged_zones(tmp_path, monkeypatch):
+    monkeypatch.setattr(threads, 'deferToThread', defer.maybeDeferred)
+    instance, handler = warm_handler(tmp_path, [('one', '198.51.100.8')])
+    handler.save_snapshots()
+    instance, handler = warm_handler(tmp_path, [('one', '198.51.100.8')])
+    forward = handler.authorities['vpn.example.org'].forward
+    handler.loadInstance(instance)
+    assert forward.soa[1].serial == 1000
+    assert forward.records[b'vpn.example.org'][0] is forward.soa[1]
+    assert forward.records.clients  # client records replace the snapshot
+    assert not handler.unsaved  # nothing changed, nothing to write
+
+
+def test_invalid_snapshot_is_ignored(tmp_path):
+    (tmp_path / 'state').mkdir()
+    (tmp_path / 'state' / 'vpn.example.org.snapshot').write_bytes(b'invalid')
+    (tmp_path / 'state' / '100.51.198.in-addr.arpa.snapshot').write_bytes(b'')
+    instance, handler = warm_handler(tmp_path, [('one', '198.51.100.8')])
+    assert not handler.scheduler.states
+    assert handler.authorities['vpn.example.org'].forward.records \
+        .clients  # read synchronously
+
+
+def test_save_snapshots_in_thread(tmp_path, monkeypatch):
+    writes = []
+
+    def deferToThread(function, *args):
+        writes.append((defer.Deferred(), function, args))
+        return writes[-1][0]
+    monkeypatch.setattr(threads, 'deferToThread', deferToThread)
+    instance, handler = warm_handler(tmp_path, [('one', '198.51.100.8')])
+    forward = handler.authorities['vpn.example.org'].forward
+    saved = handler.save_snapshots()
+    assert len(writes) == 1 and not list((tmp_path / 'state').iterdir())
+    snapshots = writes[0][2][0]
+    # the thread writes copies of the records:
+    assert [name for _, name, _ in snapshots if name == b'vpn.example.org']
+    assert all(records is not forward.records for _, _, records in snapshots)
+    # a second save waits for the running one:
+    handler.unsaved.add(forward)
+    again = handler.save_snapshots()
+    assert len(writes) == 1
+    d, function, args = writes.pop()
+    function(*args)
+    d.callback(None)
+    assert saved.called and not again.called
+    assert len(writes) == 1 and handler.saving is writes[0][0]
+    d, function, args = writes.pop()
+    d.callback(None)
+    assert again.called and handler.saving is None
+    assert (tmp_path / 'state' / 'vpn.example.org.snapshot').exists()
+
+
+def test_reload_config_continues_recreated_zones(tmp_path):
+    handler = OpenVpnAuthorityHandler(reload_config(tmp_path, {
+        'a.example.org': [('subnet4', '198.51.100.0/24')]}))
+    handler.scheduler.clock = Clock()
+    handler.reload_config(reload_config(tmp_path, {
+        'a.example.org': [('subnet4', '198.51.100.0/24'),
+                          ('add_entries', 'entries')]}))
+    handler.loadInstance(handler.config.instances['a.example.org'])
+    forward = handler.authorities['a.example.org'].forward
+    assert forward.soa[1].serial == 1001
+    assert handler.reload_config(reload_config(tmp_path, {
+        'a.example.org': [('subnet4', '198.51.101.0/24'),
+                          ('add_entries', 'entries')]})) \
+        == {'a.example.org': 'recreated'}
+    # the serial never goes backwards, the journal continues:
+    recreated = handler.authorities['a.example.org']
+    assert recreated.forward is not forward
+    assert recreated.forward.soa[1].serial == 1001  # unchanged
+    assert recreated.backward4.soa[1].serial == 1002
+    assert recreated.forward.journal == forward.journal
+    write_status(tmp_path / 'a.example.org', [('two', '198.51.100.12')])
+    os.utime(str(tmp_path / 'a.example.org'), (1000, 1000))
+    handler.loadInstance(handler.config.instances['a.example.org'])
+    assert recreated.forward.soa[1].serial == 1003
+    answers = recreated.forward.lookupIncrementalZone(
+        b'a.example.org', 1000).result[0]
+    assert [answer.payload.TYPE for answer in answers].count(dns.SOA) == 6
+
+
+def test_reload_config_resizes_journal(tmp_path):
+    handler = OpenVpnAuthorityHandler(reload_config(tmp_path, {
+        'a.example.org': []}))
+    forward = handler.authorities['a.example.org'].forward
+    forward.journal.extend(range(5))
+    assert handler.reload_config(reload_config(tmp_path, {
+        'a.example.org': [('journal_size', '2')]})) \
+        == {'a.example.org': 'updated'}
+    assert handler.authorities['a.example.org'].forward is forward
+    assert forward.soa[1].serial == 1000
+    assert list(forward.journal) == [3, 4]
+    assert forward.journal.maxlen == 2
@@ -0,0 +1,166 @@
+# -*- coding: UTF-8 -*-
+from twisted.names import dns
+import pytest
+
+from address import Address
+from openvpnzone import (ForwardRecords, InMemoryAuthority, ReverseRecords,
+                         ZoneRecords, pack_addresses)
+from tests.helpers import make_soa
+
+
+def packed(*addresses):
+    return [Address.parse(address).packed for address in addresses]
+
+
+def forward(**clients):
+    records = ForwardRecords(ZoneRecords({
+        b'vpn.example.org': [make_soa(1), dns.Record_NS('ns.example.org')],
+        b'ns.vpn.example.org': [dns.Record_A('192.0.2.53')],
+    }))
+    for name, addresses in clients.items():
+        records.add(name.encode('ascii') + b'.vpn.example.org',
+                    packed(*addresses))
+    return records.update_digests()
+
+
+def reverse(**clients):
+    records = ReverseRecords(ZoneRecords({
+        b'100.51.198.in-addr.arpa': [make_soa(1)]}))
+    for name, addresses in clients.items():
+        for address in packed(*addresses):
+            records.add(address, name.encode('ascii') + b'.vpn.example.org')
+    return records.update_digests()
+
+
+def test_forward_records():
+    records = forward(one=['198.51.100.8', 'fd00::8'], two=['198.51.100.12'])
+    assert records[b'one.vpn.example.org'] == [
+        dns.Record_A('198.51.100.8'), dns.Record_AAAA('fd00::8')]
+    assert records[b'ns.vpn.example.org'] == [dns.Record_A('192.0.2.53')]
+    assert b'two.vpn.example.org' in records
+    assert b'three.vpn.example.org' not in records
+    with pytest.raises(KeyError):
+        records[b'three.vpn.example.org']
+    assert set(records) == {b'vpn.example.org', b'ns.vpn.example.org',
+                            b'one.vpn.example.org', b'two.vpn.example.org'}
+    assert len(records) == 4
+    assert records.record_count() == 6
+
+
+def test_reverse_records():
+    records = reverse(one=['198.51.100.8'], two=['198.51.100.12'],
+                      three=['198.51.100.12'])
+    assert records[b'8.100.51.198.in-addr.arpa'] \
+        == [dns.Record_PTR(b'one.vpn.example.org')]
+    assert records[b'12.100.51.198.IN-ADDR.ARPA'.lower()] == [
+        dns.Record_PTR(b'three.vpn.example.org'),
+        dns.Record_PTR(b'two.vpn.example.org')]
+    assert b'100.51.198.in-addr.arpa' in records
+    assert b'9.100.51.198.in-addr.arpa' not in records
+    assert len(records) == 3
+    assert records.record_count() == 4
+
+
+def test_static_and_client_records_of_one_name():
+    records = forward(ns=['198.51.100.53'])
+    assert records[b'ns.vpn.example.org'] == [
+        dns.Record_A('192.0.2.53'), dns.Record_A('198.51.100.53')]
+    assert len(records) == 2
+    assert records.record_count() == 4
+
+
+@pytest.mark.parametrize('records', [
+    forward(one=['198.51.100.8', 'fd00::8'], two=['198.51.100.12'],
+            ns=['198.51.100.53']),
+    reverse(one=['198.51.100.8'], two=['198.51.100.12'],
+            three=['198.51.100.12']),
+])
+def test_digest_matches_zone_records(records):
+    expected = ZoneRecords(dict(records.items())).update_digests()
+    assert records.digest == expected.digest
+
+
+def test_changed_names():
+    one = forward(one=['198.51.100.8'], two=['198.51.100.12'])
+    two = forward(two=['198.51.100.13'], three=['198.51.100.16'])
+    assert one.changed_names(two) == {b'one.vpn.example.org',
+                                      b'two.vpn.example.org',
+                                      b'three.vpn.example.org'}
+    assert one.changed_names(ZoneRecords(dict(two.items()))) \
+        == one.changed_names(two)
+
+
+def test_apply_changes():
+    records = forward(one=['198.51.100.8'], two=['198.51.100.12'])
+    one = records[b'one.vpn.example.org']
+    entries = {b'one.vpn.example.org': None,
+               b'two.vpn.example.org': records.clients[b'two.vpn.example.org'],
+               b'three.vpn.example.org': pack_addresses(
+                   packed('198.51.100.16'))}
+    changed, previous = records.apply({
+        key: (value, records.digest_change(key, value))
+        for key, value in entries.items()})
+    assert changed == {b'one.vpn.example.org', b'three.vpn.example.org'}
+    assert previous == {b'one.vpn.example.org': one,
+                        b'three.vpn.example.org': ()}
+    assert records.digest == forward(two=['198.51.100.12'],
+                                     three=['198.51.100.16']).digest
+
+
+def test_digest_computed_on_demand():
+    records = ForwardRecords()
+    records.add(b'one.vpn.example.org', packed('198.51.100.8'))
+    assert records._digest is None
+    assert records.digest_change(b'one.vpn.example.org', None) is None
+    records.apply({b'two.vpn.example.org': (
+        pack_addresses(packed('198.51.100.12')), None)})
+    assert records._digest is None
+    assert records.digest == ZoneRecords(dict(records.items())) \
+        .update_digests().digest
+    records.apply({b'one.vpn.example.org': (None, None)})
+    assert records._digest is None
+    assert records.digest == ZoneRecords(dict(records.items())) \
+        .update_digests().digest
+
+
+def test_authority_answers_from_client_records():
+    authority = InMemoryAuthority()
+    authority.setData((b'vpn.example.org', make_soa(1)),
+                      forward(one=['198.51.100.8']))
+    answers = authority.query(dns.Query(b'one.vpn.example.org', dns.A)) \
+        .result[0]
+    assert [rr.payload for rr in answers] == [dns.Record_A('198.51.100.8')]
+    assert authority.setData((b'vpn.example.org', make_soa(2)),
+                             forward(one=['198.51.100.8'])) is False
+    assert authority.setData((b'vpn.example.org', make_soa(3)),
+                             forward(one=['198.51.100.9']), set()) is False
+
+
+def test_negative_lookups():
+    authority = InMemoryAuthority()
+    records = forward(one=['198.51.100.8'])
+    records.add(b'two.sub.vpn.example.org', packed('198.51.100.12'))
+    authority.setData((b'vpn.example.org', make_soa(1)), records)
+    assert authority.lookupNegative(b'one.vpn.example.org') is None
+    assert authority.lookupNegative(b'vpn.example.org') is None
+    assert authority.lookupNegative(b'example.org') is None
+    assert authority.lookupNegative(b'sub.vpn.example.org') == dns.OK
+    assert authority.lookupNegative(b'three.vpn.example.org') == dns.ENAME
+    assert authority.lookupNegative(b'b.sub.vpn.example.org') == dns.ENAME
+    records.apply({b'two.sub.vpn.example.org': (None, None)})
+    assert authority.lookupNegative(b'sub.vpn.example.org') == dns.ENAME
+
+
+def test_reverse_negative_lookups():
+    authority = InMemoryAuthority()
+    records = ReverseRecords(ZoneRecords({b'0.0.d.f.ip6.arpa': [make_soa(1)]}))
+    records.add(Address.parse('fd00:1234::8').packed, b'one.vpn.example.org')
+    authority.setData((b'0.0.d.f.ip6.arpa', make_soa(1)), records)
+    assert authority.lookupNegative(b'1.0.0.d.f.ip6.arpa') == dns.OK
+    assert authority.lookupNegative(b'2.1.0.0.d.f.ip6.arpa') == dns.OK
+    assert authority.lookupNegative(b'3.1.0.0.d.f.ip6.arpa') == dns.ENAME
+    assert authority.lookupNegative(b'x.0.0.d.f.ip6.arpa') == dns.ENAME
+    assert authority.lookupNegative(Address.parse('fd00:1234::8').reverse) \
+        is None
+    assert authority.lookupNegative(Address.parse('fd00:1234::9').reverse) \
+        == dns.ENAME
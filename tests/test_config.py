@@ -4,7 +4,7 @@ import os.path
 
 from config import ConfigParser
 from config import ConfigurationError, MissingSectionError, InstanceRedifinitionError
-from config import UnusedOptionWarning
+from config import OptionRedifinitionWarning, UnusedOptionWarning
 
 
 @pytest.fixture
@@ -95,6 +95,18 @@ def test_invalid_daemon(cp):
         cp.parse_data({'options': (('daemon', 'yasd'), )})
 
 
+def test_reload_options(cp):
+    cp.parse_data({'options': (('reload_min_delay', '0.25'),
+                               ('reload_max_delay', '3'),
+                               ('max_concurrent_reloads', '8'))})
+    assert cp.reload_min_delay == 0.25
+    assert cp.reload_max_delay == 3.0
+    assert cp.max_concurrent_reloads == 8
+    cp.reload_max_delay = None
+    with pytest.raises(ConfigurationError):
+        cp.parse_data({'options': (('reload_max_delay', 'soon'), )})
+
+
 def test_add_instance(cp):
     cp.data = {'vpn.example.org': [
         ('refresh', '1h'),
@@ -153,3 +165,64 @@ def test_instance_redifinition(cp):
             ),
             'vpn.example.org': [],
         })
+
+
+def test_parse_net():
+    assert ConfigParser.parse_net('198.51.100.0/24') == '100.51.198.in-addr.arpa'
+    assert ConfigParser.parse_net('198.51.100 255.255.255') \
+        == '100.51.198.in-addr.arpa'
+    assert ConfigParser.parse_net('fddc:abcd:1234::/64') \
+        == '0.0.0.0.4.3.2.1.d.c.b.a.c.d.d.f.ip6.arpa'
+
+
+def test_profile_options(cp, tmp_path):
+    cp.parse_data({'options': (('profile_directory', str(tmp_path)),
+                               ('profile_duration', '10'),
+                               ('profile_reloads', '3'))})
+    assert cp.profile_directory == str(tmp_path)
+    assert cp.profile_duration == 10.0
+    assert cp.profile_reloads == 3
+    cp.profile_directory = None
+    with pytest.raises(ConfigurationError):
+        cp.parse_data({'options': (('profile_directory',
+                                    str(tmp_path / 'missing')), )})
+
+
+def test_udp_payload_size(cp):
+    cp.parse_data({'options': (('udp_payload_size', '4096'), )})
+    assert cp.udp_payload_size == 4096
+    assert ConfigParser.parse_payload_size('0') == 0
+    for value in ('511', '65536', 'big'):
+        with pytest.raises(ConfigurationError):
+            ConfigParser.parse_payload_size(value)
+
+
+def test_journal_size(cp, recwarn):
+    cp.data = {'vpn.example.org': [('status_file', '/tmp/openvpn.status')]}
+    assert cp.parse_instance('vpn.example.org').journal_size == 100
+    cp.data = {'vpn2.example.org': [('journal_size', '10'),
+                                    ('journal_size', '0')]}
+    assert cp.parse_instance('vpn2.example.org').journal_size == 0
+    assert recwarn.pop(OptionRedifinitionWarning)
+    for value in ('-1', 'many'):
+        cp.data = {'vpn3.example.org': [('journal_size', value)]}
+        with pytest.raises(ConfigurationError):
+            cp.parse_instance('vpn3.example.org')
+
+
+def test_workers(cp):
+    cp.parse_data({'options': (('workers', '2'), )})
+    assert cp.workers == 2
+    cp.workers = None
+    with pytest.raises(ConfigurationError):
+        cp.parse_data({'options': (('workers', '-2'), )})
+
+
+def test_invalid_reload_options(cp):
+    for options in ((('reload_min_delay', '-1'), ),
+                    (('max_concurrent_reloads', '0'), ),
+                    (('reload_min_delay', '3'), ('reload_max_delay', '2'))):
+        cp.reload_min_delay = cp.reload_max_delay = None
+        cp.max_concurrent_reloads = None
+        with pytest.raises(ConfigurationError):
+            cp.parse_data({'options': options})
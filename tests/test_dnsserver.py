@@ -0,0 +1,317 @@
+# -*- coding: UTF-8 -*-
+import struct
+
+from twisted.names import dns
+from twisted.names import server
+from twisted.test import proto_helpers
+import pytest
+
+from dnsserver import (AnswerCache, BADVERS, OpenVpnDNSServerFactory,
+                       TRANSFER_MESSAGE_SIZE)
+from metrics import Metrics
+from openvpnzone import InMemoryAuthority
+from tests.helpers import FakeProtocol, make_factory, make_soa, zone
+
+
+def ixfr_query(serial, name=b'vpn.example.org'):
+    message = dns.Message(id=42)
+    message.queries = [dns.Query(name, dns.IXFR, dns.IN)]
+    if serial is not None:
+        message.authority = [dns.RRHeader(name, dns.SOA, dns.IN, 0,
+                                          make_soa(serial))]
+    return message
+
+
+def test_ixfr():
+    factory = make_factory()
+    protocol = FakeProtocol()
+    factory.messageReceived(ixfr_query(1), protocol, None)
+    message, address = protocol.messages[0]
+    assert message.rCode == dns.OK
+    assert [rr.type for rr in message.answers] \
+        == [dns.SOA, dns.SOA, dns.SOA, dns.A, dns.SOA]
+
+
+def test_ixfr_up_to_date():
+    factory = make_factory()
+    protocol = FakeProtocol()
+    factory.messageReceived(ixfr_query(2), protocol, ('127.0.0.1', 5353))
+    message, address = protocol.messages[0]
+    assert address == ('127.0.0.1', 5353)
+    assert [rr.payload.serial for rr in message.answers] == [2]
+
+
+def test_ixfr_without_soa():
+    factory = make_factory()
+    protocol = FakeProtocol()
+    factory.messageReceived(ixfr_query(None), protocol, None)
+    assert protocol.messages[0][0].rCode == dns.EFORMAT
+
+
+def test_ixfr_unknown_zone():
+    factory = make_factory()
+    protocol = FakeProtocol()
+    factory.messageReceived(ixfr_query(1, b'example.com'), protocol, None)
+    assert protocol.messages[0][0].rCode == dns.EREFUSED
+
+
+def test_ixfr_too_large_for_udp():
+    a = InMemoryAuthority()
+    a.setData(*zone(1))
+    a.setData(*zone(2, **{'client{0}'.format(i): '127.0.0.{0}'.format(i)
+                          for i in range(1, 100)}))
+    factory = OpenVpnDNSServerFactory([a])
+    protocol = FakeProtocol()
+    factory.messageReceived(ixfr_query(1), protocol, ('127.0.0.1', 5353))
+    assert [rr.payload.serial for rr in protocol.messages[0][0].answers] == [2]
+    factory.messageReceived(ixfr_query(1), protocol, None)
+    assert len(protocol.messages[1][0].answers) == 103
+
+
+def query(name, type, id=7):
+    message = dns.Message(id=id, recDes=1)
+    message.queries = [dns.Query(name, type, dns.IN)]
+    return message
+
+
+def responses(factory, message, address):
+    protocol = FakeProtocol()
+    factory.messageReceived(message, protocol, address)
+    return protocol.messages[0][0]
+
+
+def test_cached_answers_match_uncached():
+    factory = make_factory()
+    reference = server.DNSServerFactory(factory.resolver.resolvers)
+    for name, type in [(b'one.vpn.example.org', dns.A),
+                       (b'One.VPN.example.org', dns.A),
+                       (b'one.vpn.example.org', dns.AAAA),
+                       (b'vpn.example.org', dns.SOA)]:
+        for address in (None, ('127.0.0.1', 5353)):
+            for id in (1, 2):  # miss, hit
+                expected = responses(reference, query(name, type, id), address)
+                got = responses(factory, query(name, type, id), address)
+                # unlike twisted we copy the RD flag (RFC 1035 4.1.1)
+                assert got.recDes == 1
+                got.recDes = 0
+                assert got.toStr() == expected.toStr()
+
+
+def test_answer_cache_counters_and_invalidation():
+    factory = make_factory()
+    authority = factory.resolver.resolvers[0]
+    cache = authority.answer_cache
+    responses(factory, query(b'two.vpn.example.org', dns.A), None)
+    responses(factory, query(b'two.vpn.example.org', dns.A), None)
+    assert (cache.hits, cache.misses) == (1, 1)
+    authority.setData(*zone(3, one='127.0.0.1', two='127.0.0.3'))
+    assert cache.entries == {}
+    answer = responses(factory, query(b'two.vpn.example.org', dns.A), None)
+    assert answer.answers[0].payload.dottedQuad() == '127.0.0.3'
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_answer_cache_ignores_stale_entries():
+    cache = AnswerCache()
+    generation = cache.generation
+    cache.clear()
+    cache.put('key', object(), generation)
+    assert cache.entries == {}
+
+
+def test_negative_answers():
+    authority = InMemoryAuthority()
+    authority.setData(*zone(1, one='127.0.0.1', **{'two.sub': '127.0.0.2'}))
+    factory = OpenVpnDNSServerFactory([authority])
+    for address in (None, ('127.0.0.1', 5353)):
+        for name, rCode in [(b'Missing.vpn.example.org', dns.ENAME),
+                            (b'one.one.vpn.example.org', dns.ENAME),
+                            (b'sub.vpn.example.org', dns.OK)]:
+            answer = responses(factory, query(name, dns.A), address)
+            assert answer.rCode == rCode
+            assert answer.auth
+            assert answer.queries[0].name.name == name
+            assert answer.answers == []
+            assert [(rr.name.name, rr.type, rr.ttl, rr.payload.serial)
+                    for rr in answer.authority] \
+                == [(b'vpn.example.org', dns.SOA, 14400, 1)]
+    cache = authority.answer_cache
+    assert cache.entries == {}
+    assert (cache.hits, cache.negatives, cache.misses) == (0, 6, 0)
+    authority.setData(*zone(2, one='127.0.0.1'))
+    assert cache.negative == {}
+    answer = responses(factory, query(b'sub.vpn.example.org', dns.A), None)
+    assert answer.rCode == dns.ENAME
+    assert answer.authority[0].payload.serial == 2
+
+
+def big_factory():
+    authority = InMemoryAuthority()
+    (name, soa), records = zone(1)
+    records[b'big.vpn.example.org'] = [dns.Record_A('127.0.0.{0}'.format(i))
+                                       for i in range(1, 60)]
+    authority.setData((name, soa), records.update_digests())
+    factory = OpenVpnDNSServerFactory([authority])
+    factory.metrics = Metrics()
+    return factory
+
+
+def edns_query(name, type, size=4096, version=0):
+    message = query(name, type)
+    message.additional = [dns.RRHeader(b'', dns.OPT, size, version << 16,
+                                       dns.UnknownRecord(b''))]
+    return message
+
+
+def encoded_size(message):
+    message.maxSize = 0
+    return len(message.toStr())
+
+
+@pytest.mark.parametrize('name,type', [(b'big.vpn.example.org', dns.A),
+                                       (b'vpn.example.org', dns.AXFR)])
+def test_truncate_without_edns(name, type):
+    factory = big_factory()
+    answer = responses(factory, query(name, type), ('127.0.0.1', 5353))
+    assert answer.trunc
+    assert answer.answers == answer.additional == []
+    assert answer.queries[0].name.name == name
+    answer = responses(factory, query(name, type), None)
+    assert not answer.trunc
+    assert len(answer.answers) >= 59
+    assert factory.metrics.truncations.values == {(): 1}
+
+
+def test_edns_payload_size():
+    factory = big_factory()
+    answer = responses(factory, edns_query(b'big.vpn.example.org', dns.A),
+                       ('127.0.0.1', 5353))
+    assert not answer.trunc
+    assert len(answer.answers) == 59
+    assert 512 < encoded_size(answer) <= 1232
+    assert [(rr.type, rr.cls, rr.ttl) for rr in answer.additional] \
+        == [(dns.OPT, 1232, 0)]
+    factory.udp_payload_size = 512
+    answer = responses(factory, edns_query(b'big.vpn.example.org', dns.A),
+                       ('127.0.0.1', 5353))
+    assert answer.trunc
+    assert [(rr.type, rr.cls) for rr in answer.additional] == [(dns.OPT, 512)]
+
+
+def test_edns_bad_version():
+    factory = big_factory()
+    answer = responses(factory, edns_query(b'big.vpn.example.org', dns.A,
+                                           version=1), ('127.0.0.1', 5353))
+    assert answer.answers == []
+    assert answer.rCode == BADVERS  # 0 in the header, 1 in the OPT record
+    assert struct.unpack('!H', answer.toStr()[2:4])[0] & 0x0f == 0
+    assert answer.additional[0].ttl >> 24 == BADVERS >> 4
+
+
+def test_edns_disabled():
+    factory = big_factory()
+    factory.udp_payload_size = None
+    answer = responses(factory, edns_query(b'big.vpn.example.org', dns.A),
+                       ('127.0.0.1', 5353))
+    assert answer.trunc
+    assert answer.additional == []
+
+
+def test_count_tcp_retries():
+    factory = big_factory()
+    responses(factory, query(b'big.vpn.example.org', dns.A),
+              ('127.0.0.1', 5353))
+    protocol = FakeProtocol()
+    factory.messageReceived(query(b'big.vpn.example.org', dns.A), protocol,
+                            None)
+    factory.messageReceived(query(b'big.vpn.example.org', dns.A), protocol,
+                            None)
+    assert factory.metrics.tcp_retries.values == {(): 1}
+
+
+def large_zone(serial, count=2000):
+    return zone(serial, **{'client{0}'.format(i): '10.0.{0}.{1}'.format(
+        i // 250, i % 250 + 1) for i in range(count)})
+
+
+def transfer_messages(transport):
+    data = transport.value()
+    messages = []
+    while data:
+        length = struct.unpack('!H', data[:2])[0]
+        message = dns.Message()
+        message.fromStr(data[2:2 + length])
+        messages.append((length, message))
+        data = data[2 + length:]
+    return messages
+
+
+def test_axfr_in_bounded_messages():
+    authority = InMemoryAuthority()
+    authority.setData(*large_zone(1))
+    factory = OpenVpnDNSServerFactory([authority])
+    protocol = FakeProtocol()
+    factory.messageReceived(query(b'vpn.example.org', dns.AXFR), protocol,
+                            None)
+    messages = [message for message, address in protocol.messages]
+    assert len(messages) > 1
+    answers = [rr for message in messages for rr in message.answers]
+    assert answers[0].type == answers[-1].type == dns.SOA
+    assert len(answers) == 2002
+    assert {rr.name.name for rr in answers[1:-1]} \
+        == set(authority.records) - {b'vpn.example.org'}
+    assert all(message.id == 7 and message.auth and message.answer
+               and message.queries[0].name.name == b'vpn.example.org'
+               for message in messages)
+
+
+def test_axfr_snapshot_per_transfer():
+    authority = InMemoryAuthority()
+    authority.setData(*large_zone(1))
+    factory = OpenVpnDNSServerFactory([authority])
+    protocol = proto_helpers.StringTransport()
+    dns_protocol = FakeProtocol()
+    dns_protocol.transport = protocol
+    factory.messageReceived(query(b'vpn.example.org', dns.AXFR), dns_protocol,
+                            None)
+    protocol.producer.resumeProducing()
+    authority.setData(*large_zone(2, count=10))
+    while protocol.producer is not None:
+        protocol.producer.resumeProducing()
+    messages = transfer_messages(protocol)
+    assert all(length < TRANSFER_MESSAGE_SIZE + 512
+               for length, message in messages)
+    answers = [rr for length, message in messages for rr in message.answers]
+    assert len(answers) == 2002
+    assert answers[0].payload.serial == answers[-1].payload.serial == 1
+
+
+def test_transfers_of_one_connection_are_queued():
+    authority = InMemoryAuthority()
+    authority.setData(*large_zone(1))
+    factory = OpenVpnDNSServerFactory([authority])
+    protocol = proto_helpers.StringTransport()
+    dns_protocol = FakeProtocol()
+    dns_protocol.transport = protocol
+    factory.messageReceived(query(b'vpn.example.org', dns.AXFR), dns_protocol,
+                            None)
+    factory.messageReceived(query(b'vpn.example.org', dns.AXFR), dns_protocol,
+                            None)
+    while protocol.producer is not None:
+        protocol.producer.resumeProducing()
+    answers = [rr for length, message in transfer_messages(protocol)
+               for rr in message.answers]
+    assert len(answers) == 2 * 2002
+    assert [index for index, rr in enumerate(answers)
+            if rr.type == dns.SOA] == [0, 2001, 2002, 4003]
+
+
+def test_set_authorities():
+    factory = make_factory()
+    assert factory.authorityFor(b'vpn.example.org') is not None
+    other = InMemoryAuthority()
+    soa, records = zone(1, one='127.0.0.1')
+    other.setData((b'other.example.org', soa[1]), records)
+    factory.setAuthorities([other])
+    assert factory.authorityFor(b'vpn.example.org') is None
+    assert factory.authorityFor(b'Other.example.org') is other
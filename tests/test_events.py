@@ -0,0 +1,161 @@
+# -*- coding: UTF-8 -*-
+import importlib.machinery
+import importlib.util
+import os.path
+import time
+
+from twisted.internet.task import Clock
+from twisted.names import dns
+from twisted.test import proto_helpers
+import pytest
+
+from address import Address
+from config import ConfigParser, ConfigurationError
+from events import EventFactory, EventSource
+from openvpnzone import OpenVpnAuthorityHandler
+from tests.helpers import write_status
+
+
+def addresses(*texts):
+    return [Address.parse(text) for text in texts]
+
+
+def load_sender():
+    path = os.path.join(os.path.dirname(__file__), '..', 'scripts',
+                        'openvpn2dns-event')
+    loader = importlib.machinery.SourceFileLoader('openvpn2dns_event', path)
+    module = importlib.util.module_from_spec(
+        importlib.util.spec_from_loader(loader.name, loader))
+    loader.exec_module(module)
+    return module
+
+
+def test_events():
+    changes = []
+    source = EventSource(changed=lambda: changes.append(True))
+    source.add('one', addresses('198.51.100.8', 'fd00::8'))
+    source.add('two', addresses('198.51.100.12'))
+    assert len(changes) == 2
+    delta = source.update()
+    assert delta.added == {'one': addresses('198.51.100.8', 'fd00::8'),
+                           'two': addresses('198.51.100.12')}
+    assert not source.update()
+    source.add('two', addresses('198.51.100.8'))  # moved
+    source.remove(None, addresses('fd00::8'))
+    source.remove('two', addresses('198.51.100.12'))
+    delta = source.update()
+    assert delta.changed == {'one': [], 'two': addresses('198.51.100.8')}
+    source.remove('one')
+    source.remove('three')
+    assert source.update().removed == {'one': []}
+    assert source.clients == {'two': addresses('198.51.100.8')}
+
+
+def test_reconcile_keeps_newer_events(tmp_path):
+    path = tmp_path / 'status'
+    write_status(path, [('one', '198.51.100.8'), ('two', '198.51.100.12')])
+    source = EventSource(str(path))
+    assert source.update().added == {'one': addresses('198.51.100.8'),
+                                     'two': addresses('198.51.100.12')}
+    source.remove('one')  # missed by the status file
+    source.add('three', addresses('198.51.100.16'))
+    os.utime(str(path), (time.time() - 10, time.time() - 10))
+    source.event_times['two'] = time.time() - 20
+    source.current['two'] = addresses('198.51.100.13')  # missed event
+    assert source.reconcile()
+    delta = source.update()
+    assert delta.removed == {'one': addresses('198.51.100.8')}
+    assert delta.added == {'three': addresses('198.51.100.16')}
+    assert not delta.changed
+    assert source.clients['two'] == addresses('198.51.100.12')
+    assert not EventSource().reconcile()
+
+
+def test_event_socket_protocol():
+    source = EventSource()
+    factory = EventFactory({'vpn.example.org': source})
+    protocol = factory.buildProtocol(None)
+    protocol.makeConnection(proto_helpers.StringTransport())
+    protocol.dataReceived(b'add\tvpn.example.org\tone\t198.51.100.8\tfd00::8\n'
+                          b'add\tvpn.example.org\ttwo\t198.51.100.12\r\n'
+                          b'add\tvpn.example.org\ttwo\t10.8.0.0/24\n'
+                          b'remove\tvpn.example.org\t-\tfd00::8\n'
+                          b'add\tother.example.org\tthree\t198.51.100.16\n'
+                          b'add\tvpn.example.org\tthree\tinvalid\n'
+                          b'move\tvpn.example.org\tthree\n')
+    assert source.update().added == {'one': addresses('198.51.100.8'),
+                                     'two': addresses('198.51.100.12')}
+    protocol.dataReceived(b'remove\tvpn.example.org\tone\n')
+    assert source.update().removed == {'one': addresses('198.51.100.8')}
+
+
+def test_sender_events():
+    sender = load_sender()
+    env = {'script_type': 'client-connect', 'common_name': 'one',
+           'ifconfig_pool_remote_ip': '198.51.100.8'}
+    assert sender.event(['vpn.example.org', '/tmp/openvpn_cc.tmp'], env) \
+        == 'add\tvpn.example.org\tone\t198.51.100.8\n'
+    env['script_type'] = 'client-disconnect'
+    assert sender.event(['vpn.example.org'], env) \
+        == 'remove\tvpn.example.org\tone\n'
+    env = {'script_type': 'learn-address'}
+    assert sender.event(['vpn.example.org', 'update', 'fd00::8', 'one'], env) \
+        == 'add\tvpn.example.org\tone\tfd00::8\n'
+    assert sender.event(['vpn.example.org', 'delete', 'fd00::8'], env) \
+        == 'remove\tvpn.example.org\t-\tfd00::8\n'
+    assert sender.event(['vpn.example.org'], {'script_type': 'up'}) is None
+
+
+def test_handler_applies_events(tmp_path):
+    path = tmp_path / 'status'
+    write_status(path, [('one', '198.51.100.8')])
+    cp = ConfigParser()
+    cp.parse_data({
+        'options': [
+            ('instance', 'vpn.example.org'),
+            ('reconcile_interval', '60'),
+            ('event_socket', str(tmp_path / 'events')),
+        ],
+        'vpn.example.org': [
+            ('mname', 'dns.example.org'),
+            ('rname', 'dns.example.org'),
+            ('refresh', '1h'),
+            ('retry', '2h'),
+            ('expire', '3h'),
+            ('minimum', '4h'),
+            ('subnet4', '198.51.100.0/24'),
+            ('suffix', '@'),
+            ('status_file', str(path)),
+            ('events', 'yes'),
+        ]
+    })
+    handler = OpenVpnAuthorityHandler(cp)
+    handler.reconciler.stop()
+    handler.scheduler.clock = Clock()
+    instance = cp.instances['vpn.example.org']
+    forward = handler.authorities['vpn.example.org'].forward
+    assert forward.records[b'one.vpn.example.org'] \
+        == [dns.Record_A('198.51.100.8')]
+    source = handler.event_sources['vpn.example.org']
+    source.add('two', addresses('198.51.100.12'))
+    source.add('three', addresses('198.51.100.16'))
+    # one reload for the burst:
+    assert len(handler.scheduler.clock.getDelayedCalls()) == 1
+    records = forward.records
+    handler.loadInstance(instance)
+    assert forward.records is records  # patched
+    assert forward.records[b'two.vpn.example.org'] \
+        == [dns.Record_A('198.51.100.12')]
+    assert handler.authorities['vpn.example.org'].backward4.records[
+        b'16.100.51.198.in-addr.arpa'] \
+        == [dns.Record_PTR(b'three.vpn.example.org')]
+
+
+def test_events_need_event_socket():
+    cp = ConfigParser()
+    with pytest.raises(ConfigurationError):
+        cp.parse_data({
+            'options': [('instance', 'vpn.example.org')],
+            'vpn.example.org': [('status_file', '/run/openvpn/status'),
+                                ('events', 'yes')],
+        })
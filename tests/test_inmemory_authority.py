@@ -2,19 +2,8 @@
 from twisted.names import dns
 import pytest
 
-from openvpnzone import InMemoryAuthority
-
-
-def make_soa(serial):
-    return dns.Record_SOA(
-        mname='dns.example.org',
-        rname='admin.example.org',
-        serial=int(serial),
-        refresh='1h',
-        retry='2h',
-        expire='3h',
-        minimum='4h'
-    )
+from openvpnzone import InMemoryAuthority, ZoneRecords
+from tests.helpers import make_soa, zone
 
 
 @pytest.fixture
@@ -107,3 +96,74 @@ def test_ignore_update_with_same_data_but_different_soa_serial(a):
     assert a.setData(soa2, new_records) is False
     assert a.soa is soa
     assert a.records is old_records
+
+
+def test_digest_independent_of_order():
+    one = ZoneRecords({b'vpn.example.org': [dns.Record_A('127.0.0.1'),
+                                            dns.Record_AAAA('::1')],
+                       b'a.vpn.example.org': [dns.Record_A('127.0.0.2')]})
+    two = ZoneRecords({b'a.vpn.example.org': [dns.Record_A('127.0.0.2')],
+                       b'vpn.example.org': [dns.Record_AAAA('::1'),
+                                            dns.Record_A('127.0.0.1')]})
+    assert one.update_digests().digest == two.update_digests().digest
+    assert one.name_digests == two.name_digests
+
+
+def test_digest_ignores_soa_serial():
+    one = ZoneRecords({b'vpn.example.org': [make_soa(1)]}).update_digests()
+    two = ZoneRecords({b'vpn.example.org': [make_soa(2)]}).update_digests()
+    assert one.digest == two.digest
+
+
+def test_changed_names(a):
+    new_records = ZoneRecords({
+        b'vpn.example.org': [dns.Record_A('127.0.0.1')],
+        b'one.vpn.example.org': [dns.Record_A('127.0.0.2')],
+        b'two.vpn.example.org': [],
+    }).update_digests()
+    a.setData(make_soa(2), ZoneRecords({
+        b'vpn.example.org': [dns.Record_A('127.0.0.1')],
+        b'two.vpn.example.org': [dns.Record_A('127.0.0.3')],
+    }).update_digests())
+    assert a.setData(make_soa(3), new_records) is True
+    assert a.changed_names == {b'one.vpn.example.org', b'two.vpn.example.org'}
+
+
+def transfer(authority, serial):
+    answers = authority.lookupIncrementalZone(b'vpn.example.org', serial) \
+        .result[0]
+    return [(rr.name.name, rr.type, rr.payload.serial if rr.type == dns.SOA
+             else rr.payload.dottedQuad()) for rr in answers]
+
+
+def test_journal_ixfr():
+    a = InMemoryAuthority()
+    a.setData(*zone(1, one='127.0.0.1', two='127.0.0.2'))
+    a.setData(*zone(2, one='127.0.0.1', two='127.0.0.3'))
+    a.setData(*zone(3, one='127.0.0.1', two='127.0.0.3', three='127.0.0.4'))
+    assert len(a.journal) == 2
+    assert transfer(a, 1) == [
+        (b'vpn.example.org', dns.SOA, 3),
+        (b'vpn.example.org', dns.SOA, 1),
+        (b'two.vpn.example.org', dns.A, '127.0.0.2'),
+        (b'vpn.example.org', dns.SOA, 2),
+        (b'two.vpn.example.org', dns.A, '127.0.0.3'),
+        (b'vpn.example.org', dns.SOA, 2),
+        (b'vpn.example.org', dns.SOA, 3),
+        (b'three.vpn.example.org', dns.A, '127.0.0.4'),
+        (b'vpn.example.org', dns.SOA, 3),
+    ]
+    assert transfer(a, 3) == [(b'vpn.example.org', dns.SOA, 3)]
+
+
+def test_journal_fallback_to_axfr():
+    a = InMemoryAuthority(journal_size=1)
+    a.setData(*zone(1, one='127.0.0.1'))
+    a.setData(*zone(2, one='127.0.0.2'))
+    a.setData(*zone(3, one='127.0.0.3'))
+    assert len(a.journal) == 1
+    assert transfer(a, 1) == [
+        (b'vpn.example.org', dns.SOA, 3),
+        (b'one.vpn.example.org', dns.A, '127.0.0.3'),
+        (b'vpn.example.org', dns.SOA, 3),
+    ]
@@ -0,0 +1,230 @@
+# -*- coding: UTF-8 -*-
+from twisted.internet.task import Clock
+from twisted.names import dns
+from twisted.protocols import basic
+from twisted.test import iosim
+
+from address import Address
+from config import ConfigParser
+from management import ManagementSource
+from openvpnzone import OpenVpnAuthorityHandler
+
+
+STATUS_HEADER = [
+    'TITLE\tOpenVPN 2.6.8 x86_64-pc-linux-gnu',
+    'TIME\t2024-01-01 00:00:00\t1704067200',
+    'HEADER\tCLIENT_LIST\tCommon Name\tReal Address\tVirtual Address\t'
+    'Virtual IPv6 Address\tBytes Received\tBytes Sent\tConnected Since\t'
+    'Connected Since (time_t)\tUsername\tClient ID\tPeer ID\t'
+    'Data Channel Cipher',
+    'HEADER\tROUTING_TABLE\tVirtual Address\tCommon Name\tReal Address\t'
+    'Last Ref\tLast Ref (time_t)',
+]
+
+
+class FakeManagementServer(basic.LineOnlyReceiver):
+    """ Management interface of an openvpn server with the given clients
+        ((common name, client id, addresses) tuples)"""
+    delimiter = b'\n'
+
+    def __init__(self, clients):
+        self.clients = clients
+        self.commands = []
+
+    def sendLine(self, line):
+        self.transport.write(line + b'\r\n')
+
+    def connectionMade(self):
+        self.sendLine(b'>INFO:OpenVPN Management Interface Version 5')
+
+    def lineReceived(self, line):
+        self.commands.append(line)
+        if line != b'status 3':
+            self.sendLine(b'ERROR: unknown command, enter \'help\' for more '
+                          b'options')
+            return
+        lines = list(STATUS_HEADER)
+        for name, cid, addresses in self.clients:
+            lines.append('CLIENT_LIST\t{0}\t192.0.2.1:1194\t{1}\t\t0\t0\t'
+                         '2024-01-01 00:00:00\t1704067200\tUNDEF\t{2}\t{2}\t'
+                         'AES-256-GCM'.format(name, addresses[0], cid))
+        for name, cid, addresses in self.clients:
+            for address in addresses:
+                lines.append('ROUTING_TABLE\t{0}\t{1}\t192.0.2.1:1194\t'
+                             '2024-01-01 00:00:00\t1704067200'.format(
+                                 address, name))
+        lines += ['GLOBAL_STATS\tMax bcast/mcast queue length\t0', 'END']
+        for line in lines:
+            self.sendLine(line.encode('utf-8'))
+
+    def notify(self, event, cid, **env):
+        self.sendLine('>CLIENT:{0},{1}'.format(event, cid).encode('utf-8'))
+        for name, value in env.items():
+            self.sendLine('>CLIENT:ENV,{0}={1}'.format(name, value)
+                          .encode('utf-8'))
+        self.sendLine(b'>CLIENT:ENV,END')
+
+
+def connect(clients):
+    changes = []
+    source = ManagementSource('/run/openvpn/management',
+                              lambda: changes.append(True), clock=Clock())
+    server = FakeManagementServer(clients)
+    client = source.buildProtocol(None)
+    pump = iosim.connect(server, iosim.makeFakeServer(server),
+                         client, iosim.makeFakeClient(client))
+    pump.flush()
+    return source, server, pump, changes
+
+
+def addresses(*texts):
+    return [Address.parse(text) for text in texts]
+
+
+def test_synchronize_client_list():
+    source, server, pump, changes = connect([
+        ('one', 1, ['198.51.100.8', 'fd00::8']), ('two', 2, ['198.51.100.12'])])
+    assert server.commands == [b'status 3']
+    assert changes
+    delta = source.update()
+    assert delta.added == {'one': addresses('198.51.100.8', 'fd00::8'),
+                           'two': addresses('198.51.100.12')}
+    assert source.clients == delta.added
+    assert not source.update()
+
+
+def test_client_events():
+    source, server, pump, changes = connect([('one', 1, ['198.51.100.8'])])
+    source.update()
+    server.sendLine(b'>CLIENT:ADDRESS,3,198.51.100.16,1')
+    server.notify('ESTABLISHED', 3, common_name='three',
+                  ifconfig_pool_remote_ip='198.51.100.16',
+                  ifconfig_pool_remote_ip6='fd00::16')
+    server.sendLine(b'>CLIENT:ADDRESS,3,10.8.0.0/24,0')
+    server.notify('DISCONNECT', 1, common_name='one')
+    pump.flush()
+    delta = source.update()
+    assert delta.added == {'three': addresses('198.51.100.16', 'fd00::16')}
+    assert delta.removed == {'one': addresses('198.51.100.8')}
+    assert source.clients == {'three': addresses('198.51.100.16', 'fd00::16')}
+    server.sendLine(b'>CLIENT:ADDRESS,3,198.51.100.17,0')
+    pump.flush()
+    assert source.update().changed == {
+        'three': addresses('198.51.100.16', 'fd00::16', '198.51.100.17')}
+
+
+def test_duplicate_common_names_and_moved_addresses():
+    source, server, pump, changes = connect([('one', 1, ['198.51.100.8'])])
+    server.notify('ESTABLISHED', 2, common_name='one',
+                  ifconfig_pool_remote_ip='198.51.100.9')
+    server.notify('ESTABLISHED', 3, common_name='two',
+                  ifconfig_pool_remote_ip='198.51.100.8')
+    pump.flush()
+    assert source.update().added == {
+        'one': addresses('198.51.100.9'), 'two': addresses('198.51.100.8')}
+    server.notify('DISCONNECT', 2)
+    pump.flush()
+    assert source.update().changed == {'one': []}  # cid 1 lost its address
+
+
+def test_reconnect_resynchronizes():
+    source, server, pump, changes = connect([('one', 1, ['198.51.100.8'])])
+    source.update()
+    client = source.buildProtocol(None)
+    server = FakeManagementServer([('two', 2, ['198.51.100.12'])])
+    iosim.connect(server, iosim.makeFakeServer(server),
+                  client, iosim.makeFakeClient(client)).flush()
+    delta = source.update()
+    assert delta.removed == {'one': addresses('198.51.100.8')}
+    assert delta.added == {'two': addresses('198.51.100.12')}
+
+
+def test_parse_management_address():
+    assert ConfigParser.parse_management('127.0.0.1:7505') \
+        == ('127.0.0.1', 7505)
+    assert ConfigParser.parse_management('/run/openvpn/management') \
+        == '/run/openvpn/management'
+
+
+def test_handler_applies_management_events(monkeypatch):
+    monkeypatch.setattr(ManagementSource, 'start', lambda self: None)
+    cp = ConfigParser()
+    cp.parse_data({
+        'options': [
+            ('instance', 'vpn.example.org'),
+        ],
+        'vpn.example.org': [
+            ('mname', 'dns.example.org'),
+            ('rname', 'dns.example.org'),
+            ('refresh', '1h'),
+            ('retry', '2h'),
+            ('expire', '3h'),
+            ('minimum', '4h'),
+            ('subnet4', '198.51.100.0/24'),
+            ('suffix', '@'),
+            ('management', '127.0.0.1:7505'),
+        ]
+    })
+    handler = OpenVpnAuthorityHandler(cp)
+    handler.scheduler.clock = Clock()
+    instance = cp.instances['vpn.example.org']
+    source = handler.status_files['vpn.example.org']
+    assert source.address == ('127.0.0.1', 7505)
+    forward = handler.authorities['vpn.example.org'].forward
+    backward4 = handler.authorities['vpn.example.org'].backward4
+    assert set(forward.records) == {b'vpn.example.org'}
+    source.clientEstablished(8, {b'common_name': 'one',
+                                 b'ifconfig_pool_remote_ip': '198.51.100.8'})
+    assert len(handler.scheduler.clock.getDelayedCalls()) == 1
+    handler.loadInstance(instance)
+    assert forward.records[b'one.vpn.example.org'] \
+        == [dns.Record_A('198.51.100.8')]
+    assert backward4.records[b'8.100.51.198.in-addr.arpa'] \
+        == [dns.Record_PTR(b'one.vpn.example.org')]
+    records = forward.records
+    source.clientDisconnected(8)
+    handler.loadInstance(instance)
+    assert forward.records is records  # patched
+    assert b'one.vpn.example.org' not in forward.records
+
+
+def test_recreated_management_instance_keeps_clients(monkeypatch):
+    monkeypatch.setattr(ManagementSource, 'start', lambda self: None)
+
+    def config(subnet4):
+        cp = ConfigParser()
+        cp.parse_data({
+            'options': [('instance', 'vpn.example.org')],
+            'vpn.example.org': [
+                ('mname', 'dns.example.org'),
+                ('rname', 'dns.example.org'),
+                ('refresh', '1h'),
+                ('retry', '2h'),
+                ('expire', '3h'),
+                ('minimum', '4h'),
+                ('subnet4', subnet4),
+                ('suffix', '@'),
+                ('management', '127.0.0.1:7505'),
+            ]
+        })
+        return cp
+    handler = OpenVpnAuthorityHandler(config('198.51.100.0/24'))
+    handler.scheduler.clock = Clock()
+    source = handler.status_files['vpn.example.org']
+    source.clientEstablished(8, {b'common_name': 'one',
+                                 b'ifconfig_pool_remote_ip': '198.51.100.8'})
+    handler.loadInstance(handler.config.instances['vpn.example.org'])
+    assert handler.reload_config(config('198.51.100.0/25')) \
+        == {'vpn.example.org': 'recreated'}
+    # served from the previous client list until the first synchronisation:
+    authorities = handler.authorities['vpn.example.org']
+    assert authorities.forward.records[b'one.vpn.example.org'] \
+        == [dns.Record_A('198.51.100.8')]
+    assert authorities.backward4.records[b'8.100.51.198.in-addr.arpa'] \
+        == [dns.Record_PTR(b'one.vpn.example.org')]
+    assert 'vpn.example.org' not in handler.patchable
+    source = handler.status_files['vpn.example.org']
+    source.synchronize([])
+    handler.loadInstance(handler.config.instances['vpn.example.org'])
+    assert b'one.vpn.example.org' not in authorities.forward.records
+    assert authorities.forward.soa[1].serial > 1000
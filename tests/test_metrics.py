@@ -0,0 +1,110 @@
+# -*- coding: UTF-8 -*-
+import os
+import time
+
+from twisted.internet.testing import StringTransport
+from twisted.names import dns
+
+from metrics import Histogram, Metrics, MetricsFactory, format_labels
+from tests.helpers import FakeProtocol, delta_handler, make_factory, \
+    write_status
+
+
+def samples(metrics):
+    result = {}
+    for line in metrics.render().splitlines():
+        if not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            result[name] = float(value)
+    return result
+
+
+def test_label_escaping():
+    assert format_labels((), ()) == ''
+    assert format_labels(('zone', 'path'), (b'vpn.example.org', 'a"b\\')) \
+        == '{zone="vpn.example.org",path="a\\"b\\\\"}'
+
+
+def test_histogram_buckets():
+    histogram = Histogram('h', 'help', ('x', ), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, ('a', ))
+    assert list(histogram.samples()) == [
+        ('h_bucket', '{x="a",le="0.1"}', 2),
+        ('h_bucket', '{x="a",le="1"}', 3),
+        ('h_bucket', '{x="a",le="+Inf"}', 4),
+        ('h_sum', '{x="a"}', 3.65),
+        ('h_count', '{x="a"}', 4),
+    ]
+
+
+def test_render():
+    metrics = Metrics()
+    metrics.counter('c_total', 'Some counter', ('kind', )).inc(('x', ), 2)
+    text = metrics.render()
+    assert '# HELP c_total Some counter\n# TYPE c_total counter\n' \
+        'c_total{kind="x"} 2\n' in text
+    assert '# TYPE openvpn2dns_response_seconds histogram' in text
+
+
+def test_count_queries():
+    factory = make_factory()
+    factory.metrics = Metrics()
+    protocol = FakeProtocol()
+    for name in (b'one.vpn.example.org', b'one.vpn.example.org',
+                 b'unknown.vpn.example.org'):
+        message = dns.Message(id=1)
+        message.queries = [dns.Query(name, dns.A, dns.IN)]
+        message.timeReceived = time.time()
+        factory.messageReceived(message, protocol, ('127.0.0.1', 53))
+    message = dns.Message(id=2)
+    message.queries = [dns.Query(b'example.com', dns.A, dns.IN)]
+    message.timeReceived = time.time()
+    factory.messageReceived(message, protocol, None)
+    values = samples(factory.metrics)
+    assert values['openvpn2dns_queries_total{zone="vpn.example.org",'
+                  'qtype="A",rcode="NOERROR"}'] == 2
+    assert values['openvpn2dns_queries_total{zone="vpn.example.org",'
+                  'qtype="A",rcode="NXDOMAIN"}'] == 1
+    assert values['openvpn2dns_queries_total{zone="",'
+                  'qtype="A",rcode="NXDOMAIN"}'] == 1
+    assert values['openvpn2dns_response_seconds_count{transport="udp"}'] == 3
+    assert values['openvpn2dns_response_seconds_count{transport="tcp"}'] == 1
+
+
+def test_reload_phases_and_zone_metrics(tmp_path):
+    path, instance, handler = delta_handler(tmp_path, [('one', '198.51.100.8')])
+    write_status(path, [('one', '198.51.100.8'), ('two', '198.51.100.12')])
+    os.utime(str(path), (2000, 2000))
+    handler.loadInstance(instance)
+    values = samples(handler.metrics)
+    for phase in ('parse', 'build', 'diff', 'swap'):  # initial load + reload
+        assert values['openvpn2dns_reload_seconds_count{instance='
+                      '"vpn.example.org",phase="' + phase + '"}'] == 2
+    assert values['openvpn2dns_zone_serial{zone="vpn.example.org"}'] == 2000
+    assert values['openvpn2dns_zone_names{zone="vpn.example.org"}'] == 3
+    assert values['openvpn2dns_clients{instance="vpn.example.org"}'] == 2
+
+
+def request(metrics, line):
+    protocol = MetricsFactory(metrics).buildProtocol(None)
+    transport = StringTransport()
+    protocol.makeConnection(transport)
+    protocol.dataReceived(line + b'\r\nHost: localhost\r\n\r\n')
+    return transport
+
+
+def test_http_endpoint():
+    metrics = Metrics()
+    metrics.counter('c_total', 'Some counter').inc()
+    transport = request(metrics, b'GET /metrics HTTP/1.1')
+    head, body = transport.value().split(b'\r\n\r\n', 1)
+    assert head.startswith(b'HTTP/1.0 200 OK\r\n')
+    assert b'Content-Length: ' + str(len(body)).encode() in head
+    assert b'c_total 1\n' in body
+    assert transport.disconnecting
+
+
+def test_http_endpoint_unknown_path():
+    transport = request(Metrics(), b'GET / HTTP/1.1')
+    assert transport.value().startswith(b'HTTP/1.0 404 Not Found\r\n')
@@ -0,0 +1,108 @@
+# -*- coding: UTF-8 -*-
+import socket
+
+from twisted.internet import defer
+from twisted.internet.task import Clock
+from twisted.names import dns
+
+from notify import NotifyDispatcher
+from tests.helpers import FakeProtocol, make_soa
+
+
+class ResolvingClock(Clock):
+    def resolve(self, name):
+        return defer.succeed({'dns.example.org': '192.0.2.53'}[name])
+
+
+def make_dispatcher():
+    dispatcher = NotifyDispatcher(clock=ResolvingClock())
+    protocol = FakeProtocol()
+    dispatcher.protocols[socket.AF_INET] = protocol
+    return dispatcher, protocol.messages
+
+
+def ack(dispatcher, message, address, rCode=dns.OK):
+    response = dns.Message(message.id, answer=True, opCode=dns.OP_NOTIFY,
+                           rCode=rCode)
+    dispatcher.messageReceived(response, None, address)
+
+
+def test_notify_message():
+    dispatcher, messages = make_dispatcher()
+    dispatcher.notify(('192.0.2.1', 53), b'vpn.example.org', make_soa(5))
+    message, address = messages[0]
+    assert address == ('192.0.2.1', 53)
+    assert message.opCode == dns.OP_NOTIFY
+    assert message.queries == [dns.Query(b'vpn.example.org', dns.SOA, dns.IN)]
+    assert message.answers[0].payload.serial == 5
+    assert dispatcher.sent == 1
+
+
+def test_acknowledged_notify():
+    dispatcher, messages = make_dispatcher()
+    dispatcher.notify(('192.0.2.1', 53), b'vpn.example.org', make_soa(5))
+    ack(dispatcher, messages[0][0], ('192.0.2.1', 53))
+    assert dispatcher.acked == 1
+    assert dispatcher.pending == {}
+    dispatcher.clock.advance(100)
+    assert len(messages) == 1
+    assert dispatcher.clock.getDelayedCalls() == []
+
+
+def test_retransmit_with_backoff():
+    dispatcher, messages = make_dispatcher()
+    dispatcher.notify(('192.0.2.1', 53), b'vpn.example.org', make_soa(5))
+    for delay, count in ((1.9, 1), (0.1, 2), (4, 3), (8, 4), (16, 5)):
+        dispatcher.clock.advance(delay)
+        assert len(messages) == count
+    assert len({message.id for message, address in messages}) == 5
+    dispatcher.clock.advance(32)
+    assert (dispatcher.sent, dispatcher.retried, dispatcher.failed) \
+        == (5, 4, 1)
+    assert dispatcher.pending == {}
+    ack(dispatcher, messages[-1][0], ('192.0.2.1', 53))  # too late
+    assert dispatcher.acked == 0
+
+
+def test_coalesce_newer_zone_version():
+    dispatcher, messages = make_dispatcher()
+    dispatcher.notify(('192.0.2.1', 53), b'vpn.example.org', make_soa(5))
+    dispatcher.notify(('192.0.2.1', 53), b'vpn.example.org', make_soa(6))
+    assert len(dispatcher.pending) == 1
+    assert len(dispatcher.clock.getDelayedCalls()) == 1
+    ack(dispatcher, messages[0][0], ('192.0.2.1', 53))  # for serial 5
+    assert dispatcher.acked == 0
+    ack(dispatcher, messages[1][0], ('192.0.2.1', 53))
+    assert dispatcher.acked == 1
+    assert messages[1][0].answers[0].payload.serial == 6
+
+
+def test_independent_slaves_and_zones():
+    dispatcher, messages = make_dispatcher()
+    dispatcher.notify(('192.0.2.1', 53), b'vpn.example.org')
+    dispatcher.notify(('192.0.2.2', 53), b'vpn.example.org')
+    dispatcher.notify(('192.0.2.1', 53), b'10.in-addr.arpa')
+    assert len(dispatcher.pending) == 3
+    assert messages[0][0].answers == []
+
+
+def test_rejected_notify():
+    dispatcher, messages = make_dispatcher()
+    dispatcher.notify(('192.0.2.1', 53), b'vpn.example.org')
+    ack(dispatcher, messages[0][0], ('192.0.2.1', 53), rCode=dns.EREFUSED)
+    assert (dispatcher.acked, dispatcher.failed) == (0, 1)
+    assert dispatcher.pending == {}
+
+
+def test_ignore_foreign_responses():
+    dispatcher, messages = make_dispatcher()
+    dispatcher.notify(('192.0.2.1', 53), b'vpn.example.org')
+    ack(dispatcher, messages[0][0], ('192.0.2.99', 53))
+    assert dispatcher.acked == 0
+    assert len(dispatcher.pending) == 1
+
+
+def test_resolve_host_names():
+    dispatcher, messages = make_dispatcher()
+    dispatcher.notify(('dns.example.org', 53), b'vpn.example.org')
+    assert messages[0][1] == ('192.0.2.53', 53)
@@ -1,7 +1,11 @@
 # -*- coding: UTF-8 -*-
+import pytest
+
 from openvpnzone import extract_zones_from_status_file
+from statusfile import StatusFile, detect_version
 
-from IPy import IP
+from address import Address
+from tests.helpers import write_status
 
 
 def test_empty_server():
@@ -11,23 +15,123 @@ def test_empty_server():
 
 def test_one_client_on_server():
     assert extract_zones_from_status_file('tests/samples/one.ovpn-status-v1') \
-        == {'one.vpn.example.org': [IP('198.51.100.8')]}
+        == {'one.vpn.example.org': [Address.parse('198.51.100.8')]}
 
 
 def test_multiple_client_on_server():
     assert extract_zones_from_status_file('tests/samples/multiple.ovpn-status-v1') \
         == {
-            'one.vpn.example.org': [IP('198.51.100.8')],
-            'two.vpn.example.org': [IP('198.51.100.12')],
-            'three.vpn.example.org': [IP('198.51.100.16')]
+            'one.vpn.example.org': [Address.parse('198.51.100.8')],
+            'two.vpn.example.org': [Address.parse('198.51.100.12')],
+            'three.vpn.example.org': [Address.parse('198.51.100.16')]
         }
 
 
 def test_subnet_for_client():
     assert extract_zones_from_status_file('tests/samples/subnet.ovpn-status-v1') \
-        == {'one.vpn.example.org': [IP('198.51.100.8')]}
+        == {'one.vpn.example.org': [Address.parse('198.51.100.8')]}
 
 
 def test_cached_route():
     assert extract_zones_from_status_file('tests/samples/cached-route.ovpn-status-v1') \
-        == {'one.vpn.example.org': [IP('198.51.100.8')]}
+        == {'one.vpn.example.org': [Address.parse('198.51.100.8')]}
+
+
+def test_status_version_2():
+    assert extract_zones_from_status_file('tests/samples/one.ovpn-status-v2') \
+        == {'one.vpn.example.org': [Address.parse('198.51.100.8')]}
+    assert extract_zones_from_status_file('tests/samples/multiple.ovpn-status-v2') \
+        == {
+            'one.vpn.example.org': [Address.parse('198.51.100.8'), Address.parse('fddc:abcd:1234::1008')],
+            'two.vpn.example.org': [Address.parse('198.51.100.12')],
+        }
+
+
+def test_status_version_3():
+    assert extract_zones_from_status_file('tests/samples/one.ovpn-status-v3') \
+        == {'one.vpn.example.org': [Address.parse('198.51.100.8')]}
+    assert extract_zones_from_status_file('tests/samples/multiple.ovpn-status-v3') \
+        == {
+            'one.vpn.example.org': [Address.parse('198.51.100.8'), Address.parse('fddc:abcd:1234::1008')],
+            'two.vpn.example.org': [Address.parse('198.51.100.12')],
+        }
+
+
+def test_detect_version():
+    for version in (1, 2, 3):
+        with open('tests/samples/one.ovpn-status-v{0}'.format(version), 'rb') as f:
+            assert detect_version(f.read()) == version
+    assert detect_version(b'') is None
+
+
+def test_status_version_switch(tmp_path):
+    path = tmp_path / 'status'
+    path.write_bytes(open('tests/samples/one.ovpn-status-v1', 'rb').read())
+    status = StatusFile(str(path))
+    status.update()
+    path.write_bytes(open('tests/samples/multiple.ovpn-status-v3', 'rb').read())
+    delta = status.update()
+    assert delta.added == {'two.vpn.example.org': [Address.parse('198.51.100.12')]}
+    assert delta.removed == {}
+    assert delta.changed == {
+        'one.vpn.example.org': [Address.parse('198.51.100.8'), Address.parse('fddc:abcd:1234::1008')]}
+    assert status.version == 3
+
+
+def test_incremental_first_pass_reports_all_clients(tmp_path):
+    path = tmp_path / 'status'
+    write_status(path, [('one', '198.51.100.8'), ('two', '198.51.100.12')])
+    status = StatusFile(str(path))
+    delta = status.update()
+    assert delta.added == {'one': [Address.parse('198.51.100.8')], 'two': [Address.parse('198.51.100.12')]}
+    assert delta.removed == {}
+    assert delta.changed == {}
+
+
+def test_incremental_unchanged_file(tmp_path):
+    path = tmp_path / 'status'
+    write_status(path, [('one', '198.51.100.8')])
+    status = StatusFile(str(path))
+    status.update()
+    assert not status.update()
+    assert status.clients == {'one': [Address.parse('198.51.100.8')]}
+
+
+def test_incremental_connect_disconnect_and_move(tmp_path):
+    path = tmp_path / 'status'
+    write_status(path, [('one', '198.51.100.8'), ('two', '198.51.100.12')])
+    status = StatusFile(str(path))
+    status.update()
+    write_status(path, [('two', '198.51.100.13'), ('three', '198.51.100.16')])
+    delta = status.update()
+    assert delta.added == {'three': [Address.parse('198.51.100.16')]}
+    assert delta.removed == {'one': [Address.parse('198.51.100.8')]}
+    assert delta.changed == {'two': [Address.parse('198.51.100.13')]}
+    assert status.clients == {
+        'two': [Address.parse('198.51.100.13')],
+        'three': [Address.parse('198.51.100.16')],
+    }
+
+
+def test_incremental_ignores_traffic_counters(tmp_path):
+    path = tmp_path / 'status'
+    write_status(path, [('one', '198.51.100.8')])
+    status = StatusFile(str(path))
+    status.update()
+    path.write_text(path.read_text().replace(',1,2,', ',100,200,')
+                    .replace('16:50:00', '16:51:00'))
+    assert not status.update()
+
+
+def test_incremental_unknown_client_resets_state(tmp_path):
+    path = tmp_path / 'status'
+    write_status(path, [('one', '198.51.100.8')])
+    status = StatusFile(str(path))
+    status.update()
+    path.write_text(path.read_text().replace(
+        'ROUTING TABLE\nVirtual Address,Common Name,Real Address,Last Ref\n',
+        'ROUTING TABLE\nVirtual Address,Common Name,Real Address,Last Ref\n'
+        '198.51.100.9,unknown,192.0.2.2:43156,Tue Jul  9 16:50:00 2013\n'))
+    with pytest.raises(ValueError):
+        status.update()
+    assert status.clients == {}
@@ -0,0 +1,78 @@
+# -*- coding: UTF-8 -*-
+import os
+import pstats
+import threading
+
+from twisted.internet import defer
+from twisted.internet import threads
+from twisted.internet.task import Clock
+
+from profiling import ProfileSession
+from tests.helpers import delta_handler, write_status
+
+
+def build_names(count):
+    return [str(i) for i in range(count)]
+
+
+def run_in_thread(session, callable, *args):
+    thread = threading.Thread(target=session.run, args=(callable, ) + args)
+    thread.start()
+    thread.join()
+
+
+def test_session_combines_thread_profiles(tmp_path, capsys):
+    session = ProfileSession(str(tmp_path), clock=Clock())
+    session.start()
+    run_in_thread(session, build_names, 100)
+    path = session.stop()
+    assert os.path.dirname(path) == str(tmp_path)
+    functions = {name for filename, line, name
+                 in pstats.Stats(path).stats}
+    assert 'build_names' in functions
+    assert 'build_names' in capsys.readouterr().out
+    assert session.stop() is None  # already stopped
+
+
+def test_session_stops_after_duration(tmp_path):
+    session = ProfileSession(str(tmp_path), duration=5, clock=Clock())
+    session.start()
+    session.clock.advance(5)
+    assert not session.active
+    assert len(os.listdir(str(tmp_path))) == 1
+
+
+def test_session_stops_after_reloads(tmp_path):
+    session = ProfileSession(str(tmp_path), reloads=2, clock=Clock())
+    session.start()
+    session.reload_done()
+    assert session.active
+    session.reload_done()
+    assert not session.active
+
+
+def test_inactive_session_does_not_profile(tmp_path):
+    session = ProfileSession(str(tmp_path), clock=Clock())
+    assert session.run(build_names, 2) == ['0', '1']
+    assert session.thread_profiles == []
+
+
+def test_profile_reloads(tmp_path, monkeypatch):
+    path, instance, handler = delta_handler(tmp_path, [('one', '198.51.100.8')])
+    monkeypatch.setattr(threads, 'deferToThread', defer.maybeDeferred)
+    stats = tmp_path / 'stats'
+    stats.mkdir()
+    handler.config.profile_directory = str(stats)
+    handler.config.profile_reloads = 1
+    session = handler.toggle_profiling()
+    write_status(path, [('two', '198.51.100.12')])
+    os.utime(str(path), (2000, 2000))
+    handler.reload_instance(instance)
+    assert not session.active
+    assert session.timer is None
+    profile, = os.listdir(str(stats))
+    functions = {name for filename, line, name
+                 in pstats.Stats(str(stats / profile)).stats}
+    assert 'prepare_instance' in functions
+    assert handler.toggle_profiling() is not None  # starts a new session
+    assert handler.toggle_profiling() is None
@@ -0,0 +1,126 @@
+# -*- coding: UTF-8 -*-
+from twisted.internet import defer
+from twisted.internet.task import Clock
+
+from scheduler import ReloadScheduler
+
+
+def make_scheduler(**options):
+    reloads = []
+
+    def reload(instance, reason):
+        reloads.append((scheduler.clock.seconds(), instance, reason))
+    scheduler = ReloadScheduler(reload, clock=Clock(), **options)
+    return scheduler, reloads
+
+
+def test_coalesce_burst():
+    scheduler, reloads = make_scheduler(min_delay=0.1, max_delay=2)
+    for i in range(5):
+        scheduler.changed('a', 'modify')
+        scheduler.clock.advance(0.01)
+        assert len(scheduler.clock.getDelayedCalls()) == 1
+    scheduler.clock.advance(1)
+    assert len(reloads) == 1
+    assert reloads[0][1:] == ('a', 'modify')
+
+
+def test_window_adapts_to_write_gaps():
+    scheduler, reloads = make_scheduler(min_delay=0.125, max_delay=10)
+    state = scheduler.states['a']
+    assert scheduler.window(state) == 0.125
+    for i in range(10):
+        scheduler.changed('a')
+        scheduler.clock.advance(0.25)
+    # only the first change (gap unknown) was reloaded immediately
+    assert [time for time, instance, reason in reloads] == [0.25]
+    assert scheduler.window(state) == 0.5
+    scheduler.clock.advance(0.25)
+    assert [time for time, instance, reason in reloads] == [0.25, 2.75]
+
+
+def test_window_bounds():
+    scheduler, reloads = make_scheduler(min_delay=0.5, max_delay=2)
+    state = scheduler.states['a']
+    state.gap = 0.001
+    assert scheduler.window(state) == 0.5
+    state.gap = 10
+    assert scheduler.window(state) == 2
+
+
+def test_continuous_changes_reload_after_max_delay():
+    scheduler, reloads = make_scheduler(min_delay=0.5, max_delay=2)
+    for i in range(30):
+        scheduler.changed('a')
+        scheduler.clock.advance(0.25)
+    assert [time for time, instance, reason in reloads] == [2.0, 4.0, 6.0]
+    assert len(scheduler.clock.getDelayedCalls()) == 1
+
+
+def test_instances_are_independent():
+    scheduler, reloads = make_scheduler(min_delay=0.1)
+    scheduler.changed('a')
+    scheduler.changed('b')
+    scheduler.clock.advance(0.1)
+    assert sorted(instance for time, instance, reason in reloads) == ['a', 'b']
+
+
+def test_concurrent_reload_limit():
+    pending = {}
+
+    def reload(instance, reason):
+        pending[instance] = defer.Deferred()
+        return pending[instance]
+    scheduler = ReloadScheduler(reload, min_delay=0.1, max_concurrent=2,
+                                clock=Clock())
+    for instance in 'abc':
+        scheduler.changed(instance)
+    scheduler.clock.advance(0.1)
+    assert sorted(pending) == ['a', 'b']
+    assert scheduler.running == 2
+    # a changes again while reloading - runs after the reload and c:
+    scheduler.changed('a')
+    scheduler.clock.advance(1)
+    pending.pop('a').callback(None)
+    assert sorted(pending) == ['b', 'c']
+    pending.pop('b').callback(None)
+    assert sorted(pending) == ['a', 'c']
+    pending.pop('a').callback(None)
+    pending.pop('c').callback(None)
+    assert scheduler.running == 0
+    assert scheduler.reloads == 4
+    assert list(scheduler.queue) == []
+
+
+def test_failed_reload_releases_slot():
+    def reload(instance, reason):
+        raise ValueError('broken status file')
+    scheduler = ReloadScheduler(reload, min_delay=0.1, max_concurrent=1,
+                                clock=Clock())
+    scheduler.changed('a')
+    scheduler.changed('b')
+    scheduler.clock.advance(0.1)
+    assert scheduler.reloads == 2
+    assert scheduler.running == 0
+
+
+def test_forget_instance():
+    pending = {}
+
+    def reload(instance, reason):
+        pending[instance] = defer.Deferred()
+        return pending[instance]
+    scheduler = ReloadScheduler(reload, min_delay=0.1, max_concurrent=1,
+                                clock=Clock())
+    for instance in 'abc':
+        scheduler.changed(instance)
+    scheduler.clock.advance(0.1)
+    assert list(scheduler.queue) == ['b', 'c']
+    scheduler.forget('b')  # queued
+    scheduler.forget('a')  # running
+    scheduler.changed('d')
+    scheduler.forget('d')  # pending timer
+    assert not scheduler.clock.getDelayedCalls()
+    pending.pop('a').callback(None)
+    assert sorted(pending) == ['c']
+    assert set(scheduler.states) == {'c'}
@@ -0,0 +1,141 @@
+# -*- coding: UTF-8 -*-
+from twisted.names import dns
+import pytest
+
+from openvpnzone import InMemoryAuthority, ZoneRecords
+from snapshot import encode_snapshot, write_snapshot, Snapshot, \
+    SnapshotAuthority, SnapshotRecords, HEADER, MAGIC
+from tests.helpers import make_soa
+
+
+def records():
+    soa = make_soa(7)
+    return ZoneRecords({
+        b'vpn.example.org': [soa, dns.Record_NS(b'dns.example.org'),
+                             dns.Record_MX(10, b'mail.example.org', ttl=60)],
+        b'one.vpn.example.org': [dns.Record_A('10.0.0.1'),
+                                 dns.Record_AAAA('fd00::1')],
+        b'www.vpn.example.org': [dns.Record_CNAME(b'one.vpn.example.org')],
+        b'txt.vpn.example.org': [dns.Record_TXT(b'a', b'b c')],
+        b'empty.vpn.example.org': [],
+    })
+
+
+def test_round_trip():
+    data = records()
+    snapshot = Snapshot(encode_snapshot(b'vpn.example.org', data))
+    assert snapshot.zone == b'vpn.example.org'
+    assert len(snapshot) == 4  # names without records are skipped
+    loaded = SnapshotRecords(snapshot)
+    assert sorted(loaded) == sorted(name for name in data if data[name])
+    for name in loaded:
+        assert loaded[name] == data[name]
+        assert [r.ttl for r in loaded[name]] == [r.ttl for r in data[name]]
+
+
+def test_lookup():
+    snapshot = Snapshot(encode_snapshot(b'vpn.example.org', records()))
+    assert snapshot.find(b'ONE.vpn.example.org') == snapshot.find(
+        b'one.vpn.example.org') >= 0
+    assert snapshot.find(b'two.vpn.example.org') == -1
+    assert snapshot.find(b'a') == -1
+    assert snapshot.find(b'zzz') == -1
+    assert snapshot.lookup(b'one.vpn.example.org') == [
+        (dns.A, None, bytes([10, 0, 0, 1])),
+        (dns.AAAA, None, b'\xfd' + b'\x00' * 14 + b'\x01')]
+    assert snapshot.lookup(b'unknown.vpn.example.org') == []
+    assert b'www.vpn.example.org' in SnapshotRecords(snapshot)
+    with pytest.raises(KeyError):
+        SnapshotRecords(snapshot)[b'unknown.vpn.example.org']
+
+
+def test_mapped_file(tmp_path):
+    path = str(tmp_path / 'zone.snapshot')
+    write_snapshot(path, b'vpn.example.org', records())
+    snapshot = Snapshot.open(path)
+    assert SnapshotRecords(snapshot)[b'one.vpn.example.org'] \
+        == records()[b'one.vpn.example.org']
+    # replacing the file does not affect the mapped version:
+    write_snapshot(path, b'vpn.example.org', {b'vpn.example.org': [make_soa(8)]})
+    assert len(snapshot) == 4
+    assert len(Snapshot.open(path)) == 1
+    assert [p.name for p in tmp_path.iterdir()] == ['zone.snapshot']
+
+
+def test_invalid_snapshot():
+    with pytest.raises(ValueError):
+        Snapshot(b'')
+    with pytest.raises(ValueError):
+        Snapshot(b'X' * 32)
+    with pytest.raises(ValueError):
+        Snapshot(HEADER.pack(MAGIC, 99, 0, 0, 0))
+
+
+def answers(authority, name, type):
+    result = authority.query(dns.Query(name, type, dns.IN)).result
+    return [[(rr.name.name, rr.type, rr.ttl, rr.payload) for rr in section]
+            for section in result]
+
+
+@pytest.mark.parametrize('name,type', [
+    (b'vpn.example.org', dns.SOA),
+    (b'vpn.example.org', dns.MX),
+    (b'One.vpn.example.org', dns.A),
+    (b'one.vpn.example.org', dns.ALL_RECORDS),
+    (b'www.vpn.example.org', dns.A),
+    (b'txt.vpn.example.org', dns.A),
+])
+def test_authority_matches_in_memory_authority(name, type):
+    data = records()
+    memory = InMemoryAuthority()
+    memory.setData((b'vpn.example.org', data[b'vpn.example.org'][0]), data)
+    snapshot = SnapshotAuthority(Snapshot(encode_snapshot(b'vpn.example.org',
+                                                          data)))
+    assert answers(snapshot, name, type) == answers(memory, name, type)
+
+
+def test_authority_unknown_name():
+    authority = SnapshotAuthority(Snapshot(encode_snapshot(b'vpn.example.org',
+                                                           records())))
+    d = authority.query(dns.Query(b'two.vpn.example.org', dns.A, dns.IN))
+    assert d.result.check(dns.AuthoritativeDomainError)
+    d.addErrback(lambda failure: None)
+
+
+def test_authority_negative_lookups():
+    data = records()
+    data[b'a.sub.vpn.example.org'] = [dns.Record_A('10.0.0.2')]
+    authority = SnapshotAuthority(Snapshot(encode_snapshot(b'vpn.example.org',
+                                                           data)))
+    assert authority.lookupNegative(b'one.vpn.example.org') is None
+    assert authority.lookupNegative(b'example.com') is None
+    assert authority.lookupNegative(b'Sub.vpn.example.org') == dns.OK
+    assert authority.lookupNegative(b'b.sub.vpn.example.org') == dns.ENAME
+    assert authority.lookupNegative(b'empty.vpn.example.org') == dns.ENAME
+
+
+def test_authority_zone_transfers():
+    authority = SnapshotAuthority(Snapshot(encode_snapshot(b'vpn.example.org',
+                                                           records())))
+    up_to_date = authority.lookupIncrementalZone(b'vpn.example.org', 7).result
+    assert [rr.type for rr in up_to_date[0]] == [dns.SOA]
+    transfer = authority.lookupIncrementalZone(b'vpn.example.org', 6).result
+    assert [rr.type for rr in transfer[0]].count(dns.SOA) == 2
+    assert len(transfer[0]) == 8
+
+
+def test_authority_requires_soa():
+    with pytest.raises(ValueError):
+        SnapshotAuthority(Snapshot(encode_snapshot(
+            b'vpn.example.org', {b'one.vpn.example.org': [
+                dns.Record_A('10.0.0.1')]})))
+
+
+def test_set_snapshot_clears_answer_cache():
+    authority = SnapshotAuthority(Snapshot(encode_snapshot(b'vpn.example.org',
+                                                           records())))
+    authority.answer_cache.put('key', object(), authority.answer_cache.generation)
+    authority.setSnapshot(Snapshot(encode_snapshot(
+        b'vpn.example.org', {b'vpn.example.org': [make_soa(8)]})))
+    assert authority.answer_cache.entries == {}
+    assert authority.soa[1].serial == 8
@@ -0,0 +1,185 @@
+# -*- coding: UTF-8 -*-
+import os.path
+import socket
+import struct
+import subprocess
+import sys
+
+from twisted.internet import defer
+from twisted.internet import threads
+from twisted.internet.task import Clock
+from twisted.names import dns
+from twisted.python.failure import Failure
+
+from dnsserver import OpenVpnDNSServerFactory
+from openvpnzone import InMemoryAuthority
+from snapshot import Snapshot
+from tests.helpers import zone
+from workers import (create_reuseport_socket, encode_zone, WorkerPool,
+                     ZoneReceiver)
+import workers
+
+
+def authority(serial, **names):
+    a = InMemoryAuthority()
+    a.setData(*zone(serial, **names))
+    return a
+
+
+def test_reuseport_sockets_share_port():
+    first = create_reuseport_socket('127.0.0.1', 0)
+    second = create_reuseport_socket('127.0.0.1', first.getsockname()[1])
+    assert first.getsockname() == second.getsockname()
+    first.close()
+    second.close()
+
+
+def test_zone_receiver_adds_and_updates_zones():
+    factory = OpenVpnDNSServerFactory()
+    authorities = factory.resolver.resolvers
+    receiver = ZoneReceiver(factory)
+    receiver.stringReceived(encode_zone(authority(1, one='127.0.0.1')))
+    assert len(authorities) == 1
+    assert factory.authorityFor(b'vpn.example.org') is authorities[0]
+    receiver.stringReceived(encode_zone(authority(2, two='127.0.0.2')))
+    assert len(authorities) == 1
+    assert authorities[0].soa[1].serial == 2
+    assert set(authorities[0].records) == {b'vpn.example.org',
+                                           b'two.vpn.example.org'}
+
+
+def test_worker_process_answers_queries():
+    sock = create_reuseport_socket('127.0.0.1', 0)
+    worker = subprocess.Popen(
+        [sys.executable, os.path.abspath(workers.__file__), '1232',
+         '{0}:{1}'.format(sock.fileno(), int(sock.family))],
+        stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+        pass_fds=(sock.fileno(),))
+    try:
+        data = encode_zone(authority(1, one='127.0.0.1'))
+        worker.stdin.write(struct.pack('!I', len(data)) + data)
+        worker.stdin.write(struct.pack('!I', 0))  # initial zones complete
+        worker.stdin.flush()
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client.settimeout(10)
+        query = dns.Message(id=7, recDes=True)
+        query.queries = [dns.Query(b'one.vpn.example.org', dns.A, dns.IN)]
+        client.sendto(query.toStr(), sock.getsockname())
+        message = dns.Message()
+        message.fromStr(client.recv(512))
+        assert message.id == 7
+        assert [rr.payload.dottedQuad() for rr in message.answers] \
+            == ['127.0.0.1']
+        client.close()
+    finally:
+        worker.stdin.close()  # EOF stops the worker
+        assert worker.wait(10) == 0
+        sock.close()
+
+
+def test_zone_receiver_ready():
+    calls = []
+    receiver = ZoneReceiver(OpenVpnDNSServerFactory(), lambda: calls.append(1))
+    receiver.stringReceived(encode_zone(authority(1, one='127.0.0.1')))
+    assert calls == []
+    receiver.stringReceived(b'')
+    receiver.stringReceived(b'')
+    assert calls == [1]
+
+
+class FakeWorkerTransport(object):
+    stdin_closed = False
+
+    def closeStdin(self):
+        self.stdin_closed = True
+
+
+class FakeWorker(object):
+    def __init__(self, slot=0, spawn=0):
+        self.slot = slot
+        self.spawn = spawn
+        self.transport = FakeWorkerTransport()
+        self.zones = []
+
+    def sendZone(self, data):
+        self.zones.append(data)
+
+
+def test_workers_restarted_for_removed_zones(monkeypatch):
+    monkeypatch.setattr(threads, 'deferToThread', defer.maybeDeferred)
+    first = authority(1, one='127.0.0.1')
+    pool = WorkerPool([first], [], 1)
+    pool.workers = [FakeWorker()]
+    pool.zoneChanged(first)
+    second = authority(1, two='127.0.0.2')
+    second.soa = (b'other.example.org', second.soa[1])
+    pool.zoneChanged(second)
+    pool.zonesChanged([first, second])  # only added
+    assert not pool.workers[0].transport.stdin_closed
+    pool.zonesChanged([second])
+    assert pool.workers[0].transport.stdin_closed
+    assert pool.zone_names == {b'other.example.org'}
+
+
+def test_zone_changes_encoded_in_threads(monkeypatch):
+    encodings = []
+
+    def deferToThread(function, *args):
+        encodings.append((defer.Deferred(), function(*args)))
+        return encodings[-1][0]
+    monkeypatch.setattr(threads, 'deferToThread', deferToThread)
+    first = authority(1, one='127.0.0.1')
+    pool = WorkerPool([first], [], 2)
+    pool.workers = [FakeWorker(0, spawn=1), None]
+    pool.spawns = 1
+    pool.zoneChanged(first)
+    assert len(encodings) == 1 and pool.workers[0].zones == []
+    # changes during the encoding are coalesced:
+    first.setData(*zone(2, two='127.0.0.2'))
+    pool.zoneChanged(first)
+    first.setData(*zone(3, three='127.0.0.3'))
+    pool.zoneChanged(first)
+    assert len(encodings) == 1
+    # a worker spawned meanwhile got the current version at its start:
+    pool.workers[1] = FakeWorker(1, spawn=2)
+    pool.spawns = 2
+    d, data = encodings[0]
+    d.callback(data)
+    assert pool.workers[0].zones == [data]
+    assert pool.workers[1].zones == []
+    assert len(encodings) == 2
+    d, data = encodings[1]
+    d.callback(data)
+    assert [Snapshot(data).find(b'three.vpn.example.org') >= 0
+            for data in pool.workers[1].zones] == [True]
+    assert len(pool.workers[0].zones) == 2
+    assert not pool.encoding and not pool.waiting
+
+
+def test_crashed_workers_respawned_with_backoff(monkeypatch):
+    clock = Clock()
+    pool = WorkerPool([], [], 1, clock=clock)
+    pool.running = True
+    spawned = []
+
+    def spawn(slot):
+        spawned.append(clock.seconds())
+        pool.respawns[slot] = None
+        pool.spawned[slot] = clock.seconds()
+        pool.workers[slot] = FakeWorker(slot)
+    monkeypatch.setattr(pool, 'spawnWorker', spawn)
+    spawn(0)
+    for i in range(4):
+        pool.workerEnded(pool.workers[0], Failure(Exception('crash')))
+        clock.advance(pool.respawns[0].getTime() - clock.seconds())
+    assert spawned == [0, 0.5, 1.5, 3.5, 7.5]
+    # a worker running stable for a while starts over:
+    clock.advance(60)
+    pool.workerEnded(pool.workers[0], Failure(Exception('crash')))
+    assert pool.respawns[0].getTime() - clock.seconds() == 0.5
+    # restarts for removed zones are immediate:
+    clock.advance(0.5)
+    pool.zone_names = {b'vpn.example.org'}
+    pool.zonesChanged([])
+    pool.workerEnded(pool.workers[0], Failure(Exception('stdin closed')))
+    assert spawned[-1] == clock.seconds() and pool.respawns[0] is None
@@ -0,0 +1,312 @@
+import os
+import sys
+import socket
+import struct
+
+from twisted.application import service
+from twisted.internet import protocol
+from twisted.internet import stdio
+from twisted.internet import threads
+from twisted.names import dns
+from twisted.protocols import basic
+from twisted.python import log
+
+from dnsserver import DEFAULT_UDP_PAYLOAD_SIZE, OpenVpnDNSServerFactory
+from snapshot import encode_snapshot, Snapshot, SnapshotAuthority
+
+
+# first file descriptor of the passed listen sockets in the worker processes
+FIRST_SOCKET_FD = 3
+
+
+def create_reuseport_socket(address, port):
+    """ Creates a bound, non-blocking UDP socket with SO_REUSEPORT: every
+        worker gets its own socket for every listen address and the kernel
+        distributes the incoming queries between them.
+
+        :param str address: listen address
+        :param int port: listen port"""
+    family = socket.AF_INET6 if ':' in address else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((address, port))
+    except Exception:
+        sock.close()
+        raise
+    sock.setblocking(False)
+    return sock
+
+
+def encode_zone(authority):
+    """ Encodes the current zone version of an authority as snapshot for
+        the workers"""
+    return encode_snapshot(authority.soa[0], authority.records)
+
+
+class ZoneReceiver(basic.Int32StringReceiver):
+    """ Receives the zone snapshots from the parent process (via stdin) and
+        serves them from the authorities of the worker factory. An empty
+        message marks the end of the initial zones.
+
+        :param OpenVpnDNSServerFactory factory: factory of the worker
+        :param callable ready: called once all initial zones are received"""
+    MAX_LENGTH = 2**31 - 1
+
+    def __init__(self, factory, ready=None):
+        self.factory = factory
+        self.ready = ready
+
+    def stringReceived(self, data):
+        if not data:
+            ready, self.ready = self.ready, None
+            if ready is not None:
+                ready()
+            return
+        snapshot = Snapshot(data)
+        authority = self.factory.authorityFor(snapshot.zone)
+        if authority is None:
+            authority = SnapshotAuthority(snapshot)
+            self.factory.resolver.resolvers.append(authority)
+            self.factory.zones = None  # rebuild zone lookup
+        else:
+            authority.setSnapshot(snapshot)
+        print('updated zone {0} to serial {1}'.format(snapshot.zone,
+                                                      authority.soa[1].serial))
+
+    def connectionLost(self, reason):
+        # the parent process is gone (or stops us)
+        from twisted.internet import reactor
+        if reactor.running:
+            reactor.stop()
+
+
+def run_worker(sockets, udp_payload_size=DEFAULT_UDP_PAYLOAD_SIZE):
+    """ Main function of a worker process: serves the passed UDP sockets
+        with the zones received via stdin. The sockets are only read after
+        the initial zones are received, queries wait in the socket buffers
+        until then.
+
+        :param list sockets: list of (file descriptor, address family)
+            tuples
+        :param int udp_payload_size: UDP payload size advertised to EDNS0
+            clients (0 disables EDNS0)"""
+    from twisted.internet import reactor
+    log.startLogging(sys.stdout, setStdout=False)
+    # not verbose: the parent would have to relay a log line per query
+    factory = OpenVpnDNSServerFactory(None, None, None, 0)
+    factory.noisy = 0
+    factory.udp_payload_size = udp_payload_size or None
+
+    def listen():
+        for fd, family in sockets:
+            reactor.adoptDatagramPort(fd, family,
+                                      dns.DNSDatagramProtocol(factory))
+    stdio.StandardIO(ZoneReceiver(factory, listen))
+    reactor.run()
+
+
+class WorkerProcessProtocol(protocol.ProcessProtocol):
+    """ Parent side of one worker process: writes the zone versions to the
+        stdin of the worker and logs its output.
+
+        :param WorkerPool pool: pool of the worker
+        :param int slot: index of the worker (and its sockets) in the pool"""
+    def __init__(self, pool, slot):
+        self.pool = pool
+        self.slot = slot
+        self.buffer = b''
+
+    def connectionMade(self):
+        for authority in self.pool.zones:
+            if authority.soa is not None:
+                self.pool.zone_names.add(authority.soa[0].lower())
+                self.sendZone(encode_zone(authority))
+        self.sendZone(b'')  # initial zones complete
+
+    def sendZone(self, data):
+        self.transport.writeToChild(0, struct.pack('!I', len(data)) + data)
+
+    def outReceived(self, data):
+        lines = (self.buffer + data).split(b'\n')
+        self.buffer = lines.pop()
+        for line in lines:
+            print('worker {0}: {1}'.format(self.transport.pid,
+                                           line.decode('utf-8', 'replace')))
+
+    errReceived = outReceived
+
+    def processEnded(self, reason):
+        self.pool.workerEnded(self, reason)
+
+
+class WorkerPool(service.Service):
+    """ Forks worker processes that answer the UDP queries. Every worker
+        binds its own SO_REUSEPORT socket per listen address; the sockets
+        are created before the privileges are dropped. The parent keeps
+        watching the status files, building the zones and serving TCP - new
+        zone versions are pushed to all workers.
+
+        :param openvpnzone.OpenVpnAuthorityHandler zones: zones of the parent
+        :param list listen_addresses: list of (address, port) tuples
+        :param int count: number of worker processes
+        :param int udp_payload_size: UDP payload size advertised to EDNS0
+            clients (0 disables EDNS0, None for the default)
+        :param clock: reactor for the respawn timers"""
+    # delay before a crashed worker is respawned, doubled for every crash
+    # of a worker that ran shorter than MAX_RESPAWN_DELAY:
+    RESPAWN_DELAY = 0.5
+    MAX_RESPAWN_DELAY = 30
+
+    def __init__(self, zones, listen_addresses, count, udp_payload_size=None,
+                 clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.zones = zones
+        self.listen_addresses = listen_addresses
+        self.count = count
+        self.udp_payload_size = DEFAULT_UDP_PAYLOAD_SIZE \
+            if udp_payload_size is None else udp_payload_size
+        self.sockets = []
+        self.workers = [None] * count
+        # per slot: spawn time, next respawn delay and pending respawn:
+        self.spawned = [None] * count
+        self.delays = [self.RESPAWN_DELAY] * count
+        self.respawns = [None] * count
+        # slots whose workers were stopped to be restarted right away:
+        self.restarting = set()
+        # names of the zones pushed to the workers:
+        self.zone_names = set()
+        # names of the zones being encoded, changed zones waiting for the
+        # running encoding of their previous version:
+        self.encoding = set()
+        self.waiting = {}
+        # number of spawned workers (workers know the zones spawned before
+        # their spawn):
+        self.spawns = 0
+
+    def privilegedStartService(self):
+        self.sockets = [[create_reuseport_socket(address, port)
+                         for address, port in self.listen_addresses]
+                        for slot in range(self.count)]
+        service.Service.privilegedStartService(self)
+
+    def startService(self):
+        service.Service.startService(self)
+        self.zones.listeners.append(self.zoneChanged)
+        self.zones.zone_set_listeners.append(self.zonesChanged)
+        for slot in range(self.count):
+            self.spawnWorker(slot)
+
+    def stopService(self):
+        service.Service.stopService(self)
+        self.zones.listeners.remove(self.zoneChanged)
+        self.zones.zone_set_listeners.remove(self.zonesChanged)
+        for slot, respawn in enumerate(self.respawns):
+            if respawn is not None and respawn.active():
+                respawn.cancel()
+            self.respawns[slot] = None
+        for worker in self.workers:
+            if worker is not None:
+                worker.transport.closeStdin()  # worker stops on EOF
+        for sockets in self.sockets:
+            for sock in sockets:
+                sock.close()
+        self.sockets = []
+
+    def spawnWorker(self, slot):
+        from twisted.internet import reactor
+        self.respawns[slot] = None
+        self.spawned[slot] = self.clock.seconds()
+        childFDs = {0: 'w', 1: 'r', 2: 'r'}
+        args = [sys.executable, os.path.abspath(__file__),
+                str(self.udp_payload_size)]
+        for fd, sock in enumerate(self.sockets[slot], FIRST_SOCKET_FD):
+            childFDs[fd] = sock.fileno()
+            args.append('{0}:{1}'.format(fd, int(sock.family)))
+        worker = WorkerProcessProtocol(self, slot)
+        self.spawns += 1
+        worker.spawn = self.spawns
+        self.workers[slot] = worker
+        reactor.spawnProcess(worker, sys.executable, args, env=os.environ,
+                             childFDs=childFDs)
+
+    def workerEnded(self, worker, reason):
+        if self.workers[worker.slot] is not worker:
+            return
+        slot = worker.slot
+        self.workers[slot] = None
+        if not self.running:
+            return
+        if slot in self.restarting:
+            self.restarting.discard(slot)
+            print('worker {0} ended, restarting'.format(slot))
+            self.spawnWorker(slot)
+            return
+        # back off if the worker crashes repeatedly:
+        if self.clock.seconds() - self.spawned[slot] >= self.MAX_RESPAWN_DELAY:
+            self.delays[slot] = self.RESPAWN_DELAY
+        delay = self.delays[slot]
+        self.delays[slot] = min(2 * delay, self.MAX_RESPAWN_DELAY)
+        print('worker {0} ended ({1}), restarting in {2:g}s'.format(
+              slot, reason.value, delay))
+        self.respawns[slot] = self.clock.callLater(delay, self.spawnWorker,
+                                                   slot)
+
+    def zoneChanged(self, authority):
+        """ Listener for :class:`openvpnzone.OpenVpnAuthorityHandler`: pushes
+            the new zone version to all running workers. The zone is encoded
+            in a thread (from a copy of the records); versions changed while
+            the previous one is encoded are coalesced."""
+        name = authority.soa[0].lower()
+        self.zone_names.add(name)
+        if name in self.encoding:
+            self.waiting[name] = authority
+            return
+        self.encodeZone(name, authority)
+
+    def encodeZone(self, name, authority):
+        self.encoding.add(name)
+        spawns = self.spawns
+        d = threads.deferToThread(encode_snapshot, authority.soa[0],
+                                  authority.records.copy())
+        d.addCallback(self.sendZone, spawns)
+        d.addErrback(log.err, 'encoding zone {0} failed'.format(name))
+        d.addBoth(self.zoneEncoded, name)
+
+    def sendZone(self, data, spawns):
+        """ Sends an encoded zone version to the workers spawned before its
+            encoding started (later ones got a newer version at start)"""
+        for worker in self.workers:
+            if worker is not None and worker.transport is not None \
+                    and worker.spawn <= spawns:
+                worker.sendZone(data)
+
+    def zoneEncoded(self, ignored, name):
+        self.encoding.discard(name)
+        authority = self.waiting.pop(name, None)
+        if authority is not None:
+            self.encodeZone(name, authority)
+
+    def zonesChanged(self, zones):
+        """ Listener for zones added or removed by a configuration reload:
+            the workers are restarted (with the current zones) if zones were
+            removed - added zones are pushed by :meth:`zoneChanged`"""
+        current = {authority.soa[0].lower() for authority in zones
+                   if authority.soa is not None}
+        removed = self.zone_names - current
+        self.zone_names = current
+        if not removed:
+            return
+        print('restarting workers to stop serving {0}'.format(
+              ', '.join(sorted(name.decode('utf-8') for name in removed))))
+        for worker in self.workers:
+            if worker is not None and worker.transport is not None:
+                self.restarting.add(worker.slot)
+                worker.transport.closeStdin()  # respawned by workerEnded
+
+
+if __name__ == '__main__':
+    run_worker([tuple(map(int, arg.split(':'))) for arg in sys.argv[2:]],
+               int(sys.argv[1]))
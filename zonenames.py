@@ -0,0 +1,29 @@
+import bisect
+
+
+class NameIndex(object):
+    """ Sorted index of owner names to find names below a given name by a
+        binary search: the names are sorted by their reversed byte string,
+        so all names of a subtree are neighbours.
+
+        :param names: lowercase owner names"""
+    def __init__(self, names):
+        self.keys = sorted(name[::-1] for name in names)
+
+    def has_descendants(self, name):
+        """ Whether there are names below the (lowercase) name"""
+        prefix = name[::-1] + b'.'
+        position = bisect.bisect_left(self.keys, prefix)
+        return position < len(self.keys) and \
+            self.keys[position].startswith(prefix)
+
+
+def is_subdomain(name, zone_name):
+    """ Whether the lowercase name is zone_name or below it"""
+    zone_name = zone_name.lower()
+    return name == zone_name or name.endswith(b'.' + zone_name)
+
+
+def serial_newer(serial, reference):
+    """ Whether serial is newer than reference (RFC 1982 serial arithmetic)"""
+    return 0 < (serial - reference) % 2**32 < 2**31